@@ -0,0 +1,35 @@
+"""migration14
+
+Revision ID: a7c3e9b2d614
+Revises: f3b8d51e6a27
+Create Date: 2026-10-18 18:02:11.947305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e9b2d614'
+down_revision: Union[str, Sequence[str], None] = 'f3b8d51e6a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # История заполняется отдельно: python script/backfill_daily_stats.py
+    op.create_table('daily_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('metric', sa.String(length=50), nullable=False),
+    sa.Column('dimension', sa.String(length=50), server_default='', nullable=False),
+    sa.Column('value', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('day', 'metric', 'dimension')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('daily_stats')
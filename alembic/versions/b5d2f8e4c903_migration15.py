@@ -0,0 +1,34 @@
+"""migration15
+
+Revision ID: b5d2f8e4c903
+Revises: a7c3e9b2d614
+Create Date: 2026-10-18 19:12:40.518726
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d2f8e4c903'
+down_revision: Union[str, Sequence[str], None] = 'a7c3e9b2d614'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('subscriptions', sa.Column('removed_at', sa.DateTime(), nullable=True))
+    # Уже истекшие подписки считаем обработанными, чтобы не рассылать старые уведомления
+    op.execute("UPDATE subscriptions SET removed_at = coalesce(updated_at, now()) WHERE status = 'expired'")
+    op.create_index('ix_subscription_expired_not_removed', 'subscriptions', ['id'], unique=False,
+                    postgresql_where=sa.text("status = 'expired' AND removed_at IS NULL"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_subscription_expired_not_removed', table_name='subscriptions',
+                  postgresql_where=sa.text("status = 'expired' AND removed_at IS NULL"))
+    op.drop_column('subscriptions', 'removed_at')
@@ -0,0 +1,32 @@
+"""migration10
+
+Revision ID: c81f2b6d93e5
+Revises: a52e8f04c7d3
+Create Date: 2026-10-18 13:02:17.904116
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81f2b6d93e5'
+down_revision: Union[str, Sequence[str], None] = 'a52e8f04c7d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('job_runs',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('last_run_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('job_runs')
@@ -0,0 +1,35 @@
+"""migration11
+
+Revision ID: d4e7a1c2b958
+Revises: c81f2b6d93e5
+Create Date: 2026-10-18 14:11:42.518307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4e7a1c2b958'
+down_revision: Union[str, Sequence[str], None] = 'c81f2b6d93e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('fsm_states',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('state', sa.String(length=255), nullable=True),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), server_default='{}', nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('fsm_states')
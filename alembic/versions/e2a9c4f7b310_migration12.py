@@ -0,0 +1,62 @@
+"""migration12
+
+Revision ID: e2a9c4f7b310
+Revises: d4e7a1c2b958
+Create Date: 2026-10-18 16:05:27.310842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9c4f7b310'
+down_revision: Union[str, Sequence[str], None] = 'd4e7a1c2b958'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (имя, колонки, условие частичного индекса)
+SUBSCRIPTION_INDEXES = [
+    ('ix_subscription_user_created', ['user_id', 'created_at'], None),
+    ('ix_subscription_active_user', ['user_id', 'end_date'], "status = 'active'"),
+    ('ix_subscription_active_end_date', ['end_date'], "status = 'active'"),
+    ('ix_subscription_renew_next_payment', ['next_payment_date'], "auto_renew"),
+    ('ix_subscription_created_id', ['created_at', 'id'], None),
+]
+
+# Дубли: telegram_id/username уже проиндексированы ix_users_*, payment_id — уникальным
+# ограничением, webhook_events.id — первичным ключом; status заменен частичными индексами
+# (имя, таблица, колонки — для downgrade)
+REDUNDANT_INDEXES = [
+    ('ix_user_telegram_id', 'users', ['telegram_id']),
+    ('ix_user_username', 'users', ['username']),
+    ('ix_webhook_events_id', 'webhook_events', ['id']),
+    ('ix_subscription_payment_id', 'subscriptions', ['payment_id']),
+    ('ix_subscription_status', 'subscriptions', ['status']),
+    ('ix_subscription_user_id', 'subscriptions', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует записи в subscriptions на время построения,
+    # но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, columns, where in SUBSCRIPTION_INDEXES:
+            op.create_index(name, 'subscriptions', columns, unique=False,
+                            postgresql_where=sa.text(where) if where else None,
+                            postgresql_concurrently=True)
+        for name, table, _ in REDUNDANT_INDEXES:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns in REDUNDANT_INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+        for name, _, _ in reversed(SUBSCRIPTION_INDEXES):
+            op.drop_index(name, table_name='subscriptions', postgresql_concurrently=True)
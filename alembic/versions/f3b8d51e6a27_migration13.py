@@ -0,0 +1,50 @@
+"""migration13
+
+Revision ID: f3b8d51e6a27
+Revises: e2a9c4f7b310
+Create Date: 2026-10-18 17:21:48.604153
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d51e6a27'
+down_revision: Union[str, Sequence[str], None] = 'e2a9c4f7b310'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('entitlements',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('subscription_id', sa.Integer(), nullable=True),
+    sa.Column('plan_type', sa.String(length=50), nullable=False),
+    sa.Column('plan_name', sa.String(length=100), nullable=False),
+    sa.Column('active_until', sa.DateTime(), nullable=False),
+    sa.Column('auto_renew', sa.Boolean(), nullable=False),
+    sa.Column('payment_method', sa.String(length=50), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['subscription_id'], ['subscriptions.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Заполняем по текущим подпискам: то же правило, что database/entitlements.refresh_entitlements
+    op.execute("""
+        INSERT INTO entitlements (user_id, subscription_id, plan_type, plan_name, active_until,
+                                  auto_renew, payment_method)
+        SELECT DISTINCT ON (user_id)
+               user_id, id, plan_type, plan_name, end_date, COALESCE(auto_renew, false), payment_method
+        FROM subscriptions
+        WHERE status = 'active' AND end_date IS NOT NULL
+        ORDER BY user_id, end_date DESC, created_at DESC
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('entitlements')
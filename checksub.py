@@ -1,19 +1,23 @@
 import logging
 from datetime import datetime, timedelta
-from logging.handlers import RotatingFileHandler
 
-from sqlalchemy import select, text
+from sqlalchemy import select, update
 from sqlalchemy.orm import joinedload
 import asyncio
 
-from config import ADMIN_IDS, USERNAME_CHANNEL
+from config import ADMIN_IDS, USERNAME_CHANNEL, EXPIRY_BATCH_SIZE
+from database import daily_stats
+from database.entitlements import active_entitlements_count_query, refresh_entitlements
 from database.models import Subscription, User
+from database.subscriptions import expired_subscription_ids_query, expiring_reminders_query, unremoved_expired_query
 from database.session import AsyncSessionLocal
 
-from helpers import notify_admins, get_admin_ids
+from helpers import notify_admins, get_admin_ids, format_daily_stats, sum_daily_stats, DAILY_STATS_LEGEND
 from log.logger import get_logger
-from log.logging_config import setup_logging
+from log.logging_config import setup_logging, add_log_file
 from config import bot
+from servises.broadcaster import Broadcaster
+from servises.subscription_cache import subscription_cache
 from servises.telegram_service import TelegramService
 
 setup_logging()
@@ -22,126 +26,193 @@ logger = get_logger(__name__)
 background_logger = logging.getLogger('background_tasks')
 background_logger.setLevel(logging.INFO)
 
-# Логи в файл
-file_handler = RotatingFileHandler(
-    'logs/background.log',
-    maxBytes=10 * 1024 * 1024,
-    backupCount=3,
-    encoding='utf-8'
-)
-file_handler.setFormatter(logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-))
-background_logger.addHandler(file_handler)
+# Логи в файл (пишет фоновый поток логирования)
+add_log_file('background.log', logger_name='background_tasks')
+
+
+async def expire_subscriptions_batch(session, current_time: datetime, limit: int) -> list:
+    """
+    Одним UPDATE ... RETURNING переводит до limit просроченных подписок в expired
+    (removed_at остается NULL до удаления из канала). Возвращает строки (subscription_id, user_id, telegram_id).
+    """
+    expired_ids = expired_subscription_ids_query(current_time, limit).scalar_subquery()
+    result = await session.execute(
+        update(Subscription)
+        .where(Subscription.id.in_(expired_ids))
+        .where(Subscription.user_id == User.id)
+        .values(status='expired', updated_at=current_time)
+        .returning(Subscription.id, Subscription.user_id, User.telegram_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.all()
+
+
+async def notify_and_remove_expired(telegram_ids: list) -> set:
+    """
+    Уведомления и удаление из канала параллельно, под общим лимитом Telegram.
+    Возвращает telegram_id, у которых прошли и ban, и unban.
+    """
+    removed_ids = set()
+
+    async def notify(telegram_id: int):
+        await bot.send_message(
+            telegram_id,
+            "❌ <b>Ваша подписка закончилась</b>\n\n"
+            "Доступ к эксклюзивному контенту приостановлен.\n"
+            "Для возобновления доступа приобретите новую подписку.",
+            parse_mode='HTML'
+        )
+
+    async def remove(telegram_id: int):
+        await TelegramService.kick_from_channel(bot, telegram_id, USERNAME_CHANNEL)
+        removed_ids.add(telegram_id)
+
+    notified, removed = await asyncio.gather(
+        Broadcaster("expiry_notify").run(telegram_ids, notify),
+        # ban + unban — два запроса к API на пользователя
+        Broadcaster("expiry_remove", calls_per_send=2).run(telegram_ids, remove),
+    )
+    for telegram_id, error in removed.errors.items():
+        background_logger.info(f"🔴 У {telegram_id} , не удалось удалить подписку: {error}")
+    return removed_ids
+
+
+async def remove_expired_members(batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+    """
+    Уведомляет и удаляет из канала пользователей истекших подписок, затем отмечает removed_at.
+    Отметка ставится только после рассылки и только тем, кого удалось удалить (ban и unban):
+    остальные и пачка упавшего посередине процесса повторятся в следующем проходе
+    (повторное удаление и уведомление безопасны, потеря удаления или вечный бан — нет).
+    """
+    total = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            # Только что истекшие и оставшиеся после сбоя прошлого прохода (а также истекшие в биллинговом кроне);
+            # по id дальше, чтобы неудачные строки не выбирались снова в этом же проходе
+            rows = (await session.execute(unremoved_expired_query(datetime.utcnow(), batch_size, last_id))).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        # У кого есть другая действующая подписка, доступ не забираем
+        telegram_ids = list({telegram_id for _, telegram_id, has_access in rows if not has_access})
+        removed_ids = await notify_and_remove_expired(telegram_ids) if telegram_ids else set()
+
+        done_ids = [subscription_id for subscription_id, telegram_id, has_access in rows
+                    if has_access or telegram_id in removed_ids]
+        if done_ids:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(Subscription)
+                    .where(Subscription.id.in_(done_ids))
+                    .values(removed_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                await session.commit()
+
+        total += len(removed_ids)
+        if len(rows) < batch_size:
+            break
+    return total
+
+
+async def sweep_expired_subscriptions(batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+    """
+    Деактивирует просроченные подписки пачками (каждая пачка коммитится отдельно),
+    затем удаляет их пользователей из канала
+    """
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            rows = await expire_subscriptions_batch(session, datetime.utcnow(), batch_size)
+            await refresh_entitlements(session, [user_id for _, user_id, _ in rows])
+            await daily_stats.record_stat(session, daily_stats.EXPIRIES, len(rows))
+            await session.commit()
+
+        total += len(rows)
+        for _, user_id, _ in rows:
+            subscription_cache.invalidate(user_id)
+        if rows:
+            background_logger.info(f"🔴 Деактивировано {len(rows)} подписок (всего {total})")
+
+        if len(rows) < batch_size:
+            break
+
+    removed = await remove_expired_members(batch_size)
+    if removed:
+        background_logger.info(f"🔴 Удалено из канала {removed} пользователей")
+    return total
+
+
+async def run_expiry_sweep():
+    """Один проход деактивации просроченных подписок (задача планировщика)"""
+    background_logger.info("Запуск проверки подписок...")
+    expired_count = await sweep_expired_subscriptions()
+    if expired_count:
+        background_logger.info(f"✅ Деактивировано {expired_count} подписок")
 
 
 async def check_subscriptions():
-    logger = logging.getLogger('background_tasks')
-    logger.info("Запуск проверки подписок...")
     """Проверка и деактивация просроченных подписок"""
     while True:
         try:
-            async with AsyncSessionLocal() as session:
-                # 1. Проверка подключения к базе
-                result = await session.execute(text("SELECT 1"))
-                print(f"✅ Проверка базы: {result.scalar()}")
-
-                # 2. Деактивация просроченных подписок
-                current_time = datetime.utcnow()
-                expired_result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.status == 'active')
-                    .where(Subscription.end_date <= current_time)
-                )
-                expired_subscriptions = expired_result.scalars().all()
-
-                for subscription in expired_subscriptions:
-                    user_result = await session.execute(
-                        select(User).where(User.id == subscription.user_id)
-                    )
-                    user = user_result.scalar_one_or_none()
-                    if user:
-                        try:
-                            await bot.send_message(
-                                user.telegram_id,
-                                "❌ <b>Ваша подписка закончилась</b>\n\n"
-                                "Доступ к эксклюзивному контенту приостановлен.\n"
-                                "Для возобновления доступа приобретите новую подписку.",
-                                parse_mode='HTML'
-                            )
-                            logger.info(f"Уведомление отправлено пользователю {user.telegram_id}")
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка отправки уведомления: {e}")
-
-                    subscription.status = 'expired'
-                    subscription.updated_at = datetime.utcnow()
-
-                    try:
-                        success = await TelegramService.remove_user_from_channel(
-                            bot, user.telegram_id, USERNAME_CHANNEL)
-
-                    except Exception as e:
-                        logger.error(f"{e}")
-                        success = False
-                        await TelegramService.unban_from_channel(bot, user.telegram_id, USERNAME_CHANNEL)
-                    if success:
-                        logger.info(f"🔴 Подписка {subscription.id} деактивирована (просрочена)")
-                    else:
-                        logger.info(f"🔴 У {user.telegram_id} , не удалось удалить подписку")
-
-                # Коммитим изменения в базе
-                if expired_subscriptions:
-                    await session.commit()
-                    logger.info(f"✅ Деактивировано {len(expired_subscriptions)} подписок")
-
+            await run_expiry_sweep()
         except Exception as e:
-            logger.error(f"Ошибка в check_subscriptions: {e}")
+            background_logger.error(f"Ошибка в check_subscriptions: {e}")
 
         await asyncio.sleep(24 * 3600)  # Проверяем каждый день
 
 
+async def run_daily_report():
+    """Ежедневный отчет по подпискам (один запуск)"""
+    async with AsyncSessionLocal() as session:
+        current_time = datetime.utcnow()
+
+        # Действующие подписки — по одной строке entitlements на пользователя
+        active_count = await session.scalar(active_entitlements_count_query(current_time))
+
+        expiring_result = await session.execute(
+            select(Subscription)
+            .options(joinedload(Subscription.user))
+            .where(Subscription.status == 'active')
+            .where(Subscription.end_date <= current_time + timedelta(days=1))
+            .where(Subscription.end_date > current_time)
+        )
+        expiring_subscriptions = expiring_result.scalars().all()
+
+        # Вчера и последние 7 дней — из дневных счетчиков, без сканирования истории
+        start, end = daily_stats.day_range(7, end=daily_stats.today())
+        stats_by_day = await daily_stats.get_daily_stats(session, start, end)
+
+        data = []
+        for subscription in expiring_subscriptions:
+            if subscription.user:  # Проверяем, что пользователь загружен
+                telegram_id = subscription.user.telegram_id
+                username = subscription.user.username
+                data.append(f"У пользователя {username} c id {telegram_id} заканчивается подписка")
+
+        if get_admin_ids():
+            yesterday = stats_by_day.get(end - timedelta(days=1), {})
+            report_text = (
+                f"📊 <b>Ежедневный отчет по подпискам</b>\n\n"
+                f"📅 Дата: {current_time.strftime('%d.%m.%Y %H:%M')}\n"
+                f"✅ Активных подписок: {active_count}\n"
+                f"⚠️ Истекает в течение 1 дня: {data}\n\n"
+                f"<b>Вчера:</b> {format_daily_stats(yesterday)}\n"
+                f"<b>За 7 дней:</b> {format_daily_stats(sum_daily_stats(stats_by_day))}\n"
+                f"<i>{DAILY_STATS_LEGEND}</i>"
+            )
+
+            success_count, fail_count = await notify_admins(bot, report_text, parse_mode='HTML')
+            logger.info(f" Отчет отправлен: {success_count} успешно, {fail_count} с ошибкой")
+
+
 async def send_daily_report():
     """Ежедневный отчет по подпискам"""
     while True:
         try:
-            async with AsyncSessionLocal() as session:
-                current_time = datetime.utcnow()
-
-                active_result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.status == 'active')
-                    .where(Subscription.end_date > current_time)
-                )
-                active_subscriptions = active_result.scalars().all()
-                active_count = len(active_subscriptions)
-
-                expiring_result = await session.execute(
-                    select(Subscription)
-                    .options(joinedload(Subscription.user))
-                    .where(Subscription.status == 'active')
-                    .where(Subscription.end_date <= current_time + timedelta(days=1))
-                    .where(Subscription.end_date > current_time)
-                )
-                expiring_subscriptions = expiring_result.scalars().all()
-
-                data = []
-                for subscription in expiring_subscriptions:
-                    if subscription.user:  # Проверяем, что пользователь загружен
-                        telegram_id = subscription.user.telegram_id
-                        username = subscription.user.username
-                        data.append(f"У пользователя {username} c id {telegram_id} заканчивается подписка")
-
-                if get_admin_ids():
-                    report_text = (
-                        f"📊 <b>Ежедневный отчет по подпискам</b>\n\n"
-                        f"📅 Дата: {current_time.strftime('%d.%m.%Y %H:%M')}\n"
-                        f"✅ Активных подписок: {active_count}\n"
-                        f"⚠️ Истекает в течение 1 дня: {data}\n"
-                    )
-
-                    success_count, fail_count = await notify_admins(bot, report_text, parse_mode='HTML')
-                    logger.info(f" Отчет отправлен: {success_count} успешно, {fail_count} с ошибкой")
-
+            await run_daily_report()
         except Exception as e:
             logger.error(f"❌ Ошибка в send_daily_report: {e}")
 
@@ -155,28 +226,22 @@ async def check_expiring_subscriptions():
             async with AsyncSessionLocal() as session:
                 current_time = datetime.utcnow()
 
-                expiring_soon_result = await session.execute(
-                    select(Subscription)
-                    .join(User, Subscription.user_id == User.id)
-                    .where(Subscription.status == 'active')
-                    .where(Subscription.end_date <= current_time + timedelta(days=2))
-                    .where(Subscription.end_date > current_time + timedelta(days=1))
+                expiring_soon_result = await session.execute(expiring_reminders_query(current_time))
+                end_dates = dict(expiring_soon_result.all())
+
+            async def send_reminder(telegram_id: int):
+                end_date = end_dates[telegram_id]
+                await bot.send_message(
+                    telegram_id,
+                    "⚠️ <b>Ваша подписка скоро закончится!</b>\n\n"
+                    f"📅 Окончание: {end_date.strftime('%d.%m.%Y')}\n"
+                    f"⏳ Осталось: {(end_date - current_time).days} дней\n\n"
+                    "Не забудьте продлить подписку для непрерывного доступа к контенту.",
+                    parse_mode='HTML'
                 )
-                expiring_soon_subs = expiring_soon_result.scalars().all()
-
-                for subscription in expiring_soon_subs:
-                    try:
-                        await bot.send_message(
-                            subscription.user.telegram_id,
-                            "⚠️ <b>Ваша подписка скоро закончится!</b>\n\n"
-                            f"📅 Окончание: {subscription.end_date.strftime('%d.%m.%Y')}\n"
-                            f"⏳ Осталось: {(subscription.end_date - current_time).days} дней\n\n"
-                            "Не забудьте продлить подписку для непрерывного доступа к контенту.",
-                            parse_mode='HTML'
-                        )
-                        logger.info(f" Напоминание отправлено пользователю {subscription.user.telegram_id}")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки напоминания: {e}")
+
+            result = await Broadcaster("expiring_reminders").run(list(end_dates), send_reminder)
+            logger.info(f" Напоминания отправлены: {result.success}, с ошибкой: {result.failed + result.blocked}")
 
         except Exception as e:
             logger.error(f"❌ Ошибка в check_expiring_subscriptions: {e}")
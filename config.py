@@ -1,7 +1,10 @@
+import hashlib
 import os
 from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 
+from states.storage import PostgresStorage
+
 load_dotenv()
 
 SUBSCRIPTION_PRICE = (5900.00, 8900.00)
@@ -13,6 +16,15 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
 YOOKASSA_WEBHOOK_URL = os.getenv('YOOKASSA_WEBHOOK_URL')
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+YOOKASSA_TIMEOUT = float(os.getenv("YOOKASSA_TIMEOUT", "15"))
+YOOKASSA_MAX_RETRIES = int(os.getenv("YOOKASSA_MAX_RETRIES", "3"))
+YOOKASSA_POOL_LIMIT = int(os.getenv("YOOKASSA_POOL_LIMIT", "20"))
+YOOKASSA_WEBHOOK_POOL_LIMIT = int(os.getenv("YOOKASSA_WEBHOOK_POOL_LIMIT", "10"))
+
+# биллинговый крон: параллельные списания и лимит запросов к api.yookassa.ru в секунду
+BILLING_CONCURRENCY = int(os.getenv("BILLING_CONCURRENCY", "5"))
+BILLING_RATE = float(os.getenv("BILLING_RATE", "5"))
 
 # база
 DB_HOST = os.getenv("DB_HOST")
@@ -21,11 +33,90 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# пул соединений: "queue" — пул для бота, "null" — соединение на сессию (например, за pgbouncer);
+# одноразовые скрипты переключаются на null сами (database.session.use_null_pool)
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+# кэш статуса подписки (секунды / количество пользователей)
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "60"))
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+# рассылки: глобальный лимит Telegram (~30 сообщений/с), число воркеров, пауза между сообщениями в один чат
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "28"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "16"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# отдельный бюджет уведомлений админам, чтобы они не стояли в очереди за рассылками
+# (вместе с BROADCAST_RATE — в пределах лимита Telegram)
+ADMIN_NOTIFY_RATE = float(os.getenv("ADMIN_NOTIFY_RATE", "2"))
+# сколько получателей бесплатной рассылки читать из курсора за раз
+FREE_POST_CHUNK_SIZE = int(os.getenv("FREE_POST_CHUNK_SIZE", "1000"))
+# сколько просроченных подписок деактивировать за одну транзакцию
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "500"))
+# расписание фоновых задач (cron: мин час день месяц день_недели) и часовой пояс по умолчанию
+SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE", "UTC")
+# бесплатная рассылка проверяет окна доставки (scheduled_time поста в часовом поясе пользователя)
+# на каждом тике FREE_POST_CRON; получатели размазываются на FREE_POST_SPREAD_MINUTES после времени поста
+FREE_POST_CRON = os.getenv("FREE_POST_CRON", "*/5 * * * *")
+FREE_POST_SPREAD_MINUTES = int(os.getenv("FREE_POST_SPREAD_MINUTES", "30"))
+EXPIRY_SWEEP_CRON = os.getenv("EXPIRY_SWEEP_CRON", "5 0 * * *")
+DAILY_REPORT_CRON = os.getenv("DAILY_REPORT_CRON", "0 9 * * *")
 
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBAPP_HOST = os.getenv("WEBAPP_HOST")
 WEBAPP_PORT = int(os.getenv("WEBAPP_PORT"))
 
+# апдейты Telegram: polling | webhook (webhook принимается тем же aiohttp-приложением)
+TELEGRAM_UPDATE_MODE = os.getenv("TELEGRAM_UPDATE_MODE", "polling").lower()
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram_webhook")
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL") or (
+    f"{WEBHOOK_URL.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}" if WEBHOOK_URL else None
+)
+# секрет для X-Telegram-Bot-Api-Secret-Token; по умолчанию выводится из токена бота,
+# чтобы все воркеры регистрировали один и тот же
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or (
+    hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32] if BOT_TOKEN else None
+)
+# true — отвечать Telegram сразу и обрабатывать апдейт в фоне
+TELEGRAM_WEBHOOK_BACKGROUND = os.getenv("TELEGRAM_WEBHOOK_BACKGROUND", "true").lower() == "true"
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# число процессов-воркеров (>1 только в webhook-режиме); фоновые задачи выполняет
+# один лидер, выбранный через pg_advisory_lock, остальные проверяют блокировку раз в LEADER_CHECK_INTERVAL с
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+LEADER_CHECK_INTERVAL = float(os.getenv("LEADER_CHECK_INTERVAL", "15"))
+# проверка соединения LISTEN для инвалидаций кэшей между воркерами (переподключение при потере)
+CACHE_BUS_CHECK_INTERVAL = float(os.getenv("CACHE_BUS_CHECK_INTERVAL", "10"))
+
+# максимальная длина очереди логов; при переполнении записи отбрасываются и считаются
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# формат логов: text | json
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# доля сохраняемых записей уровня не выше LOG_SAMPLE_LEVEL по логгерам: "handlers=0.1,payment.webhook_handler=0.5"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_SAMPLE_LEVEL = os.getenv("LOG_SAMPLE_LEVEL", "DEBUG").upper()
+
+# метрики (время выполнения функций с @log_execution и т.п.); false — декораторы без обертки
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# /health/live и /health/ready: результат проверки БД кэшируется на HEALTH_CACHE_TTL с,
+# не готов при лаге event loop > HEALTH_MAX_LOOP_LAG с или без успешного getUpdates дольше HEALTH_POLLING_STALE с
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "5"))
+HEALTH_DB_TIMEOUT = float(os.getenv("HEALTH_DB_TIMEOUT", "3"))
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "1.0"))
+HEALTH_POLLING_STALE = float(os.getenv("HEALTH_POLLING_STALE", "90"))
+
+# FSM: postgres (переживает рестарты, общий для воркеров) | memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres").lower()
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
 URL = os.getenv("URL")
 USERNAME_CHANNEL = os.getenv("USERNAME_CHANNEL")
 RETURN_URL = os.getenv("RETURN_URL")
@@ -36,7 +127,10 @@ URL_BOT = os.getenv("URL_BOT")
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
+if FSM_STORAGE == "postgres":
+    dp = Dispatcher(storage=PostgresStorage(flush_interval=FSM_FLUSH_INTERVAL, cache_size=FSM_CACHE_SIZE))
+else:
+    dp = Dispatcher()
 
 # URL подключения для asyncpg
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
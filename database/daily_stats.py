@@ -0,0 +1,153 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import DailyStat
+
+# Метрики daily_stats (разрез в dimension указан в скобках)
+NEW_USERS = "new_users"
+NEW_SUBSCRIPTIONS = "new_subscriptions"  # (plan_type)
+RENEWALS = "renewals"
+RENEWAL_FAILURES = "renewal_failures"  # неуспешные автосписания биллингового крона
+PAYMENT_FAILURES = "payment_failures"  # payment.canceled от ЮКассы
+EXPIRIES = "expiries"
+REFUNDS = "refunds"
+REVENUE = "revenue"  # (currency)
+REFUNDED = "refunded"  # (currency)
+INVITES_CREATED = "invites_created"
+INVITES_USED = "invites_used"
+
+# (metric, dimension, value)
+Stat = Tuple[str, str, object]
+
+
+def today() -> date:
+    # Дни — по UTC, как и все даты в БД
+    return datetime.utcnow().date()
+
+
+async def record_stats(session: AsyncSession, stats: Iterable[Stat], day: Optional[date] = None):
+    """
+    Увеличить счетчики дня одним upsert. Вызывать в транзакции самого события,
+    чтобы счетчик и изменение данных коммитились (или откатывались) вместе.
+    """
+    totals: Dict[Tuple[str, str], Decimal] = defaultdict(Decimal)
+    for metric, dimension, value in stats:
+        # Одна строка — одно значение: ON CONFLICT не может обновить строку дважды за запрос
+        totals[(metric, dimension or "")] += Decimal(str(value or 0))
+    totals = {key: value for key, value in totals.items() if value}
+    if not totals:
+        return
+
+    day = day or today()
+    stmt = insert(DailyStat).values([
+        {"day": day, "metric": metric, "dimension": dimension, "value": value}
+        for (metric, dimension), value in totals.items()
+    ])
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[DailyStat.day, DailyStat.metric, DailyStat.dimension],
+        set_={"value": DailyStat.value + stmt.excluded.value},
+    ))
+
+
+async def record_stat(session: AsyncSession, metric: str, value=1, dimension: str = ""):
+    await record_stats(session, [(metric, dimension, value)])
+
+
+async def get_daily_stats(session: AsyncSession, start: date, end: date) -> Dict[date, Dict[Tuple[str, str], Decimal]]:
+    """Счетчики за дни [start, end): {день: {(metric, dimension): value}}"""
+    result = await session.execute(
+        select(DailyStat.day, DailyStat.metric, DailyStat.dimension, DailyStat.value)
+        .where(DailyStat.day >= start, DailyStat.day < end)
+        .order_by(DailyStat.day)
+    )
+    stats: Dict[date, Dict[Tuple[str, str], Decimal]] = defaultdict(dict)
+    for day, metric, dimension, value in result.all():
+        stats[day][(metric, dimension)] = value
+    return stats
+
+
+def metric_total(day_stats: Dict[Tuple[str, str], Decimal], metric: str) -> Decimal:
+    """Сумма метрики по всем разрезам"""
+    return sum((value for (name, _), value in day_stats.items() if name == metric), Decimal(0))
+
+
+# Восстановление из истории. Текущие события пишутся точнее, поэтому backfill
+# нужен для дней до появления daily_stats или после потери данных:
+# - новые подписки и выручка по ним — оплаченные подписки по start_date, кроме строк,
+#   созданных раньше вебхуком на автосписание крона (их платеж есть в billing_attempts);
+# - продления и выручка по ним — только billing_attempts (продления вебхуком auto_payment не восстановить),
+#   неуспешные — только отклоненные (canceled): pending и ошибки решаются позже вебхуком или повтором;
+# - истечения, отмены и возвраты — по updated_at подписки в текущем статусе.
+BACKFILL_SQL = """
+    INSERT INTO daily_stats (day, metric, dimension, value)
+    SELECT day, metric, dimension, sum(value) FROM (
+        SELECT created_at::date AS day, 'new_users' AS metric, '' AS dimension, 1 AS value
+        FROM users WHERE created_at >= :start AND created_at < :end
+        UNION ALL
+        SELECT start_date::date, 'new_subscriptions', plan_type, 1
+        FROM subscriptions s
+        WHERE payment_status IN ('completed', 'refunded') AND start_date >= :start AND start_date < :end
+          AND NOT EXISTS (SELECT 1 FROM billing_attempts a WHERE a.payment_id = s.payment_id)
+        UNION ALL
+        SELECT start_date::date, 'revenue', coalesce(currency, 'RUB'), price
+        FROM subscriptions s
+        WHERE payment_status IN ('completed', 'refunded') AND start_date >= :start AND start_date < :end
+          AND NOT EXISTS (SELECT 1 FROM billing_attempts a WHERE a.payment_id = s.payment_id)
+        UNION ALL
+        SELECT a.created_at::date, CASE WHEN a.status = 'succeeded' THEN 'renewals' ELSE 'renewal_failures' END, '', 1
+        FROM billing_attempts a
+        WHERE a.status IN ('succeeded', 'canceled') AND a.created_at >= :start AND a.created_at < :end
+        UNION ALL
+        SELECT a.created_at::date, 'revenue', coalesce(s.currency, 'RUB'), s.price
+        FROM billing_attempts a JOIN subscriptions s ON s.id = a.subscription_id
+        WHERE a.status = 'succeeded' AND a.created_at >= :start AND a.created_at < :end
+        UNION ALL
+        SELECT updated_at::date, 'expiries', '', 1
+        FROM subscriptions WHERE status = 'expired' AND updated_at >= :start AND updated_at < :end
+        UNION ALL
+        SELECT updated_at::date, 'payment_failures', '', 1
+        FROM subscriptions
+        WHERE status = 'canceled' AND payment_status = 'failed' AND updated_at >= :start AND updated_at < :end
+        UNION ALL
+        SELECT updated_at::date, 'refunds', '', 1
+        FROM subscriptions WHERE status = 'refunded' AND updated_at >= :start AND updated_at < :end
+        UNION ALL
+        SELECT updated_at::date, 'refunded', coalesce(currency, 'RUB'), price
+        FROM subscriptions WHERE status = 'refunded' AND updated_at >= :start AND updated_at < :end
+        UNION ALL
+        SELECT created_at::date, 'invites_created', '', 1
+        FROM invite_links WHERE created_at >= :start AND created_at < :end
+        UNION ALL
+        SELECT used_at::date, 'invites_used', '', 1
+        FROM invite_links WHERE is_used AND used_at >= :start AND used_at < :end
+    ) events
+    GROUP BY day, metric, dimension
+"""
+
+
+async def backfill_daily_stats(session: AsyncSession, start: date, end: date) -> int:
+    """Пересчитать дни [start, end) из истории (строки этих дней заменяются). Возвращает число строк"""
+    await session.execute(delete(DailyStat).where(DailyStat.day >= start, DailyStat.day < end))
+    result = await session.execute(
+        text(BACKFILL_SQL),
+        {"start": datetime.combine(start, datetime.min.time()), "end": datetime.combine(end, datetime.min.time())},
+    )
+    return result.rowcount
+
+
+async def get_history_start(session: AsyncSession) -> Optional[date]:
+    """Первый день, с которого есть данные (по пользователям)"""
+    result = await session.execute(text("SELECT min(created_at)::date FROM users"))
+    return result.scalar()
+
+
+def day_range(days: int, end: Optional[date] = None) -> Tuple[date, date]:
+    """[start, end) последних days дней, включая сегодня"""
+    end = end or today() + timedelta(days=1)
+    return end - timedelta(days=days), end
@@ -0,0 +1,120 @@
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql.psycopg import PGDialect_psycopg
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Entitlement, Subscription, User
+
+_PSYCOPG_DIALECT = PGDialect_psycopg()
+
+
+def current_subscriptions_query(user_ids: list):
+    """Действующая подписка каждого пользователя: активная с самой поздней end_date"""
+    return (
+        select(
+            Subscription.user_id,
+            Subscription.id,
+            Subscription.plan_type,
+            Subscription.plan_name,
+            Subscription.end_date,
+            func.coalesce(Subscription.auto_renew, False),
+            Subscription.payment_method,
+        )
+        .where(Subscription.user_id.in_(user_ids))
+        .where(Subscription.status == 'active')
+        .where(Subscription.end_date.isnot(None))
+        .distinct(Subscription.user_id)
+        .order_by(Subscription.user_id, Subscription.end_date.desc(), Subscription.created_at.desc())
+    )
+
+
+def refresh_entitlements_statements(user_ids: list) -> list:
+    """Запросы пересчета entitlements (см. refresh_entitlements) в порядке выполнения"""
+    lock_users = (
+        select(User.id).where(User.id.in_(user_ids)).order_by(User.id).with_for_update(key_share=True)
+    )
+
+    has_active = (
+        exists()
+        .where(Subscription.user_id == Entitlement.user_id)
+        .where(Subscription.status == 'active')
+        .where(Subscription.end_date.isnot(None))
+    )
+    delete_inactive = (
+        delete(Entitlement)
+        .where(Entitlement.user_id.in_(user_ids))
+        .where(~has_active)
+        .execution_options(synchronize_session=False)
+    )
+
+    stmt = insert(Entitlement).from_select(
+        ["user_id", "subscription_id", "plan_type", "plan_name", "active_until", "auto_renew", "payment_method"],
+        current_subscriptions_query(user_ids),
+    )
+    upsert_current = stmt.on_conflict_do_update(
+        index_elements=[Entitlement.user_id],
+        set_={
+            "subscription_id": stmt.excluded.subscription_id,
+            "plan_type": stmt.excluded.plan_type,
+            "plan_name": stmt.excluded.plan_name,
+            "active_until": stmt.excluded.active_until,
+            "auto_renew": stmt.excluded.auto_renew,
+            "payment_method": stmt.excluded.payment_method,
+            "updated_at": func.now(),
+        },
+    )
+    return [lock_users, delete_inactive, upsert_current]
+
+
+async def refresh_entitlements(session: AsyncSession, user_ids: Iterable[int]):
+    """
+    Пересчитать entitlements пользователей из их подписок. Вызывать в той же транзакции,
+    где менялись подписки, до commit.
+    Строки users блокируются, чтобы параллельные пересчеты одного пользователя шли по очереди
+    и последний видел изменения предыдущего.
+    """
+    user_ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    if not user_ids:
+        return
+
+    for statement in refresh_entitlements_statements(user_ids):
+        await session.execute(statement)
+
+
+def refresh_entitlements_sql(user_ids: Iterable[int]) -> List[Tuple[str, dict]]:
+    """
+    Те же запросы текстом с параметрами для psycopg: script/billing_cron.py работает без
+    SQLAlchemy-сессии, но пересчитывает доступ по тому же правилу
+    """
+    user_ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    if not user_ids:
+        return []
+
+    queries = []
+    for statement in refresh_entitlements_statements(user_ids):
+        compiled = statement.compile(dialect=_PSYCOPG_DIALECT, compile_kwargs={"render_postcompile": True})
+        queries.append((str(compiled), compiled.params))
+    return queries
+
+
+def active_entitlements_count_query(current_time):
+    """Число пользователей с действующим доступом"""
+    return select(func.count()).select_from(Entitlement).where(Entitlement.active_until > current_time)
+
+
+async def get_entitlement(session: AsyncSession, user_id: int) -> Optional[Entitlement]:
+    """Действующий доступ пользователя (поиск по первичному ключу) или None"""
+    entitlement = await session.get(Entitlement, user_id, populate_existing=True)
+    if entitlement is None or not entitlement.is_active:
+        return None
+    return entitlement
+
+
+async def get_current_subscription(session: AsyncSession, user_id: int) -> Optional[Subscription]:
+    """Подписка, дающая пользователю доступ, или None"""
+    entitlement = await get_entitlement(session, user_id)
+    if entitlement is None or entitlement.subscription_id is None:
+        return None
+    return await session.get(Subscription, entitlement.subscription_id, populate_existing=True)
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Numeric, Index, BigInteger, func
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, Text, Numeric, Index, BigInteger, \
+    func, UniqueConstraint, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -22,11 +24,6 @@ class User(Base):
     user_settings = relationship("UserSettings", back_populates="user", cascade="all, delete-orphan")
     invite_links = relationship("InviteLink", back_populates="user", cascade="all, delete-orphan")
 
-    __table_args__ = (
-        Index('ix_user_telegram_id', 'telegram_id'),
-        Index('ix_user_username', 'username'),
-    )
-
     def __repr__(self):
         return f"<User(id={self.id}, username={self.username})>"
 
@@ -70,10 +67,94 @@ class FreeDailyPost(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class MediaFile(Base):
+    """file_id загруженных в Telegram локальных файлов (по пути и хэшу содержимого)"""
+    __tablename__ = 'media_files'
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String(500), nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    media_type = Column(String(20), nullable=False)  # document, photo
+    file_id = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('path', 'content_hash', 'media_type', name='uq_media_file_path_hash_type'),
+    )
+
+
+class BillingAttempt(Base):
+    """Попытка автосписания из биллингового крона"""
+    __tablename__ = 'billing_attempts'
+
+    id = Column(Integer, primary_key=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id", ondelete="CASCADE"), nullable=False, index=True)
+    payment_id = Column(String(100), nullable=True)
+    status = Column(String(20), nullable=False)  # succeeded, canceled, pending, error
+    error = Column(Text, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class JobRun(Base):
+    """Время последнего запуска задачи планировщика (для догоняющего запуска после рестарта)"""
+    __tablename__ = 'job_runs'
+
+    name = Column(String(100), primary_key=True)
+    last_run_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class FsmState(Base):
+    """Состояние FSM aiogram (ключ строится DefaultKeyBuilder: бот, чат, пользователь, destiny)"""
+    __tablename__ = 'fsm_states'
+
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255), nullable=True)
+    data = Column(JSONB, nullable=False, server_default='{}')
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class Entitlement(Base):
+    """
+    Текущий доступ пользователя: одна строка на пользователя, пересчитывается из subscriptions
+    в той же транзакции, что и изменение подписки (database/entitlements.py).
+    Нет строки — нет действующей подписки.
+    """
+    __tablename__ = 'entitlements'
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id", ondelete="SET NULL"), nullable=True)
+    plan_type = Column(String(50), nullable=False)
+    plan_name = Column(String(100), nullable=False)
+    active_until = Column(DateTime, nullable=False)
+    auto_renew = Column(Boolean, nullable=False, default=False)
+    payment_method = Column(String(50), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    @property
+    def is_active(self) -> bool:
+        # Между end_date и проходом expiry sweep строка еще есть, но доступа уже нет
+        return self.active_until > datetime.utcnow()
+
+
+class DailyStat(Base):
+    """
+    Дневные счетчики для отчетов (database/daily_stats.py): увеличиваются в транзакции события,
+    история пересчитывается script/backfill_daily_stats.py. dimension — разрез метрики
+    (тип плана, валюта) или пустая строка.
+    """
+    __tablename__ = 'daily_stats'
+
+    day = Column(Date, primary_key=True)
+    metric = Column(String(50), primary_key=True)
+    dimension = Column(String(50), primary_key=True, server_default='')
+    value = Column(Numeric(14, 2), nullable=False, server_default='0')
+
+
 class WebhookEvent(Base):
     __tablename__ = "webhook_events"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     payment_id = Column(String(128), unique=True, nullable=False, index=True)
     event_type = Column(String(64), nullable=True)
     processed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -101,16 +182,34 @@ class Subscription(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     next_payment_date = Column(DateTime, )
+    # Когда после истечения пользователь уведомлен и удален из канала (NULL — еще нет)
+    removed_at = Column(DateTime, nullable=True)
 
     payment_id = Column(String(100), unique=True, nullable=True)
     payment_method = Column(String(50), nullable=True)
 
     user = relationship("User", back_populates="subscriptions")
 
+    # Индексы под горячие запросы (планы — script/explain_hot_queries.py).
+    # payment_id покрыт уникальным ограничением, отдельный индекс по status не нужен:
+    # все выборки по статусу — это active, для них частичные индексы.
     __table_args__ = (
-        Index('ix_subscription_user_id', 'user_id'),
-        Index('ix_subscription_status', 'status'),
-        Index('ix_subscription_payment_id', 'payment_id'),
+        # все подписки пользователя, новые первыми; FK при каскадном удалении пользователя
+        Index('ix_subscription_user_created', 'user_id', 'created_at'),
+        # активная подписка пользователя: user_id + status='active' + end_date > now
+        Index('ix_subscription_active_user', 'user_id', 'end_date',
+              postgresql_where=text("status = 'active'")),
+        # активные по сроку: истекшие (sweep), истекающие (напоминания), число подписчиков
+        Index('ix_subscription_active_end_date', 'end_date',
+              postgresql_where=text("status = 'active'")),
+        # биллинговый крон: auto_renew и next_payment_date в пределах дня
+        Index('ix_subscription_renew_next_payment', 'next_payment_date',
+              postgresql_where=text("auto_renew")),
+        # последние подписки в админке
+        Index('ix_subscription_created_id', 'created_at', 'id'),
+        # истекшие, чьих пользователей еще не удалили из канала (повтор после сбоя sweep)
+        Index('ix_subscription_expired_not_removed', 'id',
+              postgresql_where=text("status = 'expired' AND removed_at IS NULL")),
     )
 
     def __repr__(self):
@@ -1,19 +1,167 @@
+import asyncio
+import time
+
+from sqlalchemy import event, exc, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
 from contextlib import asynccontextmanager
-from config import DATABASE_URL
+
+from config import (
+    DATABASE_URL, DB_POOL_MODE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, DB_ECHO
+)
+from log.metrics import registry
 
 # URL подключения для asyncpg
 database = DATABASE_URL
 
+
+class PoolStats:
+    """Счетчики пула соединений для подбора его размера"""
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.wait_total += seconds
+        if seconds > self.wait_max:
+            self.wait_max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_total": round(self.wait_total, 6),
+            "wait_max": round(self.wait_max, 6),
+            "wait_avg": round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+        }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который замеряет время ожидания свободного соединения"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            # Только ожидание свободного соединения; ошибки подключения сюда не относятся
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
+
+
+def _attach_pool_listeners(async_engine):
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        pool_stats.connects += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_stats.checkouts += 1
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        pool_stats.checkins += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.invalidations += 1
+
+
+_QUERY_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+
+def _attach_query_metrics(async_engine):
+    """Число и время SQL-запросов: db_query_duration_seconds{operation}, db_query_errors_total{operation}"""
+    sync_engine = async_engine.sync_engine
+
+    def _operation(statement: str) -> str:
+        head = statement.lstrip()[:6].upper()
+        return head if head in _QUERY_OPERATIONS else "OTHER"
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        registry.histogram("db_query_duration_seconds", "Время выполнения SQL-запроса",
+                           operation=_operation(statement)).observe(time.perf_counter() - context._query_started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(exception_context):
+        registry.counter("db_query_errors_total", "Ошибки SQL-запросов",
+                         operation=_operation(exception_context.statement or "")).inc()
+
+
+def build_engine(pool_mode: str = DB_POOL_MODE):
+    """
+    Создает асинхронный engine.
+    pool_mode="queue" — пул соединений для бота,
+    pool_mode="null" — новое соединение на каждую сессию (одноразовые скрипты, см. use_null_pool).
+    """
+    connect_args = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+
+    if pool_mode == "null":
+        async_engine = create_async_engine(
+            database,
+            echo=DB_ECHO,
+            poolclass=NullPool,
+            connect_args=connect_args,
+        )
+    elif pool_mode == "queue":
+        async_engine = create_async_engine(
+            database,
+            echo=DB_ECHO,
+            poolclass=InstrumentedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            connect_args=connect_args,
+        )
+    else:
+        raise ValueError(f"Неизвестный DB_POOL_MODE: {pool_mode}")
+
+    _attach_pool_listeners(async_engine)
+    _attach_query_metrics(async_engine)
+    return async_engine
+
+
 # Создаем асинхронный engine
-engine = create_async_engine(
-    database,
-    echo=True,
-    poolclass=NullPool,
-    future=True
-)
+engine = build_engine()
+
+
+def get_pool_stats() -> dict:
+    """Состояние пула и счетчики checkout/ожидания"""
+    pool = engine.pool
+    stats = {"mode": "queue" if isinstance(pool, AsyncAdaptedQueuePool) else "null", **pool_stats.snapshot()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    return stats
 
 # Создаем фабрику сессий
 AsyncSessionLocal = async_sessionmaker(
@@ -23,6 +171,17 @@ AsyncSessionLocal = async_sessionmaker(
     autoflush=False
 )
 
+
+def use_null_pool():
+    """
+    Переключить engine и сессии на NullPool. Для одноразовых скриптов (вызвать до первого запроса):
+    соединения не остаются в пуле после asyncio.run и не держат слоты БД между запусками.
+    """
+    global engine
+    engine = build_engine("null")
+    AsyncSessionLocal.configure(bind=engine)
+
+
 # Базовый класс для моделей
 Base = declarative_base()
 
@@ -48,11 +207,22 @@ async def create_tables():
     print("✅ Таблицы созданы успешно")
 
 
+async def ping_database(timeout: float = 5.0) -> float:
+    """SELECT 1 через пул; возвращает время ответа в секундах, при недоступности БД бросает исключение"""
+    async def _ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    started = time.perf_counter()
+    # Таймаут покрывает и ожидание свободного соединения в пуле
+    await asyncio.wait_for(_ping(), timeout)
+    return time.perf_counter() - started
+
+
 async def check_connection():
     """Проверка подключения к базе данных"""
     try:
-        async with engine.begin() as conn:
-            await conn.execute("SELECT 1")
+        await ping_database()
         print("✅ Подключение к PostgreSQL успешно")
         return True
     except Exception as e:
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import desc, select, tuple_
+
+from database.models import Entitlement, Subscription, User
+
+# Построители горячих запросов к subscriptions. Код выполняет их, а
+# script/explain_hot_queries.py снимает планы с тех же самых запросов.
+
+
+def expired_subscription_ids_query(current_time: datetime, limit: int):
+    """id до limit просроченных активных подписок; занятые другим проходом строки пропускаются"""
+    return (
+        select(Subscription.id)
+        .where(Subscription.status == 'active')
+        .where(Subscription.end_date <= current_time)
+        .order_by(Subscription.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def unremoved_expired_query(current_time: datetime, limit: int, after_id: int = 0):
+    """
+    Истекшие подписки, чьих пользователей еще не удалили из канала:
+    (subscription_id, telegram_id, есть_действующий_доступ), по id после after_id
+    """
+    has_access = (
+        select(Entitlement.user_id)
+        .where(Entitlement.user_id == Subscription.user_id)
+        .where(Entitlement.active_until > current_time)
+        .exists()
+    )
+    return (
+        select(Subscription.id, User.telegram_id, has_access)
+        .join(User, User.id == Subscription.user_id)
+        .where(Subscription.status == 'expired')
+        .where(Subscription.removed_at.is_(None))
+        .where(Subscription.id > after_id)
+        .order_by(Subscription.id)
+        .limit(limit)
+    )
+
+
+def expiring_reminders_query(current_time: datetime):
+    """(telegram_id, end_date) активных подписок, истекающих через 1-2 дня"""
+    return (
+        select(User.telegram_id, Subscription.end_date)
+        .join(User, Subscription.user_id == User.id)
+        .where(Subscription.status == 'active')
+        .where(Subscription.end_date <= current_time + timedelta(days=2))
+        .where(Subscription.end_date > current_time + timedelta(days=1))
+    )
+
+
+def subscriptions_page_query(status: str, plan: str, direction: str, anchor_id: int, limit: int):
+    """
+    Страница подписок для админки, keyset по (created_at, id). direction: first — с начала,
+    next — старше якорной подписки (новые первыми), prev — новее нее (в обратном порядке).
+    """
+    query = select(
+        Subscription.id,
+        User.telegram_id,
+        User.username,
+        Subscription.plan_type,
+        Subscription.plan_name,
+        Subscription.start_date,
+        Subscription.end_date,
+        Subscription.status,
+        Subscription.payment_status,
+        Subscription.payment_id,
+        Subscription.created_at,
+        Subscription.updated_at
+    ).join(
+        User, User.id == Subscription.user_id
+    )
+    if status != "all":
+        query = query.where(Subscription.status == status)
+    if plan != "all":
+        query = query.where(Subscription.plan_type == plan)
+
+    if direction != "first":
+        # Сравнение строк (created_at, id) идет по индексу ix_subscription_created_id
+        key = tuple_(Subscription.created_at, Subscription.id)
+        anchor_created_at = select(Subscription.created_at).where(Subscription.id == anchor_id).scalar_subquery()
+        anchor_key = tuple_(anchor_created_at, anchor_id)
+        query = query.where(key > anchor_key if direction == "prev" else key < anchor_key)
+
+    if direction == "prev":
+        query = query.order_by(Subscription.created_at, Subscription.id)
+    else:
+        query = query.order_by(desc(Subscription.created_at), desc(Subscription.id))
+    return query.limit(limit)
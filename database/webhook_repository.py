@@ -4,8 +4,11 @@ from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
 
-from database.models import Subscription, WebhookEvent, User
+from database import daily_stats
+from database.entitlements import get_current_subscription, refresh_entitlements
+from database.models import BillingAttempt, Subscription, WebhookEvent, User
 from database.session import get_db_session
+from servises.subscription_cache import subscription_cache
 
 
 class WebhookRepository:
@@ -50,13 +53,7 @@ class WebhookRepository:
 
     async def get_active_subscription_for_user(self, user_id: int):
         async with get_db_session() as session:
-            result = await session.execute(
-                select(Subscription).where(
-                    Subscription.user_id == user_id,
-                    Subscription.status == "active"
-                )
-            )
-            return result.scalar_one_or_none()
+            return await get_current_subscription(session, user_id)
 
     async def create_subscription(self, user_id: int, plan_type: str, payment_id: str, amount,
                                   payment_data: dict):
@@ -86,8 +83,15 @@ class WebhookRepository:
                 updated_at=now
             )
             session.add(sub)
+            await session.flush()
+            await refresh_entitlements(session, [user_id])
+            await daily_stats.record_stats(session, [
+                (daily_stats.NEW_SUBSCRIPTIONS, sub.plan_type, 1),
+                (daily_stats.REVENUE, sub.currency, amount),
+            ])
             await session.commit()
             await session.refresh(sub)
+            subscription_cache.invalidate(user_id)
             return sub
 
     # ------------------------
@@ -108,7 +112,15 @@ class WebhookRepository:
                     updated_at=now
                 )
             )
+            await refresh_entitlements(session, [subscription_obj.user_id])
+            amount = payment_data.get("amount") or {}
+            await daily_stats.record_stats(session, [
+                (daily_stats.NEW_SUBSCRIPTIONS, subscription_obj.plan_type, 1),
+                (daily_stats.REVENUE, amount.get("currency") or subscription_obj.currency or "RUB",
+                 amount.get("value") or subscription_obj.price),
+            ])
             await session.commit()
+            subscription_cache.invalidate(subscription_obj.user_id)
 
     # ------------------------
     # Продление подписки (автоплатёж)
@@ -130,38 +142,125 @@ class WebhookRepository:
                     updated_at=datetime.utcnow()
                 )
             )
+            await refresh_entitlements(session, [sub.user_id])
+            await daily_stats.record_stats(session, [
+                (daily_stats.RENEWALS, "", 1),
+                (daily_stats.REVENUE, sub.currency or "RUB", sub.price),
+            ])
             await session.commit()
+            subscription_cache.invalidate(sub.user_id)
             return True
 
+    # ------------------------
+    # Автосписание биллингового крона, которое крон сам не провел
+    # ------------------------
+    async def apply_recurring_payment(self, subscription_id: int, payment_id: str, amount, currency: str):
+        """
+        Продлевает (или снова активирует) подписку по успешному автосписанию крона, если крон его
+        не учел: ответ pending, таймаут или ошибка после того, как ЮKassa списала деньги.
+        Подписка блокируется так же, как в script/billing_cron.py, а платеж учтен, если в
+        billing_attempts есть успешная попытка с этим payment_id. Возвращает telegram_id
+        пользователя или None, если платеж уже учтен или подписки нет.
+        """
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(Subscription, User.telegram_id)
+                .join(User, User.id == Subscription.user_id)
+                .where(Subscription.id == subscription_id)
+                .with_for_update(of=Subscription, key_share=True)
+            )
+            row = result.first()
+            if not row:
+                return None
+            sub, telegram_id = row
+
+            applied = await session.scalar(
+                select(BillingAttempt.id)
+                .where(BillingAttempt.payment_id == payment_id)
+                .where(BillingAttempt.status == 'succeeded')
+                .limit(1)
+            )
+            if applied:
+                return None
+
+            # Как в кроне: оплачен период от next_payment_date, доступ — не меньше его конца
+            now = datetime.utcnow()
+            next_payment_date = (sub.next_payment_date or now) + timedelta(days=30)
+            await session.execute(
+                update(Subscription).where(Subscription.id == subscription_id).values(
+                    status="active",
+                    payment_status="completed",
+                    auto_renew=True,
+                    next_payment_date=next_payment_date,
+                    end_date=max(sub.end_date or now, next_payment_date),
+                    removed_at=None,
+                    updated_at=now
+                )
+            )
+
+            # Попытка крона с этим платежом (pending) становится успешной; после ошибки ее нет — добавляем
+            attempt_id = await session.scalar(
+                select(BillingAttempt.id).where(BillingAttempt.payment_id == payment_id)
+                .order_by(BillingAttempt.id).limit(1)
+            )
+            if attempt_id:
+                await session.execute(
+                    update(BillingAttempt).where(BillingAttempt.id == attempt_id).values(status="succeeded")
+                )
+            else:
+                session.add(BillingAttempt(subscription_id=subscription_id, payment_id=payment_id, status="succeeded"))
+
+            await refresh_entitlements(session, [sub.user_id])
+            await daily_stats.record_stats(session, [
+                (daily_stats.RENEWALS, "", 1),
+                (daily_stats.REVENUE, currency or sub.currency or "RUB", amount or sub.price),
+            ])
+            await session.commit()
+            subscription_cache.invalidate(sub.user_id)
+            return telegram_id
+
     # ------------------------
     # Отмена подписки по payment_id (payment.canceled)
     # ------------------------
     async def cancel_subscription_by_payment(self, payment_id: str):
         async with get_db_session() as session:
-            await session.execute(
+            result = await session.execute(
                 update(Subscription).where(Subscription.payment_id == payment_id).values(
                     status="canceled",
                     payment_status="failed",
                     auto_renew=False,
                     updated_at=datetime.utcnow()
-                )
+                ).returning(Subscription.user_id)
             )
+            user_ids = result.scalars().all()
+            await refresh_entitlements(session, user_ids)
+            await daily_stats.record_stat(session, daily_stats.PAYMENT_FAILURES, len(user_ids))
             await session.commit()
+            for user_id in user_ids:
+                subscription_cache.invalidate(user_id)
 
     # ------------------------
     # Refund — отмечаем как refunded и отключаем автопродление
     # ------------------------
     async def refund_subscription_by_payment(self, payment_id: str):
         async with get_db_session() as session:
-            await session.execute(
+            result = await session.execute(
                 update(Subscription).where(Subscription.payment_id == payment_id).values(
                     status="refunded",
                     payment_status="refunded",
                     auto_renew=False,
                     updated_at=datetime.utcnow()
-                )
+                ).returning(Subscription.user_id, Subscription.price, Subscription.currency)
             )
+            rows = result.all()
+            user_ids = [user_id for user_id, _, _ in rows]
+            await refresh_entitlements(session, user_ids)
+            await daily_stats.record_stats(session, [(daily_stats.REFUNDS, "", len(rows))] + [
+                (daily_stats.REFUNDED, currency or "RUB", price) for _, price, currency in rows
+            ])
             await session.commit()
+            for user_id in user_ids:
+                subscription_cache.invalidate(user_id)
 
     # ------------------------
     # Найти user по subscription (если нужно)
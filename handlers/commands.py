@@ -7,10 +7,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dateutil.relativedelta import relativedelta
-from sqlalchemy import select, and_
+from sqlalchemy import select, exists, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import SUBSCRIPTION_PRICE, URL, ADMIN_IDS, USERNAME_CHANNEL
-from database.models import User, Subscription, UserSettings, FreeDailyPost
+from database import daily_stats
+from database.entitlements import get_current_subscription, get_entitlement
+from database.models import Entitlement, User, Subscription, UserSettings, FreeDailyPost
 from database.session import get_db_session
 
 from helpers import is_admin, get_admin_ids, notify_admins
@@ -19,8 +22,9 @@ from keyboard import main_keyboard, show_tariff_selection, _process_tariff_selec
     _check_payment, show_tariff_selection_by_callback
 import logging
 
+from log.context import bind_log_context
 from payment.yookassa_service import YooKassaService
-from servises.daily_poster import FreePostService
+from servises.subscription_cache import subscription_cache, SubscriptionStatus
 from states.subscription_states import FreePostCreation, SubscriptionStates
 
 logging.basicConfig(level=logging.INFO)
@@ -34,95 +38,91 @@ PRICES = {
 
 
 @router.message(Command("start"))
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, session: AsyncSession, db_user: User = None):
     telegram_user = message.from_user
 
-    async with get_db_session() as session:
-        try:
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_user.id)
+    try:
+        user = db_user
+
+        if not user:
+            user = User(
+                telegram_id=telegram_user.id,
+                username=telegram_user.username,
+                full_name=f"{telegram_user.first_name or ''} {telegram_user.last_name or ''}".strip()
+            )
+            session.add(user)
+            await session.flush()
+            await daily_stats.record_stat(session, daily_stats.NEW_USERS)
+            print(f"✅ Создан пользователь с ID: {user.id}")
+        user_settings = await session.get(UserSettings, user.id)
+        if not user_settings:
+            user_settings = UserSettings(
+                user_id=user.id,
+                wants_free_posts=True
             )
-            user = result.scalar_one_or_none()
+            session.add(user_settings)
+            print(f"✅ Созданы настройки для user_id: {user.id}")
 
-            if not user:
-                user = User(
-                    telegram_id=telegram_user.id,
-                    username=telegram_user.username,
-                    full_name=f"{telegram_user.first_name or ''} {telegram_user.last_name or ''}".strip()
-                )
-                session.add(user)
-                await session.flush()
-                print(f"✅ Создан пользователь с ID: {user.id}")
-            user_settings = await session.get(UserSettings, user.id)
-            if not user_settings:
-                user_settings = UserSettings(
-                    user_id=user.id,
-                    wants_free_posts=True
-                )
-                session.add(user_settings)
-                print(f"✅ Созданы настройки для user_id: {user.id}")
+        await session.commit()
+        print(f"✅ Пользователь создан: {telegram_user.id}")
+        sub_info = await get_subscription_info(user.id, session)
+        has_active_sub = bool(sub_info)
 
-            await session.commit()
-            print(f"✅ Пользователь создан: {telegram_user.id}")
-            await session.refresh(user)
-            await session.refresh(user_settings)
-            has_active_sub = await check_active_subscription(user.id)
-            sub_info = await get_subscription_info(user.id)
+        await main_keyboard(message, sub_info, has_active_sub, user=user)
 
-            await main_keyboard(message, sub_info, has_active_sub)
+    except Exception as e:
+        print(f"❌ Ошибка в /start: {e}")
+        await session.rollback()
+        await message.answer("Произошла ошибка. Попробуйте позже.")
 
-        except Exception as e:
-            print(f"❌ Ошибка в /start: {e}")
-            await session.rollback()
-            await message.answer("Произошла ошибка. Попробуйте позже.")
 
+async def get_active_subscription(session: AsyncSession, user_id: int):
+    """Действующая подписка пользователя (через entitlements) или None"""
+    return await get_current_subscription(session, user_id)
 
-async def check_active_subscription(user_id: int) -> bool:
-    """Проверяет есть ли активная подписка"""
-    logger.debug(f"Проверка активной подписки для пользователя {user_id}")
 
-    async with get_db_session() as session:
-        result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user_id)
-            .where(Subscription.status == 'active')
-            .where(Subscription.end_date > datetime.utcnow())
-        )
-        subscription = result.scalar_one_or_none()
+async def get_subscription_status(user_id: int, session: AsyncSession = None) -> SubscriptionStatus:
+    """Статус подписки из кэша, при промахе — из БД"""
+    status = subscription_cache.get(user_id)
+    if status is not None:
+        return status
 
-        if subscription:
-            logger.debug(f"Найдена активная подписка {subscription.id} для пользователя {user_id}")
-        else:
-            logger.debug(f"Активная подписка для пользователя {user_id} не найдена")
+    if session is None:
+        async with get_db_session() as session:
+            entitlement = await get_entitlement(session, user_id)
+    else:
+        entitlement = await get_entitlement(session, user_id)
 
-        return subscription is not None
+    if entitlement:
+        status = SubscriptionStatus(True, entitlement.plan_name, entitlement.active_until, entitlement.auto_renew)
+    else:
+        status = SubscriptionStatus(False)
+    subscription_cache.set(user_id, status)
+    return status
 
 
-async def get_subscription_info(user_id: int) -> dict:
-    """Получает информацию о подписке"""
-    logger.debug(f"Получение информации о подписке для пользователя {user_id}")
+async def check_active_subscription(user_id: int, session: AsyncSession = None) -> bool:
+    """Проверяет есть ли активная подписка"""
+    status = await get_subscription_status(user_id, session)
+    logger.debug("Активная подписка для пользователя %s: %s", user_id, status.is_active)
+    return status.is_active
 
-    async with get_db_session() as session:
-        result = await session.execute(
-            select(Subscription)
-            .where(Subscription.user_id == user_id)
-            .where(Subscription.status == 'active')
-            .where(Subscription.end_date > datetime.utcnow())
-            .order_by(Subscription.created_at.desc())
-        )
-        sub = result.scalar_one_or_none()
 
-        if sub:
-            days_left = (sub.end_date - datetime.utcnow()).days
-            info = {
-                'plan_name': sub.plan_name,
-                'end_date': sub.end_date.strftime('%d.%m.%Y'),
-                'days_left': days_left,
-                'auto_renew': sub.auto_renew
-            }
-            logger.debug(f"Информация о подписке: {info}")
-            return info
-        return {}
+async def get_subscription_info(user_id: int, session: AsyncSession = None) -> dict:
+    """Получает информацию о подписке"""
+    status = await get_subscription_status(user_id, session)
+
+    if status.is_active:
+        days_left = (status.end_date - datetime.utcnow()).days
+        info = {
+            'plan_name': status.plan_name,
+            'end_date': status.end_date.strftime('%d.%m.%Y'),
+            'days_left': days_left,
+            'auto_renew': status.auto_renew
+        }
+        logger.debug("Информация о подписке: %s", info)
+        return info
+    return {}
 
 
 def is_valid_email(email: str) -> bool:
@@ -133,61 +133,58 @@ def is_valid_email(email: str) -> bool:
 
 
 @router.callback_query(F.data == "buy_subscription")
-async def buy_subscription(callback: types.CallbackQuery,  state: FSMContext):
+async def buy_subscription(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession,
+                           db_user: User = None):
     """Обработка кнопки покупки подписки"""
     user_id = callback.from_user.id
-    logger.info(f"Пользователь {user_id} начал покупку подписки")
+    logger.info("Пользователь %s начал покупку подписки", user_id)
 
-    async with get_db_session() as session:
-        try:
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
+    try:
+        user = db_user
+
+        if not user:
+            logger.warning("Пользователь %s не найден в БД", user_id)
+            await callback.answer("❌ Сначала используйте /start")
+            return
+
+        # Проверяем активную подписку
+        sub_info = await get_subscription_info(user.id, session)
+        if sub_info:
+            message = (
+                f"⚠️ У вас уже есть активная подписка!\n\n"
+                f"📅 Действует до: {sub_info['end_date']}\n"
+                f"⏳ Осталось дней: {sub_info['days_left']}\n"
+                f"🔄 Автоплатеж: {'✅ Включен' if sub_info['auto_renew'] else '❌ Выключен'}"
             )
-            user = user_result.scalar_one_or_none()
-
-            if not user:
-                logger.warning(f"Пользователь {user_id} не найден в БД")
-                await callback.answer("❌ Сначала используйте /start")
-                return
-
-            # Проверяем активную подписку
-            if await check_active_subscription(user.id):
-                sub_info = await get_subscription_info(user.id)
-                message = (
-                    f"⚠️ У вас уже есть активная подписка!\n\n"
-                    f"📅 Действует до: {sub_info['end_date']}\n"
-                    f"⏳ Осталось дней: {sub_info['days_left']}\n"
-                    f"🔄 Автоплатеж: {'✅ Включен' if sub_info['auto_renew'] else '❌ Выключен'}"
-                )
-                await callback.message.answer(message)
-                await callback.answer()
-                return
+            await callback.message.answer(message)
+            await callback.answer()
+            return
 
-            if not user.email:
-                # Если email нет - запрашиваем его
-                await callback.message.answer(
-                    "📧 <b>Для оформления подписки нужен ваш email</b>\n\n"
-                    "Он потребуется для отправки чека об оплате.\n"
-                    "Пожалуйста, введите ваш email:",
-                    parse_mode="HTML"
-                )
-                await state.set_state(SubscriptionStates.waiting_email)
-                await state.update_data(user_id=user.id)
+        if not user.email:
+            # Если email нет - запрашиваем его
+            await callback.message.answer(
+                "📧 <b>Для оформления подписки нужен ваш email</b>\n\n"
+                "Он потребуется для отправки чека об оплате.\n"
+                "Пожалуйста, введите ваш email:",
+                parse_mode="HTML"
+            )
+            await state.set_state(SubscriptionStates.waiting_email)
+            await state.update_data(user_id=user.id)
 
-            else:
-                await show_tariff_selection_by_callback(callback)
+        else:
+            await show_tariff_selection_by_callback(callback)
 
-            await callback.answer()
-            logger.info(f"Показан выбор тарифов для пользователя {user_id}")
+        await callback.answer()
+        logger.info("Показан выбор тарифов для пользователя %s", user_id)
 
-        except Exception as e:
-            logger.error(f"Ошибка покупки подписки: {str(e)}", exc_info=True)
-            await callback.message.answer("❌ Произошла ошибка при обработке запроса")
-            await callback.answer()
+    except Exception as e:
+        logger.error("Ошибка покупки подписки: %s", e, exc_info=True)
+        await callback.message.answer("❌ Произошла ошибка при обработке запроса")
+        await callback.answer()
 
 
 @router.message(SubscriptionStates.waiting_email)
-async def process_user_email(message, state: FSMContext):
+async def process_user_email(message, state: FSMContext, session: AsyncSession, db_user: User = None):
     """Обработка введенного email пользователя"""
     user_id = message.from_user.id
     email = message.text.strip()
@@ -204,27 +201,28 @@ async def process_user_email(message, state: FSMContext):
 
     try:
         # Сохраняем email в базу данных
-        async with get_db_session() as session:
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
+        user = db_user
+        if user is None:
+            user = await session.scalar(select(User).where(User.telegram_id == user_id))
+        if user is None:
+            await message.answer("❌ Пользователь не найден. Нажмите /start и попробуйте снова.")
+            await state.clear()
+            return
 
-            if user:
-                user.email = email
-                await session.commit()
-                logger.info(f"Email сохранен для пользователя {user_id}: {email}")
+        user.email = email
+        await session.commit()
+        logger.info("Email сохранен для пользователя %s: %s", user_id, email)
 
-            if await check_active_subscription(user.id):
-                await message.answer("✅ Email успешно изменен")
-                return
+        if await check_active_subscription(user.id, session):
+            await message.answer("✅ Email успешно изменен")
+            return
 
-            # Показываем выбор тарифа
-            await show_tariff_selection(message)
-            await state.clear()
+        # Показываем выбор тарифа
+        await show_tariff_selection(message)
+        await state.clear()
 
     except Exception as e:
-        logger.error(f"Ошибка сохранения email: {e}")
+        logger.error("Ошибка сохранения email: %s", e)
         await message.answer("❌ Произошла ошибка при сохранении email. Попробуйте позже.")
         await state.clear()
 
@@ -242,544 +240,456 @@ async def change_email(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "_show_cancel_confirmation")
-async def show_cancel_confirmation(callback: types.CallbackQuery):
+async def show_cancel_confirmation(callback: types.CallbackQuery, session: AsyncSession, db_user: User = None):
     user_id = callback.from_user.id
-    logger.info(f"Пользователь {user_id} начал отмену подписки")
-    async with get_db_session() as session:
-        try:
-            # Получаем пользователя
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
+    logger.info("Пользователь %s начал отмену подписки", user_id)
+    try:
+        # Получаем пользователя
+        user = db_user
+
+        if not user:
+            logger.warning("Пользователь %s не найден в БД", user_id)
+            await callback.answer("❌ Сначала используйте /start")
+            return
+
+        subscription = await get_active_subscription(session, user.id)
+        if not subscription:
+            await callback.message.answer(
+                "❌ У вас нет активной подписки.\n\n"
+                "Если у вас есть вопросы, обратитесь в поддержку."
             )
-            user = user_result.scalar_one_or_none()
-
-            if not user:
-                logger.warning(f"Пользователь {user_id} не найден в БД")
-                await callback.answer("❌ Сначала используйте /start")
-                return
-
-            subscription_result = await session.execute(
-                select(Subscription).where(
-                    Subscription.user_id == user.id,
-                    Subscription.status == 'active',
-                    Subscription.end_date > datetime.utcnow()
-                ).order_by(Subscription.created_at.desc())
+            return
+        if not subscription.auto_renew:
+            await callback.message.answer(
+                "ℹ️ Автоплатежи уже отключены для вашей подписки.\n\n"
+                f"📅 Подписка действует до: {subscription.end_date.strftime('%d.%m.%Y')}\n"
+                "После этой даты доступ будет закрыт."
             )
-            subscription = subscription_result.scalar_one_or_none()
-            if not subscription:
-                await callback.message.answer(
-                    "❌ У вас нет активной подписки.\n\n"
-                    "Если у вас есть вопросы, обратитесь в поддержку."
-                )
-                return
-            if not subscription.auto_renew:
-                await callback.message.answer(
-                    "ℹ️ Автоплатежи уже отключены для вашей подписки.\n\n"
-                    f"📅 Подписка действует до: {subscription.end_date.strftime('%d.%m.%Y')}\n"
-                    "После этой даты доступ будет закрыт."
-                )
-                return
+            return
 
-            days_left = (subscription.end_date - datetime.utcnow()).days
+        days_left = (subscription.end_date - datetime.utcnow()).days
 
-            await _show_cancel_confirmation(callback, subscription, days_left)
+        await _show_cancel_confirmation(callback, subscription, days_left)
 
-        except Exception as e:
-            logger.error(f"Ошибка при показе подтверждения отмены: {str(e)}", exc_info=True)
-            await callback.answer("❌ Произошла ошибка. Попробуйте позже.")
+    except Exception as e:
+        logger.error("Ошибка при показе подтверждения отмены: %s", e, exc_info=True)
+        await callback.answer("❌ Произошла ошибка. Попробуйте позже.")
 
 
 @router.callback_query(F.data == "confirm_cancel_auto")
-async def confirm_cancel_auto_subscription(callback: CallbackQuery):
+async def confirm_cancel_auto_subscription(callback: CallbackQuery, session: AsyncSession, db_user: User = None):
     """Подтверждение отмены авто-подписки"""
     user_id = callback.from_user.id
-    logger.info(f"Пользователь {user_id} подтвердил отмену авто-подписки")
+    logger.info("Пользователь %s подтвердил отмену авто-подписки", user_id)
 
-    async with get_db_session() as session:
-        try:
+    try:
+        user = db_user
 
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
-
-            if not user:
-                await callback.message.answer("❌ Пользователь не найден")
-                await callback.answer()
-                return
-
-            success = await YooKassaService.cancel_auto_payments(user.id)
-
-            if success:
-                # Получаем обновленную информацию о подписке
-                subscription_result = await session.execute(
-                    select(Subscription).where(
-                        Subscription.user_id == user.id,
-                        Subscription.status == 'active'
-                    ).order_by(Subscription.created_at.desc())
-                )
-                subscription = subscription_result.scalar_one_or_none()
-
-                if subscription:
-                    message_text = (
-                        f"✅ <b>Автоплатежи отменены!</b>\n\n"
-                        f"📋 Тариф: <b>{subscription.plan_name}</b>\n"
-                        f"📅 Подписка действует до: <b>{subscription.end_date.strftime('%d.%m.%Y')}</b>\n"
-                        f"🔄 Автоплатеж: <b>❌ Отключен</b>\n\n"
-                        f"<i>После {subscription.end_date.strftime('%d.%m.%Y')} доступ к материалам будет закрыт.</i>\n"
-                        f"Для продления оформите подписку заново."
-                    )
-                else:
-                    message_text = "✅ Автоплатежи отменены!"
-
-                await callback.message.edit_text(
-                    message_text,
-                    parse_mode="HTML"
-                )
+        if not user:
+            await callback.message.answer("❌ Пользователь не найден")
+            await callback.answer()
+            return
 
-                logger.info(f"Автоплатежи успешно отменены для пользователя {user_id}")
+        success = await YooKassaService.cancel_auto_payments(user.id)
 
-            else:
-                await callback.message.edit_text(
-                    "❌ <b>Не удалось отменить автоплатежи</b>\n\n"
-                    "Пожалуйста, попробуйте позже или обратитесь в поддержку.",
-                    parse_mode="HTML"
+        if success:
+            # Получаем обновленную информацию о подписке
+            subscription = await get_active_subscription(session, user.id)
+
+            if subscription:
+                message_text = (
+                    f"✅ <b>Автоплатежи отменены!</b>\n\n"
+                    f"📋 Тариф: <b>{subscription.plan_name}</b>\n"
+                    f"📅 Подписка действует до: <b>{subscription.end_date.strftime('%d.%m.%Y')}</b>\n"
+                    f"🔄 Автоплатеж: <b>❌ Отключен</b>\n\n"
+                    f"<i>После {subscription.end_date.strftime('%d.%m.%Y')} доступ к материалам будет закрыт.</i>\n"
+                    f"Для продления оформите подписку заново."
                 )
-                logger.error(f"Ошибка отмены автоплатежей для пользователя {user_id}")
+            else:
+                message_text = "✅ Автоплатежи отменены!"
 
-        except Exception as e:
-            logger.error(f"Ошибка при отмене авто-подписки: {str(e)}", exc_info=True)
             await callback.message.edit_text(
-                "❌ <b>Произошла ошибка при отмене автоплатежей</b>\n\n"
+                message_text,
+                parse_mode="HTML"
+            )
+
+            logger.info("Автоплатежи успешно отменены для пользователя %s", user_id)
+
+        else:
+            await callback.message.edit_text(
+                "❌ <b>Не удалось отменить автоплатежи</b>\n\n"
                 "Пожалуйста, попробуйте позже или обратитесь в поддержку.",
                 parse_mode="HTML"
             )
+            logger.error("Ошибка отмены автоплатежей для пользователя %s", user_id)
+
+    except Exception as e:
+        logger.error("Ошибка при отмене авто-подписки: %s", e, exc_info=True)
+        await callback.message.edit_text(
+            "❌ <b>Произошла ошибка при отмене автоплатежей</b>\n\n"
+            "Пожалуйста, попробуйте позже или обратитесь в поддержку.",
+            parse_mode="HTML"
+        )
 
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("tariff_"))
-async def process_tariff_selection(callback: types.CallbackQuery):
+async def process_tariff_selection(callback: types.CallbackQuery, session: AsyncSession, db_user: User = None):
     """Обработка выбора тарифа"""
     tariff_type = callback.data.replace("tariff_", "")
     user_id = callback.from_user.id
 
-    logger.info(f"Пользователь {user_id} выбрал тариф: {tariff_type}")
+    logger.info("Пользователь %s выбрал тариф: %s", user_id, tariff_type)
 
     if tariff_type not in PRICES:
-        logger.warning(f"Неизвестный тип тарифа: {tariff_type}")
+        logger.warning("Неизвестный тип тарифа: %s", tariff_type)
         await callback.answer("❌ Неизвестный тариф")
         return
 
-    async with get_db_session() as session:
-        try:
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
+    try:
+        user = db_user
 
-            if not user:
-                await callback.answer("❌ Пользователь не найден")
-                return
+        if not user:
+            await callback.answer("❌ Пользователь не найден")
+            return
 
-            if not user.email:
-                await callback.message.answer(
-                    "❌ <b>Email не указан</b>\n\n"
-                    "Пожалуйста, сначала укажите ваш email для получения чека.",
-                    parse_mode="HTML"
-                )
-                await callback.answer()
-                return
+        if not user.email:
+            await callback.message.answer(
+                "❌ <b>Email не указан</b>\n\n"
+                "Пожалуйста, сначала укажите ваш email для получения чека.",
+                parse_mode="HTML"
+            )
+            await callback.answer()
+            return
 
-            # Определяем название плана
-            plan_name = "Обычный" if tariff_type == "regular" else "Студенческий"
-            price = PRICES[tariff_type]
+        # Определяем название плана
+        plan_name = "Обычный" if tariff_type == "regular" else "Студенческий"
+        price = PRICES[tariff_type]
+
+        # Создаем запись о подписке
+        subscription = Subscription(
+            user_id=user.id,
+            plan_type=tariff_type,
+            plan_name=plan_name,
+            price=price,
+            currency="RUB",
+            status="pending",
+            payment_status="pending",
+            auto_renew=True,  # Включаем автосписание по умолчанию
+            next_payment_date=datetime.utcnow() + relativedelta(months=1)
+        )
+        session.add(subscription)
+        await session.commit()
+        await session.refresh(subscription)
 
-            # Создаем запись о подписке
-            subscription = Subscription(
+        logger.info("Создана подписка %s для пользователя %s", subscription.id, user_id)
+
+        try:
+            # Создаем платеж в ЮKассе
+            payment_url, payment_id = await YooKassaService.create_subscription(
                 user_id=user.id,
-                plan_type=tariff_type,
-                plan_name=plan_name,
-                price=price,
-                currency="RUB",
-                status="pending",
-                payment_status="pending",
-                auto_renew=True,  # Включаем автосписание по умолчанию
-                next_payment_date=datetime.utcnow() + relativedelta(months=1)
+                plan_data={
+                    'plan_type': tariff_type,
+                    'plan_name': plan_name,
+                    'price': float(price)
+                },
+                email=user.email
             )
-            session.add(subscription)
-            await session.commit()
-            await session.refresh(subscription)
-
-            logger.info(f"Создана подписка {subscription.id} для пользователя {user_id}")
 
-            try:
-                # Создаем платеж в ЮKассе
-                payment_url, payment_id = await YooKassaService.create_subscription(
-                    user_id=user.id,
-                    plan_data={
-                        'plan_type': tariff_type,
-                        'plan_name': plan_name,
-                        'price': float(price)
-                    },
-                    email=user.email
-                )
+            bind_log_context(payment_id=payment_id)
 
-                # Обновляем подписку с payment_id
-                subscription.payment_id = payment_id
-                await session.commit()
+            # Обновляем подписку с payment_id
+            subscription.payment_id = payment_id
+            await session.commit()
 
-                # Отправляем пользователю ссылку на оплату
-                await _process_tariff_selection(callback, subscription, {
-                    'confirmation_url': payment_url,
-                    'id': payment_id
-                })
+            # Отправляем пользователю ссылку на оплату
+            await _process_tariff_selection(callback, subscription, {
+                'confirmation_url': payment_url,
+                'id': payment_id
+            })
 
-                logger.info(f"Платеж создан для подписки {subscription.id}, payment_id: {payment_id}")
+            logger.info("Платеж создан для подписки %s, payment_id: %s", subscription.id, payment_id)
 
-            except Exception as e:
-                logger.error(f"Ошибка создания платежа: {str(e)}", exc_info=True)
-                await callback.message.answer("❌ Ошибка при создании платежа. Попробуйте позже.")
-                # Удаляем подписку если не удалось создать платеж
-                await session.delete(subscription)
-                await session.commit()
+        except Exception as e:
+            logger.error("Ошибка создания платежа: %s", e, exc_info=True)
+            await callback.message.answer("❌ Ошибка при создании платежа. Попробуйте позже.")
+            # Удаляем подписку если не удалось создать платеж
+            await session.delete(subscription)
+            await session.commit()
 
-            await callback.answer()
+        await callback.answer()
 
-        except Exception as e:
-            logger.error(f"Ошибка выбора тарифа: {str(e)}", exc_info=True)
-            await callback.message.answer("❌ Произошла ошибка при выборе тарифа")
-            await callback.answer()
+    except Exception as e:
+        logger.error("Ошибка выбора тарифа: %s", e, exc_info=True)
+        await callback.message.answer("❌ Произошла ошибка при выборе тарифа")
+        await callback.answer()
 
 
 @router.callback_query(F.data.startswith("check_payment_"))
-async def check_payment(callback: types.CallbackQuery):
+async def check_payment(callback: types.CallbackQuery, session: AsyncSession, db_user: User = None):
     """Проверка оплаты, но теперь без обращения к YooKassa API — только статус в БД"""
 
     subscription_id = int(callback.data.replace("check_payment_", ""))
     user_id = callback.from_user.id
-    logger.info(f"Проверка оплаты для подписки {subscription_id} пользователем {user_id}")
+    logger.info("Проверка оплаты для подписки %s пользователем %s", subscription_id, user_id)
 
-    async with get_db_session() as session:
-        try:
-            # Получаем пользователя
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
+    try:
+        # Получаем пользователя
+        user = db_user
 
-            if not user:
-                await callback.answer("❌ Пользователь не найден")
-                return
+        if not user:
+            await callback.answer("❌ Пользователь не найден")
+            return
 
-            # Получаем подписку
-            result = await session.execute(
-                select(Subscription)
-                .where(Subscription.id == subscription_id)
-                .where(Subscription.user_id == user.id)
-            )
-            subscription = result.scalar_one_or_none()
-
-            if not subscription:
-                await callback.message.answer("❌ Подписка не найдена")
-                await callback.answer()
-                return
-
-            # 💡 Теперь всё решает статус в БД, который выставляет ВЕБХУК
-            if subscription.status == "active":
-                await _check_payment(callback, subscription, URL)
-                if get_admin_ids():
-                    await notify_admins(
-                        callback.bot,
-                        f"💸 Новая подписка!\n"
-                        f"👤 Пользователь: {user.full_name}\n"
-                        f"📧 @{user.username or 'нет'}\n"
-                        f"🆔 ID: {user.telegram_id}\n"
-                        f"💳 Тариф: {subscription.plan_name}\n"
-                        f"💰 Сумма: {subscription.price:.2f}₽",
-                        parse_mode="HTML"
-                    )
-                await callback.answer()
-                return
-
-            if subscription.status in ["pending", "waiting_payment", None]:
-                await callback.message.answer(
-                    "⌛ Платеж еще не подтверждён.\n"
-                    "Обычно это занимает несколько секунд.\n"
-                    "Если оплата прошла — подождите немного."
-                )
-                await callback.answer()
-                return
+        # Получаем подписку
+        result = await session.execute(
+            select(Subscription)
+            .where(Subscription.id == subscription_id)
+            .where(Subscription.user_id == user.id)
+        )
+        subscription = result.scalar_one_or_none()
 
-            if subscription.status == "canceled":
-                await callback.message.answer(
-                    "❌ Платеж был отменён.\nПопробуйте оформить подписку снова."
-                )
-                await callback.answer()
-                return
+        if not subscription:
+            await callback.message.answer("❌ Подписка не найдена")
+            await callback.answer()
+            return
 
-            if subscription.status == "failed":
-                await callback.message.answer(
-                    "❌ Ошибка при оплате.\nПлатеж не прошёл."
+        # 💡 Теперь всё решает статус в БД, который выставляет ВЕБХУК
+        if subscription.status == "active":
+            await _check_payment(callback, subscription, URL)
+            if get_admin_ids():
+                await notify_admins(
+                    callback.bot,
+                    f"💸 Новая подписка!\n"
+                    f"👤 Пользователь: {user.full_name}\n"
+                    f"📧 @{user.username or 'нет'}\n"
+                    f"🆔 ID: {user.telegram_id}\n"
+                    f"💳 Тариф: {subscription.plan_name}\n"
+                    f"💰 Сумма: {subscription.price:.2f}₽",
+                    parse_mode="HTML"
                 )
-                await callback.answer()
-                return
+            await callback.answer()
+            return
 
+        if subscription.status in ["pending", "waiting_payment", None]:
             await callback.message.answer(
-                f"Статус подписки: {subscription.status}"
+                "⌛ Платеж еще не подтверждён.\n"
+                "Обычно это занимает несколько секунд.\n"
+                "Если оплата прошла — подождите немного."
             )
             await callback.answer()
+            return
 
-        except Exception as e:
-            logger.error(f"Ошибка проверки платежа: {str(e)}\", exc_info=True")
-            # await callback.message.answer("❌ Произошла ошибка при проверке платежа")
+        if subscription.status == "canceled":
+            await callback.message.answer(
+                "❌ Платеж был отменён.\nПопробуйте оформить подписку снова."
+            )
             await callback.answer()
+            return
 
+        if subscription.status == "failed":
+            await callback.message.answer(
+                "❌ Ошибка при оплате.\nПлатеж не прошёл."
+            )
+            await callback.answer()
+            return
 
-@router.callback_query(F.data == "my_subscription")
-async def my_subscription_handler(callback: types.CallbackQuery):
-    """Обработчик кнопки 'Моя подписка'"""
-    user_id = callback.from_user.id
+        await callback.message.answer(
+            f"Статус подписки: {subscription.status}"
+        )
+        await callback.answer()
 
-    async with get_db_session() as session:
-        try:
+    except Exception as e:
+        logger.error("Ошибка проверки платежа: %s", e, exc_info=True)
+        # await callback.message.answer("❌ Произошла ошибка при проверке платежа")
+        await callback.answer()
 
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
 
-            if not user:
-                await callback.answer("❌ Пользователь не найден. Используйте /start")
-                return
+@router.callback_query(F.data == "my_subscription")
+async def my_subscription_handler(callback: types.CallbackQuery, session: AsyncSession, db_user: User = None):
+    """Обработчик кнопки 'Моя подписка'"""
+    try:
+        user = db_user
+
+        if not user:
+            await callback.answer("❌ Пользователь не найден. Используйте /start")
+            return
 
-            result = await session.execute(
+        subscription = await get_active_subscription(session, user.id)
+        if subscription:
+            days_left = (subscription.end_date - datetime.utcnow()).days
+            await my_subscription(callback, subscription, days_left, subscription.auto_renew)
+        else:
+            inactive_result = await session.execute(
                 select(Subscription)
                 .where(Subscription.user_id == user.id)
-                .where(Subscription.status == 'active')
-                .where(Subscription.end_date > datetime.utcnow())
                 .order_by(Subscription.created_at.desc())
+                .limit(1)
             )
-            subscription = result.scalar_one_or_none()
-            if subscription:
-                days_left = (subscription.end_date - datetime.utcnow()).days
-                await my_subscription(callback, subscription, days_left, subscription.auto_renew)
+            inactive_sub = inactive_result.scalar_one_or_none()
+            if inactive_sub:
+                await my_subscription_inactive(callback, inactive_sub)
             else:
-                inactive_result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.user_id == user.id)
-                    .order_by(Subscription.created_at.desc())
-                )
-                inactive_sub = inactive_result.scalar_one_or_none()
-                if inactive_sub:
-                    await my_subscription_inactive(callback, inactive_sub)
-                else:
-                    await callback.message.answer("❌ У вас нет активных подписок")
+                await callback.message.answer("❌ У вас нет активных подписок")
 
-            await callback.answer()
+        await callback.answer()
 
-        except Exception as e:
-            print(f"❌ Ошибка в my_subscription_handler: {e}")
-            await callback.message.answer("❌ Произошла ошибка при получении информации о подписке")
-            await callback.answer()
+    except Exception as e:
+        print(f"❌ Ошибка в my_subscription_handler: {e}")
+        await callback.message.answer("❌ Произошла ошибка при получении информации о подписке")
+        await callback.answer()
 
 
 @router.callback_query(F.data == "back_to_main")
-async def back_to_main_handler(callback: types.CallbackQuery):
+async def back_to_main_handler(callback: types.CallbackQuery, session: AsyncSession, db_user: User = None):
     """Обработчик кнопки 'Назад' - возврат к главному меню"""
-    user_id = callback.from_user.id
-
-    async with get_db_session() as session:
-        try:
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
-
-            if user:
-                result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.user_id == user.id)
-                    .where(Subscription.status == 'active')
-                    .where(Subscription.end_date > datetime.utcnow())
-                )
-                has_active_sub = result.scalar_one_or_none() is not None
-                await back_main(callback, has_active_sub)
-            else:
-                has_active_sub = False
-                await back_main(callback, has_active_sub)
+    try:
+        if db_user:
+            has_active_sub = await check_active_subscription(db_user.id, session)
+        else:
+            has_active_sub = False
+        await back_main(callback, has_active_sub)
 
-            await callback.answer()
+        await callback.answer()
 
-        except Exception as e:
-            print(f"❌ Ошибка в back_to_main_handler: {e}")
-            await callback.message.answer("❌ Произошла ошибка")
-            await callback.answer()
+    except Exception as e:
+        print(f"❌ Ошибка в back_to_main_handler: {e}")
+        await callback.message.answer("❌ Произошла ошибка")
+        await callback.answer()
 
 
 @router.callback_query(F.data == "content")
-async def content_handler(callback: types.CallbackQuery):
+async def content_handler(callback: types.CallbackQuery, session: AsyncSession, db_user: User = None):
     """Обработчик кнопки 'Контент'"""
-    user_id = callback.from_user.id
-
-    async with get_db_session() as session:
-        try:
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user_id)
-            )
-            user = user_result.scalar_one_or_none()
-
-            if user:
-                result = await session.execute(
-                    select(Subscription)
-                    .where(Subscription.user_id == user.id)
-                    .where(Subscription.status == 'active')
-                    .where(Subscription.end_date > datetime.utcnow())
-                )
-                has_active_sub = result.scalar_one_or_none() is not None
-            else:
-                has_active_sub = False
+    try:
+        if db_user:
+            has_active_sub = await check_active_subscription(db_user.id, session)
+        else:
+            has_active_sub = False
 
-            if has_active_sub:
-                await _content_handler(callback, URL)
-            else:
-                await _content_handler_false(callback)
+        if has_active_sub:
+            await _content_handler(callback, URL)
+        else:
+            await _content_handler_false(callback)
 
-            await callback.answer()
+        await callback.answer()
 
-        except Exception as e:
-            print(f"❌ Ошибка в content_handler: {e}")
-            await callback.message.answer("❌ Произошла ошибка")
-            await callback.answer()
+    except Exception as e:
+        print(f"❌ Ошибка в content_handler: {e}")
+        await callback.message.answer("❌ Произошла ошибка")
+        await callback.answer()
 
 
 @router.message(Command("free_subscribe"))
-async def free_subscribe_handler(message: types.Message):
+async def free_subscribe_handler(message: types.Message, session: AsyncSession, db_user: User = None):
     """Подписаться на бесплатную рассылку"""
-    telegram_user = message.from_user.id
-    async with get_db_session() as session:
-        try:
-
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == telegram_user)
-            )
-            user = user_result.scalar_one_or_none()
+    try:
+        user = db_user
 
-            if not user:
-                await message.answer("❌ Пользователь не найден. Используйте /start")
-                return
+        if not user:
+            await message.answer("❌ Пользователь не найден. Используйте /start")
+            return
 
-                # Проверяем, есть ли у пользователя активная подписка
-            current_time = datetime.utcnow()
-            active_subscription = await session.execute(
-                select(Subscription)
-                .where(
-                    and_(
-                        Subscription.user_id == user.id,
-                        Subscription.status == 'active',
-                        Subscription.end_date > current_time
-                    )
-                )
+        # Проверяем, есть ли у пользователя активная подписка
+        if await check_active_subscription(user.id, session):
+            await message.answer(
+                "❌ У вас уже есть активная премиум подписка!\n"
+                "Бесплатная рассылка предназначена для пользователей без подписки."
             )
-            active_subscription = active_subscription.scalar()
+            return
 
-            if active_subscription:
-                await message.answer(
-                    "❌ У вас уже есть активная премиум подписка!\n"
-                    "Бесплатная рассылка предназначена для пользователей без подписки."
-                )
-                return
-
-            # Находим или создаем настройки пользователя
-            user_settings = await session.get(UserSettings, user.id)
-            if not user_settings:
-                user_settings = UserSettings(
-                    user_id=user.id,
-                    wants_free_posts=True
-                )
-                session.add(user_settings)
-            else:
-                user_settings.wants_free_posts = True
+        # Находим или создаем настройки пользователя
+        user_settings = await session.get(UserSettings, user.id)
+        if not user_settings:
+            user_settings = UserSettings(
+                user_id=user.id,
+                wants_free_posts=True
+            )
+            session.add(user_settings)
+        else:
+            user_settings.wants_free_posts = True
 
-            await session.commit()
+        await session.commit()
 
-            await message.answer(
-                "✅ Вы подписались на бесплатную рассылку!\n"
-                "Вы будете получать интересные посты каждый день в 14:00 утра.\n\n"
-                "💎 Чтобы получить доступ ко всему контенту, оформите премиум подписку"
-            )
-        except Exception as e:
-            print(f"❌ Ошибка в /free_subscribe: {e}")
-            await session.rollback()
-            await message.answer("Произошла ошибка. Попробуйте позже.")
+        await message.answer(
+            "✅ Вы подписались на бесплатную рассылку!\n"
+            "Вы будете получать интересные посты каждый день.\n\n"
+            "💎 Чтобы получить доступ ко всему контенту, оформите премиум подписку"
+        )
+    except Exception as e:
+        print(f"❌ Ошибка в /free_subscribe: {e}")
+        await session.rollback()
+        await message.answer("Произошла ошибка. Попробуйте позже.")
 
 
 @router.message(Command("free_unsubscribe"))
-async def free_unsubscribe_handler(message: types.Message):
+async def free_unsubscribe_handler(message: types.Message, session: AsyncSession):
     """Отписаться от бесплатной рассылки"""
     user_id = message.from_user.id
-    async with get_db_session() as session:
-        try:
-            user_settings = await session.get(UserSettings, user_id)
-            if user_settings:
-                user_settings.wants_free_posts = False
-                await session.commit()
+    try:
+        user_settings = await session.get(UserSettings, user_id)
+        if user_settings:
+            user_settings.wants_free_posts = False
+            await session.commit()
 
-            await message.answer(
-                "❌ Вы отписались от бесплатной рассылки.\n"
-                "Чтобы снова подписаться, используйте /free_subscribe\n\n"
-                "💎 Или оформите премиум подписку"
-            )
-        except Exception as e:
-            print(f"❌ Ошибка в /free_unsubscribe: {e}")
-            await message.answer("Произошла ошибка. Попробуйте позже.")
+        await message.answer(
+            "❌ Вы отписались от бесплатной рассылки.\n"
+            "Чтобы снова подписаться, используйте /free_subscribe\n\n"
+            "💎 Или оформите премиум подписку"
+        )
+    except Exception as e:
+        print(f"❌ Ошибка в /free_unsubscribe: {e}")
+        await message.answer("Произошла ошибка. Попробуйте позже.")
 
 
 @router.message(Command("free_stats"))
-async def free_stats_handler(message: types.Message):
+async def free_stats_handler(message: types.Message, session: AsyncSession):
     """Статистика бесплатной рассылки (для админов)"""
-    async with get_db_session() as session:
-        try:
-
-            if not await is_admin(message.from_user.id):
-                await message.answer("У вас нет прав для этой команды")
-                return
-
-            # Количество пользователей без подписки
-            users_without_sub = await FreePostService.get_users_without_subscription()
-
-            # Количество пользователей с истекшей подпиской
-            users_expired_sub = await FreePostService.get_users_with_expired_subscription()
+    try:
 
-            total_free_users = len(users_without_sub) + len(users_expired_sub)
+        if not await is_admin(message.from_user.id):
+            await message.answer("У вас нет прав для этой команды")
+            return
 
-            # Количество пользователей с активной подпиской
-            current_time = datetime.utcnow()
-            active_subs = await session.execute(
-                select(Subscription)
-                .where(
-                    and_(
-                        Subscription.status == 'active',
-                        Subscription.end_date > current_time
-                    )
-                )
-            )
-            active_subs_count = len(active_subs.scalars().all())
-
-            stats_text = (
-                "📊 <b>Статистика рассылок</b>\n\n"
-                f" <b>Пользователей с подпиской:</b> {active_subs_count}\n"
-                f" <b>Пользователей без подписки:</b> {total_free_users}\n"
-                f"   - Никогда не было подписки: {len(users_without_sub)}\n"
-                f"   - Подписка истекла: {len(users_expired_sub)}\n\n"
-                f" <b>Время бесплатной рассылки:</b> 14:00"
-            )
+        # Все счетчики и время рассылки одним запросом по users
+        current_time = datetime.utcnow()
+        has_access = exists().where(Entitlement.user_id == User.id, Entitlement.active_until > current_time)
+        wants_free = exists().where(UserSettings.user_id == User.id, UserSettings.wants_free_posts == True)
+        had_subscription = exists().where(Subscription.user_id == User.id)
+        post_time = (
+            select(FreeDailyPost.scheduled_time)
+            .where(FreeDailyPost.is_active == True)
+            .order_by(FreeDailyPost.created_at.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            select(
+                func.count().filter(has_access),
+                func.count().filter(wants_free, ~has_access, ~had_subscription),
+                func.count().filter(wants_free, ~has_access, had_subscription),
+                post_time,
+            ).select_from(User)
+        )
+        active_subs_count, never_subscribed, expired_count, post_time = result.one()
+        total_free_users = never_subscribed + expired_count
+        post_time = post_time or "—"
+
+        stats_text = (
+            "📊 <b>Статистика рассылок</b>\n\n"
+            f" <b>Пользователей с подпиской:</b> {active_subs_count}\n"
+            f" <b>Пользователей без подписки:</b> {total_free_users}\n"
+            f"   - Никогда не было подписки: {never_subscribed}\n"
+            f"   - Подписка истекла: {expired_count}\n\n"
+            f" <b>Время бесплатной рассылки:</b> {post_time} (по часовому поясу пользователя)"
+        )
 
-            await message.answer(stats_text, parse_mode="HTML")
+        await message.answer(stats_text, parse_mode="HTML")
 
-        except Exception as e:
-            print(f"❌ Ошибка в /free_stats: {e}")
-            await message.answer("Произошла ошибка. Попробуйте позже.")
+    except Exception as e:
+        print(f"❌ Ошибка в /free_stats: {e}")
+        await message.answer("Произошла ошибка. Попробуйте позже.")
 
 
 @router.callback_query(lambda c: c.data == "help")
@@ -836,77 +746,75 @@ async def get_file_id_handler(message: types.Message):
 
 
 @router.message(Command("list_free_posts"))
-async def list_free_posts_handler(message: types.Message):
+async def list_free_posts_handler(message: types.Message, session: AsyncSession):
     """Показать все активные посты для бесплатной рассылки"""
-    async with get_db_session() as session:
-        try:
-            if not await is_admin(message.from_user.id):
-                await message.answer("У вас нет прав для этой команды")
-                return
-
-            result = await session.execute(
-                select(FreeDailyPost)
-                .where(FreeDailyPost.is_active == True)
-                .order_by(FreeDailyPost.created_at.desc())
-            )
-            posts = result.scalars().all()
+    try:
+        if not await is_admin(message.from_user.id):
+            await message.answer("У вас нет прав для этой команды")
+            return
 
-            if not posts:
-                await message.answer("📭 Нет активных постов для бесплатной рассылки")
-                return
+        result = await session.execute(
+            select(FreeDailyPost)
+            .where(FreeDailyPost.is_active == True)
+            .order_by(FreeDailyPost.created_at.desc())
+        )
+        posts = result.scalars().all()
+
+        if not posts:
+            await message.answer("📭 Нет активных постов для бесплатной рассылки")
+            return
 
-            text = "📋 <b>Активные посты для бесплатной рассылки:</b>\n\n"
+        text = "📋 <b>Активные посты для бесплатной рассылки:</b>\n\n"
 
-            for i, post in enumerate(posts, 1):
-                has_photo = "📷" if post.photo_file_id else "📝"
-                text += (
-                    f"{i}. {has_photo} <b>ID:</b> {post.id}\n"
-                    f"   <b>Текст:</b> {post.content[:50]}...\n"
-                    f"   <b>Время:</b> {post.scheduled_time}\n"
-                    f"   <b>Создан:</b> {post.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
-                )
+        for i, post in enumerate(posts, 1):
+            has_photo = "📷" if post.photo_file_id else "📝"
+            text += (
+                f"{i}. {has_photo} <b>ID:</b> {post.id}\n"
+                f"   <b>Текст:</b> {post.content[:50]}...\n"
+                f"   <b>Время:</b> {post.scheduled_time}\n"
+                f"   <b>Создан:</b> {post.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+            )
 
-            await message.answer(text, parse_mode="HTML")
+        await message.answer(text, parse_mode="HTML")
 
-        except Exception as e:
-            print(f"❌ Ошибка в /list_free_posts: {e}")
-            await message.answer("Произошла ошибка.")
+    except Exception as e:
+        print(f"❌ Ошибка в /list_free_posts: {e}")
+        await message.answer("Произошла ошибка.")
 
 
 @router.message(Command("delete_free_post"))
-async def delete_free_post_handler(message: types.Message):
+async def delete_free_post_handler(message: types.Message, session: AsyncSession):
     """Удалить пост из бесплатной рассылки"""
-    async with get_db_session() as session:
-        try:
-            if not await is_admin(message.from_user.id):
-                await message.answer("У вас нет прав для этой команды")
-                return
-
-            args = message.text.split()
-            if len(args) < 2:
-                await message.answer(
-                    "Использование: /delete_free_post <ID_поста>\n"
-                    "Список постов: /list_free_posts"
-                )
-                return
+    try:
+        if not await is_admin(message.from_user.id):
+            await message.answer("У вас нет прав для этой команды")
+            return
 
-            post_id = int(args[1])
-            post = await session.get(FreeDailyPost, post_id)
+        args = message.text.split()
+        if len(args) < 2:
+            await message.answer(
+                "Использование: /delete_free_post <ID_поста>\n"
+                "Список постов: /list_free_posts"
+            )
+            return
 
-            if not post:
-                await message.answer("❌ Пост с таким ID не найден")
-                return
+        post_id = int(args[1])
+        post = await session.get(FreeDailyPost, post_id)
 
-            post.is_active = False
-            await session.commit()
+        if not post:
+            await message.answer("❌ Пост с таким ID не найден")
+            return
 
-            await message.answer(f"✅ Пост ID {post_id} деактивирован")
+        post.is_active = False
+        await session.commit()
 
-        except ValueError:
-            await message.answer("❌ Неверный формат ID. ID должен быть числом.")
-        except Exception as e:
-            print(f"❌ Ошибка в /delete_free_post: {e}")
-            await message.answer("Произошла ошибка.")
+        await message.answer(f"✅ Пост ID {post_id} деактивирован")
+
+    except ValueError:
+        await message.answer("❌ Неверный формат ID. ID должен быть числом.")
+    except Exception as e:
+        print(f"❌ Ошибка в /delete_free_post: {e}")
+        await message.answer("Произошла ошибка.")
 
 
 @router.message(Command("add_free_post"))
@@ -933,7 +841,7 @@ async def start_free_post_creation(message: types.Message, state: FSMContext):
         await state.set_state(FreePostCreation.waiting_for_photo)
 
     except Exception as e:
-        logger.error(f"❌ Ошибка в start_free_post_creation: {e}")
+        logger.error("❌ Ошибка в start_free_post_creation: %s", e)
         await message.answer("❌ Произошла непредвиденная ошибка. Попробуйте позже.")
 
 
@@ -947,7 +855,7 @@ async def cancel_creation(callback: types.CallbackQuery, state: FSMContext):
         await state.clear()
         await callback.answer()
     except Exception as e:
-        logger.error(f"❌ Ошибка при отмене создания поста: {e}")
+        logger.error("❌ Ошибка при отмене создания поста: %s", e)
         try:
             await callback.message.answer("❌ Создание поста отменено.")
         except:
@@ -984,7 +892,7 @@ async def safe_edit_message(callback: types.CallbackQuery, text: str, reply_mark
             raise Exception("Неизвестный тип сообщения")
 
     except Exception as edit_error:
-        logger.warning(f"⚠️ Не удалось отредактировать сообщение: {edit_error}")
+        logger.warning("⚠️ Не удалось отредактировать сообщение: %s", edit_error)
         try:
             # Пытаемся отправить новое сообщение
             if has_photo:
@@ -1002,7 +910,7 @@ async def safe_edit_message(callback: types.CallbackQuery, text: str, reply_mark
                     parse_mode=parse_mode
                 )
         except Exception as answer_error:
-            logger.error(f"❌ Не удалось отправить новое сообщение: {answer_error}")
+            logger.error("❌ Не удалось отправить новое сообщение: %s", answer_error)
             # Последняя попытка - просто текст
             try:
                 await callback.message.answer("❌ Ошибка отображения. Продолжаем...")
@@ -1029,7 +937,7 @@ async def process_photo_choice(callback: types.CallbackQuery, state: FSMContext)
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"❌ Ошибка в process_photo_choice: {e}")
+        logger.error("❌ Ошибка в process_photo_choice: %s", e)
         await callback.message.edit_text("❌ Произошла ошибка. Попробуйте снова.")
         await state.clear()
 
@@ -1050,7 +958,7 @@ async def process_post_photo(message: types.Message, state: FSMContext):
         await state.set_state(FreePostCreation.waiting_for_content)
 
     except Exception as e:
-        logger.error(f"❌ Ошибка в process_post_photo: {e}")
+        logger.error("❌ Ошибка в process_post_photo: %s", e)
         await message.answer("❌ Ошибка при обработке фото. Попробуйте еще раз.")
 
 
@@ -1070,7 +978,7 @@ async def process_post_content(message: types.Message, state: FSMContext):
         await state.set_state(FreePostCreation.confirming_post)
 
     except Exception as e:
-        logger.error(f"❌ Ошибка в process_post_content: {e}")
+        logger.error("❌ Ошибка в process_post_content: %s", e)
         await message.answer("❌ Ошибка при обработке текста. Попробуйте еще раз.")
 
 
@@ -1106,16 +1014,16 @@ async def show_post_preview(message: types.Message, data: dict):
             await message.answer(preview_text, reply_markup=builder.as_markup(), parse_mode="HTML")
 
     except Exception as e:
-        logger.error(f"❌ Ошибка в show_post_preview: {e}")
+        logger.error("❌ Ошибка в show_post_preview: %s", e)
         await message.answer("❌ Ошибка при создании превью. Попробуйте еще раз.")
 
 
 @router.callback_query(FreePostCreation.confirming_post, F.data.in_(["publish_post", "edit_content", "edit_photo"]))
-async def handle_confirmation_actions(callback: types.CallbackQuery, state: FSMContext):
+async def handle_confirmation_actions(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     """Обработка действий подтверждения с правильным редактированием"""
     try:
         if callback.data == "publish_post":
-            await publish_post(callback, state)
+            await publish_post(callback, state, session)
         elif callback.data == "edit_content":
             await safe_edit_message(
                 callback,
@@ -1133,7 +1041,7 @@ async def handle_confirmation_actions(callback: types.CallbackQuery, state: FSMC
         await callback.answer()
 
     except Exception as e:
-        logger.error(f"❌ Ошибка в handle_confirmation_actions: {e}")
+        logger.error("❌ Ошибка в handle_confirmation_actions: %s", e)
         # Если не удалось отредактировать, отправляем новое сообщение
         try:
             await callback.message.answer("❌ Произошла ошибка. Попробуйте снова.")
@@ -1142,38 +1050,37 @@ async def handle_confirmation_actions(callback: types.CallbackQuery, state: FSMC
         await state.clear()
 
 
-async def publish_post(callback: types.CallbackQuery, state: FSMContext):
+async def publish_post(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
     """Опубликовать пост"""
-    async with get_db_session() as session:
-        try:
-            data = await state.get_data()
-            content = data.get('content')
-            photo_file_id = data.get('photo_file_id')
+    try:
+        data = await state.get_data()
+        content = data.get('content')
+        photo_file_id = data.get('photo_file_id')
 
-            if not content:
-                await callback.message.edit_text("❌ Ошибка: текст поста отсутствует.")
-                await state.clear()
-                return
+        if not content:
+            await callback.message.edit_text("❌ Ошибка: текст поста отсутствует.")
+            await state.clear()
+            return
 
-            new_post = FreeDailyPost(content=content, photo_file_id=photo_file_id)
-            session.add(new_post)
-            await session.commit()
+        new_post = FreeDailyPost(content=content, photo_file_id=photo_file_id)
+        session.add(new_post)
+        await session.commit()
 
-            if photo_file_id:
-                await callback.message.answer_photo(
-                    photo=photo_file_id,
-                    caption=f"✅ <b>Пост с фото опубликован!</b>\n\n{content}",
-                    parse_mode="HTML"
-                )
-            else:
-                await callback.message.answer(f"✅ <b>Текстовый пост опубликован!</b>\n\n{content}", parse_mode="HTML")
+        if photo_file_id:
+            await callback.message.answer_photo(
+                photo=photo_file_id,
+                caption=f"✅ <b>Пост с фото опубликован!</b>\n\n{content}",
+                parse_mode="HTML"
+            )
+        else:
+            await callback.message.answer(f"✅ <b>Текстовый пост опубликован!</b>\n\n{content}", parse_mode="HTML")
 
-            await callback.message.delete()
-            await state.clear()
-            logger.info(f"✅ Новый пост опубликован (ID: {new_post.id})")
+        await callback.message.delete()
+        await state.clear()
+        logger.info("✅ Новый пост опубликован (ID: %s)", new_post.id)
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка публикации поста: {e}")
-            await session.rollback()
-            await callback.message.edit_text("❌ Ошибка при публикации поста. Попробуйте позже.")
-            await state.clear()
+    except Exception as e:
+        logger.error("❌ Ошибка публикации поста: %s", e)
+        await session.rollback()
+        await callback.message.edit_text("❌ Ошибка при публикации поста. Попробуйте позже.")
+        await state.clear()
@@ -1,288 +1,361 @@
-import asyncio
 import logging
 from datetime import datetime, timedelta
 
-from aiogram.types import Message
-from aiogram.filters import Command
-from aiogram import Router
-from sqlalchemy import select, desc
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from aiogram.filters import Command, CommandObject
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram import F, Router
+from sqlalchemy import select, desc, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from database import daily_stats
 from database.models import User, Subscription, InviteLink
-from database.session import get_db_session
+from database.subscriptions import subscriptions_page_query
 
-from helpers import is_admin
+from helpers import is_admin, format_daily_stats, sum_daily_stats, DAILY_STATS_LEGEND
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 router = Router()
 
 
+# Пагинация /all_subscriptions: keyset по (created_at, id), одна страница на нажатие.
+# callback_data: subs:<статус>:<план>:<направление>:<id якорной подписки>
+SUBSCRIPTIONS_PAGE_SIZE = 10
+SUBSCRIPTION_STATUS_FILTERS = ["all", "active", "pending", "expired", "canceled", "refunded"]
+SUBSCRIPTION_PLAN_FILTERS = ["all", "regular", "student"]
+STATUS_EMOJI = {'active': '✅', 'pending': '🟡', 'canceled': '❌', 'expired': '⏳', 'refunded': '↩️'}
+PAYMENT_EMOJI = {'completed': '💳', 'pending': '⏳', 'failed': '❌', 'refunded': '↩️'}
+
+
+async def _subscriptions_page(session, status: str, plan: str, direction: str, anchor_id: int):
+    """
+    Страница подписок, новые первыми. direction: first — первая страница, next — записи после
+    якоря (старше), prev — перед якорем (новее). Возвращает (rows, есть_новее, есть_старше).
+    """
+    # Лишняя запись показывает, есть ли еще страница в этом направлении
+    query = subscriptions_page_query(status, plan, direction, anchor_id, SUBSCRIPTIONS_PAGE_SIZE + 1)
+    rows = (await session.execute(query)).all()
+
+    has_more = len(rows) > SUBSCRIPTIONS_PAGE_SIZE
+    rows = rows[:SUBSCRIPTIONS_PAGE_SIZE]
+    if direction == "prev":
+        rows.reverse()
+        return rows, has_more, True
+    return rows, direction == "next", has_more
+
+
+def _format_subscriptions_page(rows, status: str, plan: str) -> str:
+    filters = []
+    if status != "all":
+        filters.append(f"статус {status}")
+    if plan != "all":
+        filters.append(f"план {plan}")
+    message_text = f"📋 <b>Подписки</b>{' (' + ', '.join(filters) + ')' if filters else ''}\n\n"
+
+    if not rows:
+        return message_text + "📭 Нет подписок."
+
+    for idx, sub in enumerate(rows, 1):
+        _, telegram_id, username, plan_type, plan_name, start_date, end_date, sub_status, payment_status, \
+            payment_id, created_at, updated_at = sub
+
+        # Форматируем даты
+        start_str = start_date.strftime("%d.%m.%Y") if start_date else "Не указана"
+        end_str = end_date.strftime("%d.%m.%Y") if end_date else "Не указана"
+        created_str = created_at.strftime("%d.%m.%Y %H:%M") if created_at else ""
+        updated_str = updated_at.strftime("%d.%m.%Y %H:%M") if updated_at else ""
+
+        message_text += (
+            f"<b>{idx}. Пользователь @{username or 'нет username'}</b>\n"
+            f"   👤 Telegram ID: <code>{telegram_id}</code>\n"
+            f"   📋 Тип: <code>{plan_type}</code>\n"
+            f"   📝 Название: <b>{plan_name}</b>\n"
+            f"   📅 Начало: <code>{start_str}</code>\n"
+            f"   📅 Окончание: <code>{end_str}</code>\n"
+            f"   📊 Статус: {STATUS_EMOJI.get(sub_status, '❓')} <code>{sub_status}</code>\n"
+            f"   💰 Платеж: {PAYMENT_EMOJI.get(payment_status, '❓')} <code>{payment_status}</code>\n"
+            f"   📝 ID платежа: <code>{payment_id or 'нет'}</code>\n"
+            f"   🕐 Создана: <code>{created_str}</code>\n"
+            f"   🔄 Обновлена: <code>{updated_str}</code>\n\n"
+        )
+    return message_text
+
+
+def _subscriptions_keyboard(rows, status: str, plan: str, has_newer: bool, has_older: bool) -> InlineKeyboardMarkup:
+    def data(status_: str, plan_: str, direction: str, anchor_id: int = 0) -> str:
+        return f"subs:{status_}:{plan_}:{direction}:{anchor_id}"
+
+    def cycle(values: list, current: str) -> str:
+        return values[(values.index(current) + 1) % len(values)]
+
+    builder = InlineKeyboardBuilder()
+    navigation = []
+    if rows and has_newer:
+        navigation.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=data(status, plan, "prev", rows[0][0])))
+    if rows and has_older:
+        navigation.append(InlineKeyboardButton(text="Старше ➡️", callback_data=data(status, plan, "next", rows[-1][0])))
+    if navigation:
+        builder.row(*navigation)
+    # Смена фильтра — с первой страницы
+    builder.row(
+        InlineKeyboardButton(text=f"Статус: {status}",
+                             callback_data=data(cycle(SUBSCRIPTION_STATUS_FILTERS, status), plan, "first")),
+        InlineKeyboardButton(text=f"План: {plan}",
+                             callback_data=data(status, cycle(SUBSCRIPTION_PLAN_FILTERS, plan), "first")),
+    )
+    builder.row(InlineKeyboardButton(text="🔄 В начало", callback_data=data(status, plan, "first")))
+    return builder.as_markup()
+
+
 @router.message(Command("all_subscriptions"))
-async def show_all_subscriptions(message: Message):
-    """Показывает все платные подписки (только для администраторов)"""
+async def show_all_subscriptions(message: Message, session: AsyncSession):
+    """Показывает платные подписки постранично с фильтрами (только для администраторов)"""
     user_id = message.from_user.id
 
     # Проверка прав администратора
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         logger.warning(f"Пользователь {user_id} попытался получить доступ к админ-команде")
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
 
     try:
-        async with get_db_session() as session:
-            # Получаем все подписки с информацией о пользователях
-            # JOIN с таблицей пользователей для получения telegram_id
-            query = select(
-                User.telegram_id,
-                User.username,
-                Subscription.plan_type,
-                Subscription.plan_name,
-                Subscription.start_date,
-                Subscription.end_date,
-                Subscription.status,
-                Subscription.payment_status,
-                Subscription.payment_id,
-                Subscription.created_at,
-                Subscription.updated_at
-            ).join(
-                User, User.id == Subscription.user_id
-            ).order_by(
-                desc(Subscription.created_at)  # Сначала новые
-            )
-
-            result = await session.execute(query)
-            subscriptions = result.fetchall()
-
-            if not subscriptions:
-                await message.answer("📭 Нет оформленных подписок.")
-                return
-
-            # Разбиваем вывод на части (Telegram ограничение на длину сообщения)
-            subscriptions_per_message = 10  # По 10 подписок в одном сообщении
-
-            for i in range(0, len(subscriptions), subscriptions_per_message):
-                batch = subscriptions[i:i + subscriptions_per_message]
-
-                message_text = f"📋 <b>Все подписки (часть {i // subscriptions_per_message + 1})</b>\n\n"
-
-                for idx, sub in enumerate(batch, 1):
-                    telegram_id, username, plan_type, plan_name, start_date, end_date, status, payment_status, payment_id, created_at, updated_at = sub
-
-                    # Форматируем даты
-                    start_str = start_date.strftime("%d.%m.%Y") if start_date else "Не указана"
-                    end_str = end_date.strftime("%d.%m.%Y") if end_date else "Не указана"
-                    created_str = created_at.strftime("%d.%m.%Y %H:%M") if created_at else ""
-                    updated_str = updated_at.strftime("%d.%m.%Y %H:%M") if updated_at else ""
-
-                    # Статус подписки с эмодзи
-                    status_emoji = {
-                        'active': '✅',
-                        'pending': '🟡',
-                        'canceled': '❌',
-                        'expired': '⏳'
-                    }.get(status, '❓')
-
-                    # Статус платежа с эмодзи
-                    payment_emoji = {
-                        'completed': '💳',
-                        'pending': '⏳',
-                        'failed': '❌',
-                        'refunded': '↩️'
-                    }.get(payment_status, '❓')
-
-                    message_text += (
-                        f"<b>{i + idx}. Пользователь @{username or 'нет username'}</b>\n"
-                        f"   👤 Telegram ID: <code>{telegram_id}</code>\n"
-                        f"   📋 Тип: <code>{plan_type}</code>\n"
-                        f"   📝 Название: <b>{plan_name}</b>\n"
-                        f"   📅 Начало: <code>{start_str}</code>\n"
-                        f"   📅 Окончание: <code>{end_str}</code>\n"
-                        f"   📊 Статус: {status_emoji} <code>{status}</code>\n"
-                        f"   💰 Платеж: {payment_emoji} <code>{payment_status}</code>\n"
-                        f"   📝 ID платежа: <code>{payment_id or 'нет'}</code>\n"
-                        f"   🕐 Создана: <code>{created_str}</code>\n"
-                        f"   🔄 Обновлена: <code>{updated_str}</code>\n\n"
-                    )
-
-                # Добавляем статистику
-                message_text += f"<i>Всего подписок: {len(subscriptions)}</i>\n"
-                message_text += f"<i>Активных: {sum(1 for s in subscriptions if s[5] == 'active')}</i>\n"
-                message_text += f"<i>Ожидающих оплаты: {sum(1 for s in subscriptions if s[5] == 'pending')}</i>"
-
-                await message.answer(message_text, parse_mode="HTML")
-
-                # Пауза между сообщениями, чтобы не спамить
-                if i + subscriptions_per_message < len(subscriptions):
-                    await asyncio.sleep(0.5)
-
-            logger.info(f"Админ {user_id} запросил список всех подписок. Выведено {len(subscriptions)} записей.")
+        rows, has_newer, has_older = await _subscriptions_page(session, "all", "all", "first", 0)
+        await message.answer(
+            _format_subscriptions_page(rows, "all", "all"),
+            parse_mode="HTML",
+            reply_markup=_subscriptions_keyboard(rows, "all", "all", has_newer, has_older)
+        )
+        logger.info(f"Админ {user_id} открыл список подписок.")
 
     except Exception as e:
         logger.error(f"Ошибка при получении списка подписок: {str(e)}", exc_info=True)
         await message.answer("❌ Произошла ошибка при получении списка подписок.")
 
 
+@router.callback_query(F.data.startswith("subs:"))
+async def subscriptions_page_callback(callback: CallbackQuery, session: AsyncSession):
+    """Страница /all_subscriptions по нажатию кнопки: сообщение редактируется на месте"""
+    if not await is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет прав", show_alert=True)
+        return
+
+    try:
+        _, status, plan, direction, anchor_id = callback.data.split(":")
+        anchor_id = int(anchor_id)
+    except ValueError:
+        await callback.answer()
+        return
+    if status not in SUBSCRIPTION_STATUS_FILTERS or plan not in SUBSCRIPTION_PLAN_FILTERS \
+            or direction not in ("first", "next", "prev"):
+        await callback.answer()
+        return
+
+    try:
+        rows, has_newer, has_older = await _subscriptions_page(session, status, plan, direction, anchor_id)
+        await callback.message.edit_text(
+            _format_subscriptions_page(rows, status, plan),
+            parse_mode="HTML",
+            reply_markup=_subscriptions_keyboard(rows, status, plan, has_newer, has_older)
+        )
+    except TelegramBadRequest as e:
+        # Повторное нажатие на ту же страницу
+        if "message is not modified" not in str(e):
+            logger.error(f"Ошибка при показе страницы подписок: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка при получении страницы подписок: {str(e)}", exc_info=True)
+    await callback.answer()
+
+
 @router.message(Command("active_subscriptions"))
-async def show_active_subscriptions(message: Message):
+async def show_active_subscriptions(message: Message, session: AsyncSession):
     """Показывает только активные подписки (только для администраторов)"""
     user_id = message.from_user.id
 
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
 
     try:
-        async with get_db_session() as session:
-            query = select(
-                User.telegram_id,
-                User.username,
-                Subscription.plan_type,
-                Subscription.plan_name,
-                Subscription.start_date,
-                Subscription.end_date,
-                Subscription.status,
-                Subscription.payment_status,
-                Subscription.payment_id
-            ).join(
-                User, User.id == Subscription.user_id
-            ).where(
-                Subscription.status == 'active'
-            ).order_by(
-                desc(Subscription.created_at)
-            )
+        query = select(
+            User.telegram_id,
+            User.username,
+            Subscription.plan_type,
+            Subscription.plan_name,
+            Subscription.start_date,
+            Subscription.end_date,
+            Subscription.status,
+            Subscription.payment_status,
+            Subscription.payment_id
+        ).join(
+            User, User.id == Subscription.user_id
+        ).where(
+            Subscription.status == 'active'
+        ).order_by(
+            desc(Subscription.created_at)
+        )
 
-            result = await session.execute(query)
-            subscriptions = result.fetchall()
+        result = await session.execute(query)
+        subscriptions = result.fetchall()
 
-            if not subscriptions:
-                await message.answer("📭 Нет активных подписок.")
-                return
+        if not subscriptions:
+            await message.answer("📭 Нет активных подписок.")
+            return
 
-            message_text = "✅ <b>Активные подписки</b>\n\n"
+        message_text = "✅ <b>Активные подписки</b>\n\n"
 
-            for idx, sub in enumerate(subscriptions, 1):
-                telegram_id, username, plan_type, plan_name, start_date, end_date, status, payment_status, payment_id = sub
+        for idx, sub in enumerate(subscriptions, 1):
+            telegram_id, username, plan_type, plan_name, start_date, end_date, status, payment_status, payment_id = sub
 
-                start_str = start_date.strftime("%d.%m.%Y") if start_date else "Не указана"
-                end_str = end_date.strftime("%d.%m.%Y") if end_date else "Не указана"
+            start_str = start_date.strftime("%d.%m.%Y") if start_date else "Не указана"
+            end_str = end_date.strftime("%d.%m.%Y") if end_date else "Не указана"
 
-                # Рассчитываем сколько дней осталось
-                days_left = "?"
-                if end_date:
-                    days_left = (end_date - datetime.utcnow()).days
-                    days_left = str(days_left) if days_left > 0 else "0"
+            # Рассчитываем сколько дней осталось
+            days_left = "?"
+            if end_date:
+                days_left = (end_date - datetime.utcnow()).days
+                days_left = str(days_left) if days_left > 0 else "0"
 
-                message_text += (
+            message_text += (
 
-                    f"<b>{idx}. Пользователь @{username or 'нет username'}</b>\n"
-                    f"   📋 id: <code>{telegram_id}</code> \n"
-                    f"   📋 Тип: <code>{plan_type}</code>\n"
-                    f"   📝 Название: <b>{plan_name}</b>\n"
-                    f"   📅 Начало: <code>{start_str}</code>\n"
-                    f"   📅 Окончание: <code>{end_str}</code>\n"
-                    f"   ⏳ Осталось дней: <code>{days_left}</code>\n"
-                    f"   💳 Платеж: <code>{payment_status}</code>\n\n"
-                )
+                f"<b>{idx}. Пользователь @{username or 'нет username'}</b>\n"
+                f"   📋 id: <code>{telegram_id}</code> \n"
+                f"   📋 Тип: <code>{plan_type}</code>\n"
+                f"   📝 Название: <b>{plan_name}</b>\n"
+                f"   📅 Начало: <code>{start_str}</code>\n"
+                f"   📅 Окончание: <code>{end_str}</code>\n"
+                f"   ⏳ Осталось дней: <code>{days_left}</code>\n"
+                f"   💳 Платеж: <code>{payment_status}</code>\n\n"
+            )
 
-            message_text += f"<i>Всего активных подписок: {len(subscriptions)}</i>"
+        message_text += f"<i>Всего активных подписок: {len(subscriptions)}</i>"
 
-            await message.answer(message_text, parse_mode="HTML")
-            logger.info(f"Админ {user_id} запросил список активных подписок.")
+        await message.answer(message_text, parse_mode="HTML")
+        logger.info(f"Админ {user_id} запросил список активных подписок.")
 
     except Exception as e:
         logger.error(f"Ошибка при получении активных подписок: {str(e)}", exc_info=True)
         await message.answer("❌ Произошла ошибка при получении активных подписок.")
 
 
+async def _subscription_stats(session, now: datetime) -> dict:
+    """
+    Счетчики по подпискам одним запросом: GROUPING SETS по status, payment_status и plan_type
+    плюс итоговая строка с общим числом, новыми за 30 дней и истекающими в ближайшие 7 дней.
+    """
+    # Бит grouping() = 1, если колонка в этой строке не группируется (status — старший бит)
+    by_status, by_payment, by_plan, total = 0b011, 0b101, 0b110, 0b111
+    result = await session.execute(
+        select(
+            func.grouping(Subscription.status, Subscription.payment_status, Subscription.plan_type),
+            Subscription.status,
+            Subscription.payment_status,
+            Subscription.plan_type,
+            func.count(),
+            func.count().filter(Subscription.created_at >= now - timedelta(days=30)),
+            func.count().filter(
+                Subscription.status == 'active',
+                Subscription.end_date <= now + timedelta(days=7),
+                Subscription.end_date > now,
+            ),
+        )
+        .group_by(func.grouping_sets(
+            tuple_(Subscription.status),
+            tuple_(Subscription.payment_status),
+            tuple_(Subscription.plan_type),
+            tuple_(),
+        ))
+        .order_by(func.count().desc())
+    )
+
+    stats = {"total": 0, "recent": 0, "expiring": 0, "status": {}, "payment_status": {}, "plan_type": {}}
+    for grouping, status, payment_status, plan_type, count, recent, expiring in result.all():
+        if grouping == by_status:
+            stats["status"][status] = count
+        elif grouping == by_payment:
+            stats["payment_status"][payment_status] = count
+        elif grouping == by_plan:
+            stats["plan_type"][plan_type] = count
+        elif grouping == total:
+            stats.update(total=count, recent=recent, expiring=expiring)
+    return stats
+
+
 @router.message(Command("subscription_stats"))
-async def show_subscription_stats(message: Message):
+async def show_subscription_stats(message: Message, session: AsyncSession):
     """Показывает статистику по подпискам (только для администраторов)"""
     user_id = message.from_user.id
 
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
 
     try:
-        async with get_db_session() as session:
-            # Общая статистика
-            total_query = select(Subscription)
-            total_result = await session.execute(total_query)
-            total_subs = total_result.fetchall()
-
-            # Статистика по статусам
-            status_stats = {}
-            payment_stats = {}
-            plan_type_stats = {}
-
-            # Подсчитываем статистику
-            for sub in total_subs:
-                subscription = sub[0]  # Извлекаем объект Subscription
-
-                # Статистика по статусам
-                status_stats[subscription.status] = status_stats.get(subscription.status, 0) + 1
-
-                # Статистика по платежам
-                payment_stats[subscription.payment_status] = payment_stats.get(subscription.payment_status, 0) + 1
-
-                # Статистика по типам планов
-                plan_type_stats[subscription.plan_type] = plan_type_stats.get(subscription.plan_type, 0) + 1
-
-            # Подписки за последние 30 дней
-            month_ago = datetime.utcnow() - timedelta(days=30)
-            recent_query = select(Subscription).where(Subscription.created_at >= month_ago)
-            recent_result = await session.execute(recent_query)
-            recent_subs = len(recent_result.fetchall())
-
-            # Подписки, истекающие в ближайшие 7 дней
-            week_later = datetime.utcnow() + timedelta(days=7)
-            expiring_query = select(Subscription).where(
-                Subscription.status == 'active',
-                Subscription.end_date <= week_later,
-                Subscription.end_date > datetime.utcnow()
-            )
-            expiring_result = await session.execute(expiring_query)
-            expiring_subs = len(expiring_result.fetchall())
+        stats = await _subscription_stats(session, datetime.utcnow())
 
-            # Формируем сообщение со статистикой
-            message_text = "📊 <b>Статистика подписок</b>\n\n"
+        # Формируем сообщение со статистикой
+        message_text = "📊 <b>Статистика подписок</b>\n\n"
 
-            message_text += f"📈 <b>Общая статистика:</b>\n"
-            message_text += f"   • Всего подписок: <b>{len(total_subs)}</b>\n"
-            message_text += f"   • За последние 30 дней: <b>{recent_subs}</b>\n"
-            message_text += f"   • Истекают через 7 дней: <b>{expiring_subs}</b>\n\n"
+        message_text += f"📈 <b>Общая статистика:</b>\n"
+        message_text += f"   • Всего подписок: <b>{stats['total']}</b>\n"
+        message_text += f"   • За последние 30 дней: <b>{stats['recent']}</b>\n"
+        message_text += f"   • Истекают через 7 дней: <b>{stats['expiring']}</b>\n\n"
 
-            message_text += f"📋 <b>Статусы подписок:</b>\n"
-            for status, count in status_stats.items():
-                emoji = {'active': '✅', 'pending': '🟡', 'canceled': '❌', 'expired': '⏳'}.get(status, '❓')
-                message_text += f"   • {emoji} {status}: <b>{count}</b>\n"
+        message_text += f"📋 <b>Статусы подписок:</b>\n"
+        for status, count in stats["status"].items():
+            emoji = {'active': '✅', 'pending': '🟡', 'canceled': '❌', 'expired': '⏳'}.get(status, '❓')
+            message_text += f"   • {emoji} {status}: <b>{count}</b>\n"
 
-            message_text += f"\n💳 <b>Статусы платежей:</b>\n"
-            for payment_status, count in payment_stats.items():
-                emoji = {'completed': '💳', 'pending': '⏳', 'failed': '❌'}.get(payment_status, '❓')
-                message_text += f"   • {emoji} {payment_status}: <b>{count}</b>\n"
+        message_text += f"\n💳 <b>Статусы платежей:</b>\n"
+        for payment_status, count in stats["payment_status"].items():
+            emoji = {'completed': '💳', 'pending': '⏳', 'failed': '❌'}.get(payment_status, '❓')
+            message_text += f"   • {emoji} {payment_status}: <b>{count}</b>\n"
 
-            message_text += f"\n🎯 <b>Типы планов:</b>\n"
-            for plan_type, count in plan_type_stats.items():
-                message_text += f"   • {plan_type}: <b>{count}</b>\n"
+        message_text += f"\n🎯 <b>Типы планов:</b>\n"
+        for plan_type, count in stats["plan_type"].items():
+            message_text += f"   • {plan_type}: <b>{count}</b>\n"
 
-            # Добавляем дату генерации отчета
-            message_text += f"\n<i>Отчет сгенерирован: {datetime.utcnow().strftime('%d.%m.%Y %H:%M')}</i>"
+        # Добавляем дату генерации отчета
+        message_text += f"\n<i>Отчет сгенерирован: {datetime.utcnow().strftime('%d.%m.%Y %H:%M')}</i>"
 
-            await message.answer(message_text, parse_mode="HTML")
-            logger.info(f"Админ {user_id} запросил статистику по подпискам.")
+        await message.answer(message_text, parse_mode="HTML")
+        logger.info(f"Админ {user_id} запросил статистику по подпискам.")
 
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {str(e)}", exc_info=True)
         await message.answer("❌ Произошла ошибка при получении статистики.")
 
 
+@router.message(Command("daily_stats"))
+async def show_daily_stats(message: Message, command: CommandObject, session: AsyncSession):
+    """Дневные счетчики из daily_stats за последние N дней (по умолчанию 14)"""
+    if not await is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    days = 14
+    if command.args and command.args.strip().isdigit():
+        days = max(1, min(int(command.args.strip()), 90))
+
+    start, end = daily_stats.day_range(days)
+    stats_by_day = await daily_stats.get_daily_stats(session, start, end)
+
+    lines = [f"📈 <b>Статистика по дням</b> (последние {days})\n"]
+    for offset in range(days):
+        day = end - timedelta(days=offset + 1)
+        lines.append(f"<b>{day.strftime('%d.%m')}</b> {format_daily_stats(stats_by_day.get(day, {}))}")
+    lines.append(f"\n<b>Итого:</b> {format_daily_stats(sum_daily_stats(stats_by_day))}")
+    lines.append(f"<i>{DAILY_STATS_LEGEND}</i>")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
 @router.message(Command("admin_help"))
 async def admin_help(message: Message):
     """Помощь по административным командам"""
     user_id = message.from_user.id
 
-    if not is_admin(user_id):
+    if not await is_admin(user_id):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
 
@@ -290,9 +363,10 @@ async def admin_help(message: Message):
 🔧 <b>Административные команды</b>
 
 📋 <b>Просмотр подписок:</b>
-• /all_subscriptions - Все подписки
+• /all_subscriptions - Все подписки (постранично, фильтры по статусу и плану)
 • /active_subscriptions - Только активные подписки
 • /subscription_stats - Статистика по подпискам
+• /daily_stats [дней] - Статистика по дням
 • /invite_stats - Статистика по ссылкам
 
 📊 <b>Управление:</b>
@@ -310,34 +384,29 @@ async def admin_help(message: Message):
 
 
 @router.message(Command("invite_stats"))
-async def invite_stats(message: Message):
+async def invite_stats(message: Message, session: AsyncSession):
     """Статистика по ссылкам"""
-    if not is_admin(message.from_user.id):
+    if not await is_admin(message.from_user.id):
         return
 
-    async with get_db_session() as session:
-        # Общая статистика
-        total_query = select(InviteLink)
-        total_result = await session.execute(total_query)
-        total = len(total_result.fetchall())
-
-        used_query = select(InviteLink).where(InviteLink.is_used == True)
-        used_result = await session.execute(used_query)
-        used = len(used_result.fetchall())
-
-        active_query = select(InviteLink).where(
-            InviteLink.is_used == False,
-            InviteLink.is_revoked == False,
-            InviteLink.expires_at > datetime.utcnow()
-        )
-        active_result = await session.execute(active_query)
-        active = len(active_result.fetchall())
-
-        await message.answer(
-            f"📊 <b>Статистика пригласительных ссылок:</b>\n\n"
-            f"• Всего создано: <b>{total}</b>\n"
-            f"• Использовано: <b>{used}</b>\n"
-            f"• Активных: <b>{active}</b>\n"
-            f"• Неиспользованных (истекших): <b>{total - used - active}</b>",
-            parse_mode="HTML"
-        )
+    result = await session.execute(
+        select(
+            func.count(),
+            func.count().filter(InviteLink.is_used == True),
+            func.count().filter(
+                InviteLink.is_used == False,
+                InviteLink.is_revoked == False,
+                InviteLink.expires_at > datetime.utcnow()
+            ),
+        ).select_from(InviteLink)
+    )
+    total, used, active = result.one()
+
+    await message.answer(
+        f"📊 <b>Статистика пригласительных ссылок:</b>\n\n"
+        f"• Всего создано: <b>{total}</b>\n"
+        f"• Использовано: <b>{used}</b>\n"
+        f"• Активных: <b>{active}</b>\n"
+        f"• Неиспользованных (истекших): <b>{total - used - active}</b>",
+        parse_mode="HTML"
+    )
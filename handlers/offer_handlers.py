@@ -1,9 +1,11 @@
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message, FSInputFile
+from aiogram.types import CallbackQuery, Message
 from aiogram.filters import Command
 import os
 import logging
 
+from servises.media_registry import media_registry
+
 router = Router()
 logger = logging.getLogger(__name__)
 
@@ -30,12 +32,12 @@ async def send_offer_pdf(callback: CallbackQuery):
             await callback.answer()
             return
 
-        # Отправляем PDF файл
-        pdf_file = FSInputFile(pdf_path, filename="public_offer.pdf")
-
-        await callback.bot.send_document(
-            chat_id=callback.message.chat.id,
-            document=pdf_file,
+        # Отправляем PDF файл (после первой загрузки — по file_id)
+        await media_registry.send_document(
+            callback.bot,
+            callback.message.chat.id,
+            pdf_path,
+            filename="public_offer.pdf",
             caption="📄 <b>Публичная оферта</b>\n\n"
                     "Документ содержит условия предоставления услуг.\n"
                     "Рекомендуем ознакомиться перед оплатой подписки.",
@@ -3,6 +3,8 @@ from typing import List, Tuple
 from aiogram import Bot
 
 from config import ADMIN_IDS
+from database import daily_stats
+from servises.broadcaster import Broadcaster, admin_rate_limiter
 
 
 def get_admin_ids() -> List[int]:
@@ -17,20 +19,48 @@ async def is_admin(user_id: int) -> bool:
 
 async def notify_admins(bot: Bot, message: str, parse_mode: str = "HTML",
                         reply_markup=None) -> Tuple[int, int]:
-    success_count = 0
-    fail_count = 0
-
-    for admin_id in get_admin_ids():
-        try:
-            await bot.send_message(
-                chat_id=admin_id,
-                text=message,
-                parse_mode=parse_mode,
-                reply_markup=reply_markup
-            )
-            success_count += 1
-        except Exception as e:
-            print(f"❌ Ошибка отправки уведомления админу {admin_id}: {e}")
-            fail_count += 1
-
-    return success_count, fail_count
+    async def send(admin_id: int):
+        await bot.send_message(
+            chat_id=admin_id,
+            text=message,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+
+    result = await Broadcaster("notify_admins", limiter=admin_rate_limiter, workers=2,
+                               progress_every=60).run(get_admin_ids(), send)
+    for admin_id, error in result.errors.items():
+        print(f"❌ Ошибка отправки уведомления админу {admin_id}: {error}")
+
+    return result.success, result.failed + result.blocked
+
+
+def format_daily_stats(day_stats: dict) -> str:
+    """Строка отчета по счетчикам одного дня (или суммы за период) из daily_stats"""
+    def total(metric: str) -> int:
+        return int(daily_stats.metric_total(day_stats, metric))
+
+    revenue = ", ".join(f"{value:.2f} {currency}" for (metric, currency), value in sorted(day_stats.items())
+                        if metric == daily_stats.REVENUE) or "0"
+    return (
+        f"👤 +{total(daily_stats.NEW_USERS)} "
+        f"💳 +{total(daily_stats.NEW_SUBSCRIPTIONS)} "
+        f"🔄 {total(daily_stats.RENEWALS)}/❌ {total(daily_stats.RENEWAL_FAILURES) + total(daily_stats.PAYMENT_FAILURES)} "
+        f"⏳ {total(daily_stats.EXPIRIES)} "
+        f"↩️ {total(daily_stats.REFUNDS)} "
+        f"🔗 {total(daily_stats.INVITES_USED)}/{total(daily_stats.INVITES_CREATED)} "
+        f"💰 {revenue}"
+    )
+
+
+def sum_daily_stats(stats_by_day: dict) -> dict:
+    """Сумма счетчиков за несколько дней: {(metric, dimension): value}"""
+    totals = {}
+    for day_stats in stats_by_day.values():
+        for key, value in day_stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+DAILY_STATS_LEGEND = ("👤 новые пользователи, 💳 новые подписки, 🔄 продления/❌ неуспешные платежи, "
+                      "⏳ истекли, ↩️ возвраты, 🔗 использовано/создано ссылок, 💰 выручка")
@@ -20,12 +20,13 @@ welcome_text = (
 )
 
 
-async def main_keyboard(message, sub_info, has_active_sub: bool = False):
-    async with get_db_session() as session:
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = user_result.scalar_one_or_none()
+async def main_keyboard(message, sub_info, has_active_sub: bool = False, user: User = None):
+    if user is None:
+        async with get_db_session() as session:
+            user_result = await session.execute(
+                select(User).where(User.telegram_id == message.from_user.id)
+            )
+            user = user_result.scalar_one_or_none()
 
     user_email = user.email if user else "не указан"
     """Создает главную клавиатуру"""
@@ -0,0 +1,39 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict
+
+# Поля корреляции текущей задачи asyncio (update_id, user_id, payment_id, ...)
+_log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+
+def get_log_context() -> Dict[str, Any]:
+    return _log_context.get()
+
+
+def bind_log_context(**fields: Any):
+    """Добавить поля к контексту до конца текущей задачи (каждый запрос aiohttp — своя задача)"""
+    fields = {key: value for key, value in fields.items() if value is not None}
+    if fields:
+        _log_context.set({**_log_context.get(), **fields})
+
+
+@contextmanager
+def log_context(**fields: Any):
+    """Поля контекста только внутри блока with"""
+    token = _log_context.set({**_log_context.get(),
+                              **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Копирует поля корреляции в запись; вешается на QueueHandler, т.е. работает в потоке вызова"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context:
+            record.context = context
+        return True
@@ -1,32 +1,66 @@
 import logging
-import inspect
+import sys
+import time
 from functools import wraps
+from inspect import iscoroutinefunction
 from typing import Optional
 
+from config import METRICS_ENABLED
+from log.metrics import registry
+
 
 def get_logger(name: Optional[str] = None):
     if name is None:
-        frame = inspect.currentframe().f_back
-        module = inspect.getmodule(frame)
-        name = module.__name__ if module else 'unknown'
+        # Имя модуля вызывающего кода без inspect.getmodule (тот перебирает sys.modules)
+        name = sys._getframe(1).f_globals.get('__name__', 'unknown')
 
     return logging.getLogger(name)
 
 
 def log_execution(logger_name: str = None):
+    """
+    Время выполнения функции пишется в гистограмму function_duration_seconds{function=...},
+    ошибки — в function_errors_total и в лог. Логгер и метрики получаются один раз при
+    декорировании; при METRICS_ENABLED=false функция возвращается без обертки.
+    """
     def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        logger = get_logger(logger_name or func.__module__)
+        function = f"{func.__module__}.{func.__qualname__}"
+        duration = registry.histogram("function_duration_seconds", "Время выполнения функции",
+                                      function=function)
+        errors = registry.counter("function_errors_total", "Исключения, вышедшие из функции",
+                                  function=function)
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    errors.inc()
+                    logger.error("Ошибка в %s: %s", func.__name__, e, exc_info=True)
+                    raise
+                finally:
+                    duration.observe(time.perf_counter() - start)
+
+            return async_wrapper
+
         @wraps(func)
-        async def async_wrapper(*args, **kwargs):
-            logger = get_logger(logger_name or func.__module__)
-            logger.debug(f"Начало выполнения {func.__name__}")
+        def sync_wrapper(*args, **kwargs):
+            start = time.perf_counter()
             try:
-                result = await func(*args, **kwargs)
-                logger.debug(f"Успешное завершение {func.__name__}")
-                return result
+                return func(*args, **kwargs)
             except Exception as e:
-                logger.error(f"Ошибка в {func.__name__}: {str(e)}", exc_info=True)
+                errors.inc()
+                logger.error("Ошибка в %s: %s", func.__name__, e, exc_info=True)
                 raise
+            finally:
+                duration.observe(time.perf_counter() - start)
 
-        return async_wrapper
+        return sync_wrapper
 
-    return decorator
\ No newline at end of file
+    return decorator
@@ -1,53 +1,152 @@
+import atexit
+import copy
 import logging
+import os
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from config import LOG_QUEUE_SIZE, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_SAMPLE_LEVEL
+from log.context import ContextFilter
+from log.structured import JsonFormatter, SamplingFilter, parse_sample_rates, resolve_fields
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
+# LOG_FORMAT=json — одна строка JSON на запись с полями контекста (update_id, payment_id, ...)
+FORMATTER = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(
+    fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler с ограниченной очередью: при переполнении запись отбрасывается
+    и учитывается в dropped, вызывающий поток (event loop) никогда не ждет диск.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_by_level = {}
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Сообщение и Lazy-поля вычисляются здесь, в потоке вызова (только для прошедших
+        уровень и сэмплирование записей). Трейсбек остается в exc_text, а не в тексте
+        сообщения, чтобы JSON-формат вынес его в отдельное поле.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = FORMATTER.formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        resolve_fields(record)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+                self.dropped_by_level[record.levelname] = self.dropped_by_level.get(record.levelname, 0) + 1
+
+
+class DropReportingListener(QueueListener):
+    """QueueListener, который пишет в лог число отброшенных записей, когда очередь разгрузилась"""
+
+    REPORT_INTERVAL = 10.0
+
+    def __init__(self, queue_handler: BoundedQueueHandler, *handlers: logging.Handler):
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.reported = queue_handler.dropped
+        self.reported_at = 0.0
+
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена — ждем, пока поток разгребет место (только при остановке)
+        self.queue.put(self._sentinel)
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        self.report_dropped()
+
+    def report_dropped(self, force: bool = False):
+        dropped = self.queue_handler.dropped
+        if dropped == self.reported:
+            return
+        # Отчет — когда очередь разгрузилась, и не чаще раза в REPORT_INTERVAL секунд
+        if not force and (self.queue.qsize() > self.queue.maxsize // 2
+                          or time.monotonic() - self.reported_at < self.REPORT_INTERVAL):
+            return
+        message = (f"Очередь логов переполнена: отброшено {dropped - self.reported} записей "
+                   f"(всего {dropped}, по уровням {self.queue_handler.dropped_by_level})")
+        self.reported = dropped
+        self.reported_at = time.monotonic()
+        super().handle(logging.LogRecord(__name__, logging.WARNING, __file__, 0, message, None, None))
+
+
+_queue_handler: Optional[BoundedQueueHandler] = None
+_listener: Optional[DropReportingListener] = None
+
+
+def _rotating_file_handler(filename: str, max_bytes: int, backup_count: int, level: int) -> RotatingFileHandler:
+    handler = RotatingFileHandler(
+        filename=LOG_DIR / filename,
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding='utf-8'
+    )
+    handler.setFormatter(FORMATTER)
+    handler.setLevel(level)
+    return handler
+
 
 def setup_logging():
-    """Настройка логирования для всего приложения"""
+    """
+    Настройка логирования для всего приложения.
+    Корневой логгер пишет только в ограниченную очередь, консоль и файлы с ротацией
+    обслуживает QueueListener в отдельном потоке. Повторный вызов ничего не делает.
+    """
+    global _queue_handler, _listener
+    if _listener is not None:
+        return
+
     root_logger = logging.getLogger()
     if root_logger.hasHandlers():
         root_logger.handlers.clear()
 
-    formatter = logging.Formatter(
-        fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
     # Хендлер для консоли
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(FORMATTER)
     console_handler.setLevel(logging.INFO)
 
     # Хендлер для файла (с ротацией)
-    file_handler = RotatingFileHandler(
-        filename=LOG_DIR / 'bot.log',
-        maxBytes=10 * 1024 * 1024,
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.DEBUG)
+    file_handler = _rotating_file_handler('bot.log', 10 * 1024 * 1024, 5, logging.DEBUG)
 
     # Хендлер для ошибок
-    error_handler = RotatingFileHandler(
-        filename=LOG_DIR / 'errors.log',
-        maxBytes=5 * 1024 * 1024,
-        backupCount=3,
-        encoding='utf-8'
-    )
-    error_handler.setFormatter(formatter)
-    error_handler.setLevel(logging.ERROR)
+    error_handler = _rotating_file_handler('errors.log', 5 * 1024 * 1024, 3, logging.ERROR)
+
+    _queue_handler = BoundedQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    # Фильтры работают до постановки в очередь: отброшенная сэмплингом запись ничего не стоит
+    _queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES),
+                                            logging.getLevelNamesMapping().get(LOG_SAMPLE_LEVEL, logging.DEBUG)))
+    _queue_handler.addFilter(ContextFilter())
+    _listener = DropReportingListener(_queue_handler, console_handler, file_handler, error_handler)
+    _listener.start()
 
     # Настраиваем корневой логгер
     root_logger.setLevel(logging.DEBUG)
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(error_handler)
+    root_logger.addHandler(_queue_handler)
 
     # Устанавливаем уровень для шумных библиотек
     logging.getLogger('aiogram').setLevel(logging.WARNING)
@@ -67,4 +166,102 @@ def setup_logging():
         logger.setLevel(logging.WARNING)
         logger.propagate = False
 
-    logging.info("Логирование настроено успешно")
\ No newline at end of file
+    atexit.register(shutdown_logging)
+    logging.info("Логирование настроено успешно")
+
+
+def add_log_file(filename: str, logger_name: Optional[str] = None, level: int = logging.INFO,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+    """
+    Дополнительный файл лога, обслуживаемый тем же фоновым потоком.
+    logger_name ограничивает файл записями этого логгера и его потомков.
+    """
+    setup_logging()
+    handler = _rotating_file_handler(filename, max_bytes, backup_count, level)
+    if logger_name:
+        handler.addFilter(logging.Filter(logger_name))
+    # Поток слушателя читает handlers на каждой записи, замена кортежа атомарна
+    _listener.handlers = _listener.handlers + (handler,)
+    return handler
+
+
+def use_worker_log_files(worker_id: int):
+    """
+    Отдельные файлы логов воркера main.run_workers: bot.log -> bot.worker0.log и т.д.
+    Файл с ротацией должен писать один процесс, иначе каждый ротирует его сам
+    и записи теряются или перемешиваются. Консоль остается общей.
+    """
+    setup_logging()
+    old_handlers = [handler for handler in _listener.handlers if isinstance(handler, RotatingFileHandler)]
+    handlers = []
+    for handler in _listener.handlers:
+        if isinstance(handler, RotatingFileHandler):
+            path = Path(handler.baseFilename)
+            worker_handler = _rotating_file_handler(f"{path.stem}.worker{worker_id}{path.suffix}",
+                                                    handler.maxBytes, handler.backupCount, handler.level)
+            for log_filter in handler.filters:
+                worker_handler.addFilter(log_filter)
+            handler = worker_handler
+        handlers.append(handler)
+    _listener.handlers = tuple(handlers)
+    # Общие файлы закрываем после замены, чтобы поток не открыл их заново
+    for handler in old_handlers:
+        handler.close()
+
+
+def get_logging_stats() -> dict:
+    if _queue_handler is None:
+        return {"queued": 0, "maxsize": LOG_QUEUE_SIZE, "dropped": 0, "dropped_by_level": {}, "sampled_out": 0}
+    sampled_out = sum(f.sampled_out for f in _queue_handler.filters if isinstance(f, SamplingFilter))
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "maxsize": _queue_handler.queue.maxsize,
+        "dropped": _queue_handler.dropped,
+        "dropped_by_level": dict(_queue_handler.dropped_by_level),
+        "sampled_out": sampled_out,
+    }
+
+
+def shutdown_logging():
+    """Дописать все, что осталось в очереди, и остановить фоновый поток"""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    listener.report_dropped(force=True)
+    for handler in listener.handlers:
+        handler.flush()
+        handler.close()
+    logging.getLogger().removeHandler(_queue_handler)
+
+
+def _stop_before_fork():
+    # Поток не должен держать блокировки файлов в момент fork — останавливаем его на время;
+    # буферы сбрасываем, чтобы дочерний процесс не дописал их копию второй раз
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.flush()
+
+
+def _start_after_fork_in_parent():
+    if _listener is not None:
+        _listener.start()
+
+
+def _start_after_fork_in_child():
+    global _listener
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+    _listener = DropReportingListener(_queue_handler, *_listener.handlers)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=_stop_before_fork,
+        after_in_parent=_start_after_fork_in_parent,
+        after_in_child=_start_after_fork_in_child,
+    )
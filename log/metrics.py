@@ -0,0 +1,188 @@
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+# Границы по умолчанию для латентности в секундах
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами (как в Prometheus)"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # последний — +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bucket_count in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if bucket_count and seen + bucket_count >= rank:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class Counter:
+    """Монотонный счетчик"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Gauge:
+    """Текущее значение (размер очереди, лаг и т.п.)"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+LabelsKey = Tuple[Tuple[str, str], ...]
+# Коллектор вызывается при каждом снятии метрик: (имя, тип, описание, метки, значение или Histogram)
+Sample = Tuple[str, str, str, Dict[str, str], Union[float, Histogram]]
+Collector = Callable[[], Iterable[Sample]]
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса: счетчики и гистограммы по имени и набору меток.
+    Метрику получают один раз (например, при декорировании) и дальше обновляют напрямую,
+    без поиска по реестру на каждом вызове.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Dict[LabelsKey, object]] = {}
+        self._kinds: Dict[str, str] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str = "", **labels: str) -> Counter:
+        return self._get(name, "counter", help, labels, Counter)
+
+    def histogram(self, name: str, help: str = "", buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+                  **labels: str) -> Histogram:
+        return self._get(name, "histogram", help, labels, lambda: Histogram(buckets))
+
+    def gauge(self, name: str, help: str = "", **labels: str) -> Gauge:
+        return self._get(name, "gauge", help, labels, Gauge)
+
+    def register_collector(self, collector: Collector):
+        """Источник значений, которые дешевле прочитать в момент снятия метрик (stats() сервисов)"""
+        self._collectors.append(collector)
+
+    def collect(self) -> Iterator[Tuple[str, str, str, Dict[LabelsKey, object]]]:
+        """(имя, тип, описание, {метки: метрика}) для всех зарегистрированных метрик"""
+        with self._lock:
+            items = [(name, dict(series)) for name, series in self._metrics.items()]
+        for name, series in items:
+            yield name, self._kinds[name], self._help.get(name, ""), series
+
+        for collector in list(self._collectors):
+            grouped: Dict[str, Tuple[str, str, Dict[LabelsKey, object]]] = {}
+            for name, kind, help, labels, value in collector():
+                key: LabelsKey = tuple(sorted((k, str(v)) for k, v in labels.items()))
+                if kind != "histogram":
+                    metric = Gauge() if kind == "gauge" else Counter()
+                    metric.value = value
+                    value = metric
+                grouped.setdefault(name, (kind, help, {}))[2][key] = value
+            for name, (kind, help, series) in grouped.items():
+                yield name, kind, help, series
+
+    def snapshot(self) -> dict:
+        result = {}
+        for name, kind, _, series in self.collect():
+            for labels, metric in series.items():
+                key = name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+                result[key] = metric.snapshot() if kind == "histogram" else metric.value
+        return result
+
+    def _get(self, name: str, kind: str, help: str, labels: Dict[str, str], factory):
+        key: LabelsKey = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        series = self._metrics.get(name)
+        metric = series.get(key) if series is not None else None
+        if metric is not None:
+            return metric
+        with self._lock:
+            known = self._kinds.setdefault(name, kind)
+            if known != kind:
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {known}")
+            if help:
+                self._help.setdefault(name, help)
+            return self._metrics.setdefault(name, {}).setdefault(key, factory())
+
+
+registry = MetricsRegistry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: LabelsKey, extra: LabelsKey = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(metrics: MetricsRegistry = registry) -> str:
+    """Текстовый формат Prometheus (exposition format 0.0.4)"""
+    lines = []
+    for name, kind, help, series in metrics.collect():
+        if help:
+            lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, metric in series.items():
+            if kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric.buckets, metric.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels, (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, (('le', '+Inf'),))} {metric.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(metric.sum)}")
+                lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {_number(metric.value)}")
+    return "\n".join(lines) + "\n"
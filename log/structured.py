@@ -0,0 +1,101 @@
+import json
+import logging
+import random
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict
+
+
+class Lazy:
+    """
+    Значение, вычисляемое только если запись действительно пишется:
+    logger.debug("Подписка: %s", Lazy(build_info, user_id)) или extra={"fields": {"info": Lazy(...)}}.
+    """
+
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func: Callable[..., Any], *args: Any, **kwargs: Any):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def resolve(self) -> Any:
+        return self.func(*self.args, **self.kwargs)
+
+    def __str__(self) -> str:
+        return str(self.resolve())
+
+
+def resolve_fields(record: logging.LogRecord):
+    """Вычислить Lazy-значения в record.fields (в потоке вызова, до передачи в очередь)"""
+    fields = getattr(record, "fields", None)
+    if fields:
+        record.fields = {key: value.resolve() if isinstance(value, Lazy) else value
+                         for key, value in fields.items()}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только долю записей уровня не выше max_level для заданных логгеров.
+    rates: {"payment.webhook_handler": 0.1, "handlers": 0.05} — действует и на потомков,
+    берется самый длинный совпавший префикс.
+    """
+
+    def __init__(self, rates: Dict[str, float], max_level: int = logging.DEBUG):
+        super().__init__()
+        self.rates = rates
+        self.max_level = max_level
+        self.sampled_out = 0
+        self._resolved: Dict[str, float] = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            best = -1
+            for prefix, prefix_rate in self.rates.items():
+                if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+                    rate, best = prefix_rate, len(prefix)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение, поля контекста и extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "context", None) or {})
+        payload.update(getattr(record, "fields", None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = record.stack_info
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """"handlers.commands=0.1,payment=0.5" -> {"handlers.commands": 0.1, "payment": 0.5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
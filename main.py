@@ -1,19 +1,38 @@
 import asyncio
+import multiprocessing
+import signal
+import sys
+from multiprocessing.connection import wait
 
 import logging
 
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 from yookassa import Configuration
 
-from checksub import check_subscriptions, send_daily_report
+from checksub import run_expiry_sweep, run_daily_report
 
-from config import bot, dp, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_URL, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, BOT_TOKEN
+from config import bot, dp, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_URL, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, BOT_TOKEN, \
+    EXPIRY_SWEEP_CRON, DAILY_REPORT_CRON, TELEGRAM_UPDATE_MODE, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_URL, \
+    TELEGRAM_WEBHOOK_SECRET, TELEGRAM_WEBHOOK_BACKGROUND, TELEGRAM_WEBHOOK_MAX_CONNECTIONS, BOT_WORKERS
 from handlers import commands, handler_admin, group_handlers, invite_handlers, offer_handlers
 
 from log.logger import get_logger
-from log.logging_config import setup_logging
+from middlewares import DbSessionMiddleware, LogContextMiddleware, TelegramApiMetricsMiddleware, \
+    setup_handler_metrics
+from log.logging_config import setup_logging, shutdown_logging, use_worker_log_files
 from payment.webhook_handler import webhook_handler
+from payment.yookassa_client import yookassa_client
+from servises.cache_bus import cache_bus
 from servises.free_scheduler import FreePostScheduler
+from servises.leader import LeaderElection
+from servises.health import health_monitor
+from servises.metrics import http_metrics_middleware, metrics_handler, register_default_collectors
+from servises.scheduler import JobScheduler
+from states.storage import PostgresStorage
+
+FSM_CHANNEL = "fsm_state"
 
 setup_logging()
 logger = get_logger(__name__)
@@ -31,60 +50,180 @@ except Exception as e:
     raise
 
 
-async def main():
+def setup_telegram_webhook(app: web.Application):
+    """Прием апдейтов Telegram на том же aiohttp-приложении, что и вебхук ЮКассы"""
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=TELEGRAM_WEBHOOK_BACKGROUND,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+    ).register(app, path=TELEGRAM_WEBHOOK_PATH)
+    # startup/shutdown диспетчера привязываются к жизненному циклу приложения
+    setup_application(app, dp, bot=bot)
+
+
+async def set_telegram_webhook():
+    if not TELEGRAM_WEBHOOK_URL:
+        raise RuntimeError("Для TELEGRAM_UPDATE_MODE=webhook нужен TELEGRAM_WEBHOOK_URL или WEBHOOK_URL")
+    await bot.set_webhook(
+        url=TELEGRAM_WEBHOOK_URL,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+    )
+    logger.info(f"Вебхук Telegram установлен: {TELEGRAM_WEBHOOK_URL}")
+
+
+async def main(worker_id: int = 0):
+    runner = None
     try:
 
-        logger.info("Запуск бота ...")
+        logger.info(f"Запуск бота (воркер {worker_id + 1}/{BOT_WORKERS}) ...")
+        if BOT_WORKERS > 1 and isinstance(dp.storage, MemoryStorage):
+            logger.warning("Состояния FSM хранятся в памяти воркера — диалоги могут теряться между воркерами")
+
+        # update_id/telegram_id в логах, одна сессия БД и один поиск пользователя на апдейт
+        dp.update.outer_middleware(LogContextMiddleware())
+        dp.update.outer_middleware(health_monitor.update_middleware)
+        dp.update.outer_middleware(DbSessionMiddleware())
 
-        dp.include_router(commands.router)
-        dp.include_router(handler_admin.router)
-        dp.include_router(group_handlers.router)
-        dp.include_router(invite_handlers.router)
-        dp.include_router(offer_handlers.router)
+        routers = [commands.router, handler_admin.router, group_handlers.router,
+                   invite_handlers.router, offer_handlers.router]
+        for router in routers:
+            dp.include_router(router)
         logger.info("Роутеры подключены")
 
+        # Метрики: время хендлеров и вызовов Bot API
+        setup_handler_metrics(*routers)
+        bot.session.middleware(TelegramApiMetricsMiddleware())
+        bot.session.middleware(health_monitor.api_middleware)
+
         # Создаем web-приложение для вебхуков ЮКассы
-        app = web.Application()
+        app = web.Application(middlewares=[http_metrics_middleware])
         app.router.add_post('/yookassa_webhook', webhook_handler.handle_webhook)
+        app.on_startup.append(webhook_handler.on_startup)
+        app.on_cleanup.append(webhook_handler.on_shutdown)
         logger.info("Вебхук для ЮКассы настроен")
 
-        async def health_check(request):
-            return web.json_response({"status": "ok", "service": "yookassa-bot"})
+        # live — перезапускать ли процесс, ready — пускать ли на него трафик
+        app.router.add_get('/health/live', health_monitor.live_handler)
+        app.router.add_get('/health/ready', health_monitor.ready_handler)
+        app.router.add_get('/status', health_monitor.ready_handler)
+        app.router.add_get('/metrics', metrics_handler)
+
+        use_webhook = TELEGRAM_UPDATE_MODE == "webhook"
+        if use_webhook:
+            setup_telegram_webhook(app)
+            logger.info(f"Вебхук Telegram настроен на {TELEGRAM_WEBHOOK_PATH}")
+
+        # Инициализируем планировщик фоновых задач
+        scheduler = JobScheduler()
+        scheduler.add_job("expiry_sweep", EXPIRY_SWEEP_CRON, run_expiry_sweep)
+        scheduler.add_job("daily_report", DAILY_REPORT_CRON, run_daily_report)
+        FreePostScheduler(bot).register(scheduler)
+
+        # Фоновые задачи выполняет только лидер (один на все воркеры и контейнеры)
+        leader = LeaderElection("scheduler")
+        leader_task = asyncio.create_task(leader.run(scheduler.start, on_lost=scheduler.stop))
+        health_monitor.watch("leader_election", leader_task)
+
+        register_default_collectors(
+            scheduler=scheduler,
+            leader=leader,
+            storage=dp.storage,
+            yookassa_clients={"service": yookassa_client, "webhook": webhook_handler.client},
+        )
+
+        # Инвалидации кэшей (подписки, FSM) из других воркеров
+        if isinstance(dp.storage, PostgresStorage):
+            cache_bus.subscribe(FSM_CHANNEL, dp.storage.forget, reset=dp.storage.forget_all)
+            dp.storage.on_flush = lambda key: cache_bus.publish(FSM_CHANNEL, key)
+        await cache_bus.start()
+
+        # Запускаем web-сервер; при нескольких воркерах все слушают один порт (SO_REUSEPORT)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT, reuse_port=BOT_WORKERS > 1)
+        await site.start()
+        logger.info(f"Web-сервер запущен на {WEBAPP_HOST}:{WEBAPP_PORT}")
+        health_monitor.start(TELEGRAM_UPDATE_MODE)
+
+        if use_webhook:
+            if worker_id == 0:
+                await set_telegram_webhook()
+            logger.info("Бот запущен в режиме webhook")
+            # Апдейты обрабатывает web-сервер, основной поток просто ждет остановки
+            await asyncio.Event().wait()
+        else:
+            # Вебхук, оставшийся от webhook-режима, блокирует getUpdates
+            await bot.delete_webhook()
+            logger.info("Бот запущен в режиме polling + web-сервер")
+            logger.info(f"Вебхук URL: {WEBHOOK_URL}")
+
+            # Запускаем polling (основной поток)
+            await dp.start_polling(bot)
 
-        app.router.add_get('/status', health_check)
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка: {e}", exc_info=True)
+        raise
+    finally:
+        # Корректное завершение
+        health_monitor.stop()
+        if 'leader' in locals():
+            leader.stop()
+        if 'scheduler' in locals():
+            scheduler.stop()
+        if runner is not None:
+            await runner.cleanup()
+        # Сбрасываем несохраненные состояния FSM до закрытия соединений
+        await dp.storage.close()
+        await cache_bus.close()
+        await yookassa_client.close()
+        await bot.session.close()
 
-        # Инициализируем планировщики
-        free_scheduler = FreePostScheduler(bot)
 
-        # Запускаем фоновые задачи
-        asyncio.create_task(check_subscriptions())
-        asyncio.create_task(send_daily_report())
-        asyncio.create_task(free_scheduler.start_free_posting())
+def run_worker(worker_id: int):
+    use_worker_log_files(worker_id)
+    # SIGTERM как Ctrl+C: asyncio.run отменит main() и отработают блоки finally
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(main(worker_id))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Дочерний процесс завершается через os._exit, atexit не вызывается
+        shutdown_logging()
 
-        # Запускаем web-сервер в фоне
-        async def run_web_server():
-            runner = web.AppRunner(app)
-            await runner.setup()
-            site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
-            await site.start()
-            logger.info(f"Web-сервер запущен на {WEBAPP_HOST}:{WEBAPP_PORT}")
 
-        asyncio.create_task(run_web_server())
+def run_workers(count: int):
+    """Запуск нескольких воркеров; если один упал — останавливаем всех, перезапуск делает docker"""
+    if TELEGRAM_UPDATE_MODE != "webhook":
+        raise RuntimeError("BOT_WORKERS > 1 поддерживается только с TELEGRAM_UPDATE_MODE=webhook")
 
-        logger.info("Бот запущен в режиме polling + web-сервер")
-        logger.info(f"Вебхук URL: {WEBHOOK_URL}")
+    workers = [multiprocessing.Process(target=run_worker, args=(i,), name=f"bot-worker-{i}")
+               for i in range(count)]
+    for process in workers:
+        process.start()
+    logger.info(f"Запущено воркеров: {count}")
 
-        # Запускаем polling (основной поток)
-        await dp.start_polling(bot)
+    def terminate(*_):
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
 
-    except Exception as e:
-        logger.error(f"❌ Критическая ошибка: {e}", exc_info=True)
-        raise
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        wait([process.sentinel for process in workers])
+    except KeyboardInterrupt:
+        pass
     finally:
-        # Корректное завершение
-        if 'free_scheduler' in locals():
-            free_scheduler.stop()
-        await bot.session.close()
+        terminate()
+        for process in workers:
+            process.join()
+
+    exit_codes = [process.exitcode for process in workers]
+    logger.info(f"Воркеры остановлены: {exit_codes}")
+    sys.exit(max(abs(code or 0) for code in exit_codes))
 
 
 if __name__ == "__main__":
@@ -92,4 +231,11 @@ if __name__ == "__main__":
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    asyncio.run(main())
+    if BOT_WORKERS > 1:
+        run_workers(BOT_WORKERS)
+    else:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,6 @@
+from middlewares.db import DbSessionMiddleware
+from middlewares.log_context import LogContextMiddleware
+from middlewares.metrics import HandlerMetricsMiddleware, TelegramApiMetricsMiddleware, setup_handler_metrics
+
+__all__ = ['DbSessionMiddleware', 'LogContextMiddleware', 'HandlerMetricsMiddleware',
+           'TelegramApiMetricsMiddleware', 'setup_handler_metrics']
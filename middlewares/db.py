@@ -0,0 +1,37 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import User
+from database.session import get_db_session
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию БД на апдейт и один раз находит пользователя.
+    В хендлеры передаются аргументы session и db_user (None, если пользователя нет в БД).
+    Регистрируется как outer-middleware на dp.update.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        async with get_db_session() as session:
+            data["session"] = session
+            data["db_user"] = await self._resolve_user(session, data.get("event_from_user"))
+            return await handler(event, data)
+
+    @staticmethod
+    async def _resolve_user(session: AsyncSession, telegram_user: TelegramUser):
+        if telegram_user is None:
+            return None
+        result = await session.execute(
+            select(User).where(User.telegram_id == telegram_user.id)
+        )
+        return result.scalar_one_or_none()
@@ -0,0 +1,26 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from log.context import log_context
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Добавляет update_id и telegram_id пользователя ко всем записям лога, сделанным
+    при обработке апдейта. Регистрируется первым outer-middleware на dp.update.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        telegram_user = data.get("event_from_user")
+        with log_context(
+                update_id=event.update_id if isinstance(event, Update) else None,
+                telegram_id=telegram_user.id if telegram_user else None,
+        ):
+            return await handler(event, data)
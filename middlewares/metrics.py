@@ -0,0 +1,90 @@
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import CallbackQuery, TelegramObject
+
+from log.metrics import registry
+
+_DIGITS = re.compile(r"\d+")
+
+
+def _callback_label(data: str) -> str:
+    # check_payment_123 -> check_payment_N: id не должны плодить серии метрик
+    return _DIGITS.sub("N", data)[:48]
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время работы хендлера: handler_duration_seconds{router, handler, event, callback}.
+    Вешается inner-middleware на наблюдатели роутера, поэтому видит уже выбранный хендлер.
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        labels = {
+            "router": getattr(callback, "__module__", "unknown"),
+            "handler": getattr(callback, "__qualname__", "unknown"),
+            "event": type(event).__name__,
+        }
+        if isinstance(event, CallbackQuery) and event.data:
+            labels["callback"] = _callback_label(event.data)
+
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            registry.counter("handler_errors_total", "Исключения в хендлерах", **labels).inc()
+            raise
+        finally:
+            registry.histogram("handler_duration_seconds", "Время обработки апдейта хендлером",
+                               **labels).observe(time.perf_counter() - start)
+
+
+def setup_handler_metrics(*routers: Router):
+    middleware = HandlerMetricsMiddleware()
+    for router in routers:
+        for event_name, observer in router.observers.items():
+            if event_name not in ("update", "error"):
+                observer.middleware(middleware)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Вызовы Bot API: telegram_api_duration_seconds{method}, telegram_api_errors_total{method, error},
+    telegram_retry_after_total{method}. Регистрируется через bot.session.middleware(...).
+    """
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            registry.counter("telegram_retry_after_total", "Ответы RetryAfter (флуд-лимит)", method=name).inc()
+            registry.counter("telegram_api_errors_total", "Ошибки Bot API",
+                             method=name, error="TelegramRetryAfter").inc()
+            raise
+        except TelegramAPIError as e:
+            registry.counter("telegram_api_errors_total", "Ошибки Bot API",
+                             method=name, error=type(e).__name__).inc()
+            raise
+        finally:
+            registry.histogram("telegram_api_duration_seconds", "Время запроса к Bot API",
+                               method=name).observe(time.perf_counter() - start)
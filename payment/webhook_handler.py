@@ -1,14 +1,17 @@
+import asyncio
 import json
 import hmac
 import hashlib
 from decimal import Decimal
 from datetime import datetime
+from typing import Dict
 
-import aiohttp
 from aiohttp import web
 
-from config import YOOKASSA_SECRET_KEY, USERNAME_CHANNEL, YOOKASSA_SHOP_ID
+from config import YOOKASSA_SECRET_KEY, USERNAME_CHANNEL, YOOKASSA_SHOP_ID, YOOKASSA_WEBHOOK_POOL_LIMIT
+from log.context import bind_log_context
 from log.logger import get_logger
+from payment.yookassa_client import YooKassaClient
 
 from database.webhook_repository import WebhookRepository
 from database.session import get_db_session
@@ -22,6 +25,25 @@ class WebhookHandler:
         self.secret_key = YOOKASSA_SECRET_KEY
         self.repo = WebhookRepository()
         self.shop_id = YOOKASSA_SHOP_ID
+        # Отдельный пул соединений к API, чтобы пачка вебхуков не мешала созданию платежей
+        self.client = YooKassaClient(pool_limit=YOOKASSA_WEBHOOK_POOL_LIMIT)
+        # payment_id -> задача проверки: одновременные уведомления по одному платежу делят один запрос
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def on_startup(self, app: web.Application):
+        await self.client.start()
+
+    async def on_shutdown(self, app: web.Application):
+        await self.client.close()
+
+    async def fetch_payment(self, payment_id: str) -> dict:
+        """Актуальное состояние платежа из API (с объединением параллельных запросов)"""
+        task = self._inflight.get(payment_id)
+        if task is None:
+            task = asyncio.ensure_future(self.client.find_payment(payment_id))
+            self._inflight[payment_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(payment_id, None))
+        return await asyncio.shield(task)
 
     def verify_webhook(self, body: bytes, signature: str) -> bool:
         """
@@ -51,29 +73,21 @@ class WebhookHandler:
                 payment_id = obj.get("id")
             elif event == "refund.succeeded":
                 payment_id = obj.get("payment_id")
-                logger.info(f"RAW OBJECT: {obj}")
+                logger.debug("RAW OBJECT: %s", obj)
             else:
-                logger.warning(f"Неизвестный event: {event}")
-                logger.info(f"RAW OBJECT: {obj}")
+                logger.warning("Неизвестный event: %s", event)
+                logger.debug("RAW OBJECT: %s", obj)
                 return web.Response(status=400, text="Unknown event")
 
+            # payment_id попадет во все записи лога этого запроса
+            bind_log_context(event=event, payment_id=payment_id)
+
             if not payment_id:
                 logger.warning("Webhook без payment id")
-                logger.info(f"RAW OBJECT: {obj}")
+                logger.debug("RAW OBJECT: %s", obj)
                 return web.Response(status=400, text="Missing payment id")
 
-            url = f"https://api.yookassa.ru/v3/payments/{payment_id}"
-
-            timeout = aiohttp.ClientTimeout(total=10)
-            auth = aiohttp.BasicAuth(login=self.shop_id, password=self.secret_key)
-
-            async with aiohttp.ClientSession(timeout=timeout, auth=auth) as session:
-                async with session.get(url) as resp:
-
-                    if resp.status < 200 or resp.status >= 300:
-                        text = await resp.text()
-                        raise RuntimeError(f"YooKassa API error: {resp.status}, body={text[:500]}")
-                    actual = await resp.json()
+            actual = await self.fetch_payment(payment_id)
 
             if payment_id != actual.get("id"):
                 return web.Response(status=400, text="Missmatch payment id")
@@ -84,11 +98,11 @@ class WebhookHandler:
             # Попытка пометить обработанным (атомарно). Если уже есть — прекращаем обработку.
             marked = await self.repo.try_mark_processed(payment_id, event)
             if not marked:
-                logger.info(f"Webhook {payment_id} уже обработан — пропускаем")
+                logger.info("Webhook %s уже обработан — пропускаем", payment_id)
 
                 return web.Response(status=200, text="Already processed")
 
-            logger.info(f"Webhook received: event={event}, payment={payment_id}")
+            logger.info("Webhook received: event=%s, payment=%s", event, payment_id)
 
             # Роутинг событий
             if event == "payment.succeeded":
@@ -98,12 +112,12 @@ class WebhookHandler:
             elif event == "refund.succeeded":
                 await self._handle_refund_succeeded(obj)
             else:
-                logger.info(f"Unhandled event type: {event}")
+                logger.info("Unhandled event type: %s", event)
 
             return web.Response(status=200, text="OK")
 
         except Exception as e:
-            logger.exception(f"Ошибка обработки вебхука: {e}")
+            logger.exception("Ошибка обработки вебхука: %s", e)
             return web.Response(status=500, text="Internal error")
 
     # ----------------------------
@@ -116,7 +130,7 @@ class WebhookHandler:
         amount = Decimal((payment_data.get("amount") or {}).get("value") or "0")
 
         if not user_id:
-            logger.warning(f"Payment {payment_id} missing user_id in metadata")
+            logger.warning("Payment %s missing user_id in metadata", payment_id)
             return
 
         # Автоплатёж — продлеваем по subscription_id из metadata
@@ -125,26 +139,43 @@ class WebhookHandler:
             if subscription_id:
                 ok = await self.repo.extend_subscription_by_id(subscription_id, days=30)
                 if ok:
-                    logger.info(f"Subscription {subscription_id} extended by auto_payment (payment={payment_id})")
+                    logger.info("Subscription %s extended by auto_payment (payment=%s)", subscription_id, payment_id)
                     # Если нужно — можно извлечь user id и уведомить
                     result = await self.repo.get_subscription_by_id(subscription_id)
                     if result:
                         await self._add_user_to_group(result.user_id)
                 else:
-                    logger.warning(f"auto_payment: subscription {subscription_id} not found (payment={payment_id})")
+                    logger.warning("auto_payment: subscription %s not found (payment=%s)", subscription_id, payment_id)
+            else:
+                logger.warning("auto_payment without subscription_id (payment=%s)", payment_id)
+            return
+
+        # Автосписание биллингового крона (script/billing_cron.py): обычно его уже учел крон,
+        # но после ответа pending или ошибки связи продлевать подписку должен вебхук
+        if metadata.get("purpose") == "subscription_recurring":
+            subscription_id = metadata.get("subscription_id")
+            if not subscription_id:
+                logger.warning("Recurring payment %s without subscription_id", payment_id)
+                return
+            currency = (payment_data.get("amount") or {}).get("currency")
+            telegram_id = await self.repo.apply_recurring_payment(int(subscription_id), payment_id, amount, currency)
+            if telegram_id:
+                logger.info("Subscription %s renewed by recurring payment %s", subscription_id, payment_id)
+                await self._add_user_to_group(telegram_id)
             else:
-                logger.warning(f"auto_payment without subscription_id (payment={payment_id})")
+                logger.info("Recurring payment %s for subscription %s already applied",
+                            payment_id, subscription_id)
             return
 
         # Инициативный платеж — создаем новую подписку или активируем существующую платежную запись
         existing = await self.repo.get_subscription_by_payment(payment_id)
         if existing:
             await self.repo.activate_subscription(existing, payment_data)
-            logger.info(f"Existing subscription (id={existing.id}) activated for payment {payment_id}")
+            logger.info("Existing subscription (id=%s) activated for payment %s", existing.id, payment_id)
             await self._add_user_to_group(existing.user_id)
         else:
             sub = await self.repo.create_subscription(user_id, plan_type, payment_id, amount, payment_data)
-            logger.info(f"New subscription created id={sub.id} for user {user_id} (payment={payment_id})")
+            logger.info("New subscription created id=%s for user %s (payment=%s)", sub.id, user_id, payment_id)
             await self._add_user_to_group(user_id)
 
     async def _handle_payment_canceled(self, payment_data: dict):
@@ -156,7 +187,7 @@ class WebhookHandler:
         user_id = (payment_data.get("metadata") or {}).get("user_id")
         if user_id:
             await self._remove_user_from_group(user_id)
-        logger.info(f"Payment canceled processed for {payment_id}")
+        logger.info("Payment canceled processed for %s", payment_id)
 
     async def _handle_refund_succeeded(self, payment_data: dict):
         # refund object may include 'payment_id' referencing original payment
@@ -168,7 +199,7 @@ class WebhookHandler:
         subscription = await self.repo.get_subscription_by_payment(original_payment)
         if subscription:
             await self._remove_user_from_group(subscription.user_id)
-        logger.info(f"Refund processed for original payment {original_payment}")
+        logger.info("Refund processed for original payment %s", original_payment)
 
     # ----------------------------
     async def _add_user_to_group(self, user_id: int):
@@ -178,18 +209,18 @@ class WebhookHandler:
             # await bot.unban_chat_member(chat_id=USERNAME_CHANNEL, user_id=user_id)
             await bot.send_message(chat_id=user_id,
                                    text="✅ Ваша подписка активирована! Добро пожаловать в закрытую группу!")
-            logger.info(f"User {user_id} added to group")
+            logger.info("User %s added to group", user_id)
         except Exception as e:
-            logger.exception(f"Error adding user {user_id} to group: {e}")
+            logger.exception("Error adding user %s to group: %s", user_id, e)
 
     async def _remove_user_from_group(self, user_id: int):
         try:
             from main import bot
             await bot.ban_chat_member(chat_id=USERNAME_CHANNEL, user_id=user_id)
             await bot.send_message(chat_id=user_id, text="❌ Ваша подписка была отменена. Доступ к группе закрыт.")
-            logger.info(f"User {user_id} removed from group")
+            logger.info("User %s removed from group", user_id)
         except Exception as e:
-            logger.exception(f"Error removing user {user_id} from group: {e}")
+            logger.exception("Error removing user %s from group: %s", user_id, e)
 
 
 # экспорт экземпляра
@@ -0,0 +1,126 @@
+import asyncio
+import time
+import uuid
+from typing import Dict, Optional
+
+import aiohttp
+
+from config import (
+    YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, YOOKASSA_API_URL, YOOKASSA_TIMEOUT,
+    YOOKASSA_MAX_RETRIES, YOOKASSA_POOL_LIMIT
+)
+from log.logger import get_logger
+from log.metrics import Histogram
+
+logger = get_logger(__name__)
+
+# Статусы, при которых запрос можно безопасно повторить с тем же Idempotence-Key
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    def __init__(self, status: int, body: str):
+        super().__init__(f"YooKassa API error: {status}, body={body[:500]}")
+        self.status = status
+        self.body = body
+
+
+class YooKassaClient:
+    """
+    Асинхронный клиент API ЮKassa на общей aiohttp-сессии с keep-alive.
+    POST-запросы повторяются с тем же Idempotence-Key, поэтому повтор не создаст второй платеж.
+    """
+
+    def __init__(
+            self,
+            shop_id: str = YOOKASSA_SHOP_ID,
+            secret_key: str = YOOKASSA_SECRET_KEY,
+            base_url: str = YOOKASSA_API_URL,
+            timeout: float = YOOKASSA_TIMEOUT,
+            max_retries: int = YOOKASSA_MAX_RETRIES,
+            pool_limit: int = YOOKASSA_POOL_LIMIT
+    ):
+        self.shop_id = shop_id
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.pool_limit = pool_limit
+        self.latency: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                base_url=self.base_url + "/",
+                auth=aiohttp.BasicAuth(login=self.shop_id or "", password=self.secret_key or ""),
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_limit, keepalive_timeout=60),
+                headers={"Content-Type": "application/json"}
+            )
+        return self._session
+
+    async def start(self):
+        """Создает сессию заранее (при старте приложения), а не на первом запросе"""
+        self._get_session()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # ------------------------
+    # Операции
+    # ------------------------
+    async def create_payment(self, payload: dict, idempotence_key: str = None) -> dict:
+        return await self._request("POST", "payments", "create_payment", payload,
+                                   idempotence_key or str(uuid.uuid4()))
+
+    async def find_payment(self, payment_id: str) -> dict:
+        return await self._request("GET", f"payments/{payment_id}", "find_payment")
+
+    async def create_refund(self, payload: dict, idempotence_key: str = None) -> dict:
+        return await self._request("POST", "refunds", "create_refund", payload,
+                                   idempotence_key or str(uuid.uuid4()))
+
+    def stats(self) -> dict:
+        return {
+            "latency": {op: hist.snapshot() for op, hist in self.latency.items()},
+            "errors": dict(self.errors),
+        }
+
+    # ------------------------
+    async def _request(self, method: str, path: str, operation: str,
+                       payload: dict = None, idempotence_key: str = None) -> dict:
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        histogram = self.latency.setdefault(operation, Histogram())
+
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                async with self._get_session().request(method, path, json=payload, headers=headers) as resp:
+                    body = await resp.text()
+                    histogram.observe(time.perf_counter() - started)
+
+                    if 200 <= resp.status < 300:
+                        return await resp.json(content_type=None)
+
+                    error = YooKassaError(resp.status, body)
+                    if resp.status not in RETRY_STATUSES:
+                        self.errors[operation] = self.errors.get(operation, 0) + 1
+                        raise error
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                histogram.observe(time.perf_counter() - started)
+                error = e
+
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+            if attempt == self.max_retries:
+                raise error
+
+            delay = min(0.5 * 2 ** attempt, 8)
+            logger.warning(f"ЮKassa {operation}: попытка {attempt + 1} не удалась ({error}), повтор через {delay} с")
+            await asyncio.sleep(delay)
+
+
+# общий клиент на процесс
+yookassa_client = YooKassaClient()
@@ -3,13 +3,16 @@ import uuid
 from datetime import datetime, timedelta
 from decimal import Decimal
 from aiogram.client.session import aiohttp
-from yookassa import Payment, Configuration
+from yookassa import Configuration
 from sqlalchemy import select, update
 from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, YOOKASSA_WEBHOOK_URL, URL, URL_BOT, RETURN_URL
 from log.logger import get_logger, log_execution
 
-from database.models import Subscription, WebhookEvent
+from database.entitlements import get_current_subscription, refresh_entitlements
+from database.models import Subscription, User, WebhookEvent
 from database.session import get_db_session
+from payment.yookassa_client import yookassa_client
+from servises.subscription_cache import subscription_cache
 
 logger = logging.getLogger(__name__)
 try:
@@ -47,7 +50,7 @@ class YooKassaService:
             YooKassaService._ensure_configured()
             logger.info(f"Создание автоподписки для пользователя {user_id}, план: {plan_data['plan_name']}")
             idempotence_key = str(uuid.uuid4())
-            payment = Payment.create({
+            payment = await yookassa_client.create_payment({
                 "amount": {
                     "value": f"{plan_data['price']:.2f}",
                     "currency": "RUB"
@@ -87,8 +90,8 @@ class YooKassaService:
                 }
             }, idempotence_key)
 
-            logger.info(f"Платеж создан: {payment.id}, статус: {payment.status}")
-            return payment.confirmation.confirmation_url, payment.id
+            logger.info(f"Платеж создан: {payment['id']}, статус: {payment['status']}")
+            return payment["confirmation"]["confirmation_url"], payment["id"]
 
         except Exception as e:
             logger.error(f"Ошибка создания автоподписки для {user_id}: {str(e)}", exc_info=True)
@@ -118,11 +121,13 @@ class YooKassaService:
                 payment_method = payment_data.get("payment_method") or {}
                 payment_method_id = payment_method.get("id")
 
-                # Найдём подписку по payment_id или по metadata (если раньше сохранили)
+                # Найдём подписку по payment_id или по metadata (если раньше сохранили);
+                # у пользователя может быть несколько подписок — берем совпавшую по payment_id, иначе последнюю
                 result = await session.execute(
                     select(Subscription).where(
                         (Subscription.payment_id == payment_id) | (Subscription.user_id == user_id)
-                    )
+                    ).order_by((Subscription.payment_id == payment_id).desc(), Subscription.created_at.desc())
+                    .limit(1)
                 )
                 subscription = result.scalar_one_or_none()
 
@@ -167,11 +172,17 @@ class YooKassaService:
                     session.add(sub)
                     logger.info(f"Создана подписка для user={user_id}, sub_id={sub.id}")
 
+                await session.flush()
+                await refresh_entitlements(session, [subscription.user_id if subscription else user_id])
+
                 # Сохраняем обработанный вебхук (идемпотентность)
                 new_ev = WebhookEvent(payment_id=payment_id, event_type=payment_data.get("status", "payment.succeeded"))
                 session.add(new_ev)
                 logger.info(f"WebHookEvent создан для payment {payment_id}")
 
+            # Сессия закоммичена при выходе из контекста — сбрасываем кэш статуса
+            subscription_cache.invalidate(subscription.user_id if subscription else user_id)
+
         except Exception as e:
             logger.error(f"Ошибка при сохранении payment_method из вебхука: {e}", exc_info=True)
             raise
@@ -185,26 +196,19 @@ class YooKassaService:
         try:
             YooKassaService._ensure_configured()
             async with get_db_session() as session:
-                # Ищем активную подписку с включенным автосписанием
-                result = await session.execute(
-                    select(Subscription).where(
-                        Subscription.user_id == user_id,
-                        Subscription.status == 'active',
-                        Subscription.auto_renew == True,
-                        Subscription.payment_method.isnot(None)
-                    )
-                )
-                subscription = result.scalar_one_or_none()
+                # Действующая подписка пользователя (через entitlements) с включенным автосписанием
+                subscription = await get_current_subscription(session, user_id)
 
-                if not subscription.payment_method:
+                if not subscription or not subscription.auto_renew or not subscription.payment_method:
                     error_msg = f"Нет активной подписки с методом оплаты для пользователя {user_id}"
                     logger.warning(error_msg)
                     raise Exception(error_msg)
 
                 logger.debug(f"Найден метод оплаты: {subscription.payment_method}")
+                user = await session.get(User, subscription.user_id)
 
                 # Создаем автоплатеж
-                payment = Payment.create({
+                payment = await yookassa_client.create_payment({
                     "amount": {
                         "value": f"{float(subscription.price):.2f}",
                         "currency": subscription.currency or "RUB"
@@ -218,7 +222,7 @@ class YooKassaService:
                     },
                     "receipt": {
                         "customer": {
-                            "email": subscription.user.email
+                            "email": user.email
                         },
                         "items": [
                             {
@@ -236,8 +240,8 @@ class YooKassaService:
                     }
                 }, str(uuid.uuid4()))
 
-                logger.info(f"Автоплатеж создан: {payment.id}, статус: {payment.status}")
-                return payment.id, payment.status
+                logger.info(f"Автоплатеж создан: {payment['id']}, статус: {payment['status']}")
+                return payment["id"], payment["status"]
 
         except Exception as e:
             logger.error(f"Ошибка автоплатежа для {user_id}: {str(e)}", exc_info=True)
@@ -266,6 +270,10 @@ class YooKassaService:
                     logger.warning(f"Не найдено активных подписок для отмены у пользователя {user_id}")
                     return False
 
+                await refresh_entitlements(session, [user_id])
+                await session.commit()
+                subscription_cache.invalidate(user_id)
+
                 logger.info(f"Автоплатежи отменены для пользователя {user_id}")
                 return True
 
@@ -273,13 +281,28 @@ class YooKassaService:
             logger.error(f"Ошибка отмены автоплатежей для {user_id}: {str(e)}", exc_info=True)
             return False
 
+    @staticmethod
+    @log_execution(__name__)
+    async def refund_payment(payment_id: str, amount: Decimal, currency: str = "RUB"):
+        """Возврат платежа"""
+        YooKassaService._ensure_configured()
+        refund = await yookassa_client.create_refund({
+            "payment_id": payment_id,
+            "amount": {
+                "value": f"{amount:.2f}",
+                "currency": currency
+            }
+        })
+        logger.info(f"Возврат {refund['id']} по платежу {payment_id}, статус: {refund['status']}")
+        return refund["id"], refund["status"]
+
     @staticmethod
     async def get_payment_method_id(payment_id: str):
         """Получаем ID привязанного метода оплаты"""
         try:
             YooKassaService._ensure_configured()
-            payment = Payment.find_one(payment_id)
-            return payment.payment_method.id if payment.payment_method else None
+            payment = await yookassa_client.find_payment(payment_id)
+            return (payment.get("payment_method") or {}).get("id")
         except Exception as e:
             logger.error(f"Ошибка получения метода оплаты: {e}")
             return None
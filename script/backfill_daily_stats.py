@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Пересчет daily_stats из истории (users, subscriptions, billing_attempts, invite_links).
+
+    python script/backfill_daily_stats.py                                # вся история до сегодня
+    python script/backfill_daily_stats.py --start 2026-01-01 --end 2026-02-01
+
+Дни [start, end) заменяются целиком одной транзакцией. Сегодняшний день по умолчанию
+не трогаем: его счетчики пишутся событиями и точнее восстановленных.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import date
+
+from database import daily_stats
+from database.session import get_db_session, use_null_pool
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+
+async def run(start: date, end: date):
+    async with get_db_session() as session:
+        if start is None:
+            start = await daily_stats.get_history_start(session)
+            if start is None:
+                logging.info("Нет данных для пересчета")
+                return
+        if start >= end:
+            logging.info("Пустой диапазон %s — %s", start, end)
+            return
+        rows = await daily_stats.backfill_daily_stats(session, start, end)
+    logging.info("daily_stats пересчитаны за %s — %s: %d строк", start, end, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет daily_stats из истории")
+    parser.add_argument("--start", type=date.fromisoformat, default=None,
+                        help="первый день (по умолчанию — первый день с пользователями)")
+    parser.add_argument("--end", type=date.fromisoformat, default=None,
+                        help="день после последнего (по умолчанию — сегодня, не включая)")
+    args = parser.parse_args()
+
+    use_null_pool()
+    asyncio.run(run(args.start, args.end or daily_stats.today()))
+
+
+if __name__ == "__main__":
+    main()
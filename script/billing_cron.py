@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
-import os
 import sys
-import uuid
+import time
+import asyncio
 import logging
+from dataclasses import dataclass, field
 from datetime import date
 import config
 import psycopg  # psycopg3
-import requests
+
+from database.entitlements import refresh_entitlements_sql
+from payment.yookassa_client import YooKassaClient
+from servises.broadcaster import TokenBucket
 
 
 # ===================== Конфиг =====================
@@ -39,7 +43,8 @@ logging.basicConfig(
 
 # ===================== Работа с ЮKassa =====================
 
-def charge_saved_method(
+async def charge_saved_method(
+    client: YooKassaClient,
     user_id: int,
     yk_payment_method_id: str,
     amount: str,
@@ -50,10 +55,9 @@ def charge_saved_method(
     Выполняет автосписание через ЮKassa по сохранённому способу оплаты.
     Возвращает JSON-ответ ЮKassa (или бросает исключение при HTTP-ошибке).
     """
-    url = "https://api.yookassa.ru/v3/payments"
-
-    # Идемпотентный ключ: завяжем на подписку и сегодняшнюю дату.
-    idempotence_key = f"sub-{subscription_id}-{date.today().isoformat()}-{uuid.uuid4()}"
+    # Идемпотентный ключ: завяжем на подписку и сегодняшнюю дату,
+    # чтобы повтор запроса (или повторный запуск крона в тот же день) не списал деньги дважды.
+    idempotence_key = f"sub-{subscription_id}-{date.today().isoformat()}"
 
     payload = {
         "amount": {
@@ -78,24 +82,7 @@ def charge_saved_method(
         currency,
     )
 
-    resp = requests.post(
-        url,
-        json=payload,
-        auth=(config.YOOKASSA_SHOP_ID, config.YOOKASSA_SECRET_KEY),
-        headers={"Idempotence-Key": idempotence_key},
-        timeout=30,
-    )
-
-    # Если код ответа не 2xx — это ошибка на уровне HTTP
-    if not (200 <= resp.status_code < 300):
-        logging.error(
-            "HTTP ошибка ЮKassa: status=%s, body=%s",
-            resp.status_code,
-            resp.text,
-        )
-        resp.raise_for_status()
-
-    data = resp.json()
+    data = await client.create_payment(payload, idempotence_key)
     status = data.get("status")
     logging.info("Ответ ЮKassa: payment_id=%s, status=%s", data.get("id"), status)
 
@@ -104,7 +91,7 @@ def charge_saved_method(
 
 # ===================== Работа с БД =====================
 
-def get_due_subscriptions(conn) -> list[dict]:
+async def get_due_subscriptions(conn) -> list[dict]:
     """
     Возвращает список подписок, которые нужно списать сегодня.
     Фильтр: auto_renew=True и next_payment_date = текущая дата.
@@ -134,14 +121,16 @@ def get_due_subscriptions(conn) -> list[dict]:
         next_payment_date
         FROM subscriptions
         WHERE auto_renew = True
-          AND next_payment_date:: date = CURRENT_DATE
+          -- диапазон вместо next_payment_date::date, чтобы работал ix_subscription_renew_next_payment
+          AND next_payment_date >= CURRENT_DATE
+          AND next_payment_date < CURRENT_DATE + 1
     """
 
     subs: list[dict] = []
 
-    with conn.cursor() as cur:
-        cur.execute(query)
-        rows = cur.fetchall()
+    async with conn.cursor() as cur:
+        await cur.execute(query)
+        rows = await cur.fetchall()
 
         for row in rows:
             (
@@ -182,9 +171,51 @@ def get_due_subscriptions(conn) -> list[dict]:
     return subs
 
 
-def move_next_payment_date(conn, subscription_id: int, subscription_type: str):
+# Одно соединение делят параллельные задачи: транзакции и записи вне их не должны перемежаться
+DB_LOCK = asyncio.Lock()
+
+# Кэш статуса подписки в процессах бота (servises/cache_bus.py, формат "источник|user_id");
+# уведомление уходит при commit
+NOTIFY_SUBSCRIPTION_CACHE_QUERY = "SELECT pg_notify('subscription_cache', 'billing_cron|' || %(user_id)s)"
+
+
+# Счетчик daily_stats за текущий день UTC (см. database/daily_stats.py)
+RECORD_STAT_QUERY = """
+    INSERT INTO daily_stats (day, metric, dimension, value)
+    VALUES ((now() at time zone 'utc')::date, %s, %s, %s)
+    ON CONFLICT (day, metric, dimension) DO UPDATE SET value = daily_stats.value + EXCLUDED.value
+"""
+
+
+async def record_stat(cur, metric: str, value=1, dimension: str = ""):
+    await cur.execute(RECORD_STAT_QUERY, (metric, dimension, value))
+
+
+async def refresh_entitlement(cur, user_id: int):
+    # Те же запросы, что database/entitlements.refresh_entitlements, скомпилированные для psycopg
+    for query, params in refresh_entitlements_sql([user_id]):
+        await cur.execute(query, params)
+    await cur.execute(NOTIFY_SUBSCRIPTION_CACHE_QUERY, {"user_id": user_id})
+
+
+RECORD_ATTEMPT_QUERY = """
+    INSERT INTO billing_attempts (subscription_id, payment_id, status, error, latency_ms, created_at)
+    VALUES (%s, %s, %s, %s, %s, now() at time zone 'utc')
+"""
+
+
+# Платеж учитывается ровно один раз: продление и успешная попытка пишутся одной транзакцией
+# под блокировкой подписки, а вебхук payment.succeeded (payment/webhook_handler.py)
+# продлевает подписку, только если успешной попытки с этим payment_id еще нет
+LOCK_SUBSCRIPTION_QUERY = "SELECT id FROM subscriptions WHERE id = %s FOR NO KEY UPDATE"
+
+PAYMENT_SUCCEEDED_QUERY = "SELECT 1 FROM billing_attempts WHERE payment_id = %s AND status = 'succeeded'"
+
+
+async def move_next_payment_date(conn, subscription_id: int, subscription_type: str, payment_id: str,
+                                 latency_ms: int = None):
     """
-    Сдвигает next_payment_date в зависимости от типа подписки.
+    Сдвигает next_payment_date в зависимости от типа подписки и продлевает доступ до новой даты.
     По умолчанию — на 1 месяц (если тип неизвестен).
     """
     interval_str = INTERVAL_MAP.get(subscription_type, "1 month")
@@ -195,19 +226,36 @@ def move_next_payment_date(conn, subscription_id: int, subscription_type: str):
         interval_str,
     )
 
+    # В SET обе колонки считаются от старого next_payment_date
     query = """
         UPDATE subscriptions
-        SET next_payment_date = next_payment_date + CAST(%s AS INTERVAL)
+        SET next_payment_date = next_payment_date + CAST(%s AS INTERVAL),
+            end_date = GREATEST(end_date, next_payment_date + CAST(%s AS INTERVAL)),
+            updated_at = now() at time zone 'utc'
         WHERE id = %s
+        RETURNING user_id, price, currency
     """
 
-    with conn.cursor() as cur:
-        cur.execute(query, (interval_str, subscription_id))
+    async with DB_LOCK, conn.transaction(), conn.cursor() as cur:
+        await cur.execute(LOCK_SUBSCRIPTION_QUERY, (subscription_id,))
+        await cur.execute(PAYMENT_SUCCEEDED_QUERY, (payment_id,))
+        if await cur.fetchone():
+            logging.info("Платеж %s уже учтен вебхуком: subscription_id=%s", payment_id, subscription_id)
+            return
 
+        await cur.execute(RECORD_ATTEMPT_QUERY, (subscription_id, payment_id, "succeeded", None, latency_ms))
+        await cur.execute(query, (interval_str, interval_str, subscription_id))
+        row = await cur.fetchone()
+        if row:
+            user_id, price, currency = row
+            await refresh_entitlement(cur, user_id)
+            await record_stat(cur, "renewals")
+            await record_stat(cur, "revenue", price, currency or "RUB")
 
-def mark_subscription_failed(conn, subscription_id: int, reason: str):
+
+async def mark_subscription_failed(conn, subscription_id: int, reason: str):
     """
-    Помечает подписку как 'failed' (или можно сделать поле last_error и т.п.).
+    Отклоненное автосписание: подписка истекает, автопродление выключается.
     """
     logging.warning(
         "Помечаем подписку как failed: subscription_id=%s, reason=%s",
@@ -215,70 +263,140 @@ def mark_subscription_failed(conn, subscription_id: int, reason: str):
         reason,
     )
 
+    # updated_at — день истечения для script/backfill_daily_stats.py
     query = """
         UPDATE subscriptions
-        SET status = 'expired', auto_renew = False
+        SET status = 'expired', auto_renew = False, updated_at = now() at time zone 'utc'
         WHERE id = %s
+        RETURNING user_id
     """
 
-    with conn.cursor() as cur:
-        cur.execute(query, (subscription_id,))
+    async with DB_LOCK, conn.transaction(), conn.cursor() as cur:
+        await cur.execute(query, (subscription_id,))
+        row = await cur.fetchone()
+        if row:
+            await refresh_entitlement(cur, row[0])
+            await record_stat(cur, "renewal_failures")
+            await record_stat(cur, "expiries")
+
+
+async def record_attempt(conn, subscription_id: int, payment_id: str, status: str,
+                         error: str = None, latency_ms: int = None):
+    """
+    Сохраняет попытку списания в billing_attempts.
+    """
+    async with DB_LOCK, conn.cursor() as cur:
+        await cur.execute(RECORD_ATTEMPT_QUERY, (subscription_id, payment_id, status, error, latency_ms))
 
 
 # ===================== Основная логика =====================
 
-def main():
-    logging.info("=== Запуск биллингового крона ===")
+@dataclass
+class BillingReport:
+    succeeded: int = 0
+    declined: int = 0
+    pending: int = 0
+    errors: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def process_subscription(conn, client, limiter, semaphore, sub: dict, report: BillingReport):
+    sub_id = sub["sub_id"]
+
+    async with semaphore:
+        await limiter.acquire()
+        started = time.perf_counter()
+        try:
+            payment = await charge_saved_method(
+                client,
+                user_id=sub["user_id"],
+                yk_payment_method_id=sub["payment_method"],
+                # ЮKassa ожидает строку для amount
+                amount=f"{sub['price']:.2f}",
+                currency=sub["currency"],
+                subscription_id=sub_id,
+            )
+        except Exception as e:
+            latency = time.perf_counter() - started
+            report.latencies.append(latency)
+            report.errors += 1
+            logging.exception(
+                "Ошибка при попытке списания: subscription_id=%s, error=%s",
+                sub_id,
+                e,
+            )
+            # Платеж мог быть создан до обрыва: исход решит вебхук или повторный запуск
+            # (тот же ключ идемпотентности вернет тот же платеж), подписку не трогаем
+            await record_attempt(conn, sub_id, None, "error", str(e), int(latency * 1000))
+            return
+
+    latency = time.perf_counter() - started
+    report.latencies.append(latency)
+    latency_ms = int(latency * 1000)
+    status = payment.get("status")
+
+    if status == "succeeded":
+        report.succeeded += 1
+        # Всё хорошо — переносим next_payment_date
+        await move_next_payment_date(conn, sub_id, sub["plan_type"], payment.get("id"), latency_ms)
+    elif status == "canceled":
+        # ЮKassa отклонила платеж
+        report.declined += 1
+        await record_attempt(conn, sub_id, payment.get("id"), status, None, latency_ms)
+        await mark_subscription_failed(conn, sub_id, reason=f"Payment status {status}")
+    else:
+        # pending / waiting_for_capture: окончательный статус придет вебхуком
+        report.pending += 1
+        logging.info("Платеж %s в статусе %s, ждем вебхук: subscription_id=%s", payment.get("id"), status, sub_id)
+        await record_attempt(conn, sub_id, payment.get("id"), status, None, latency_ms)
+
+
+async def run() -> BillingReport:
+    report = BillingReport()
+    client = YooKassaClient(pool_limit=config.BILLING_CONCURRENCY)
+    limiter = TokenBucket(config.BILLING_RATE)
+    semaphore = asyncio.Semaphore(config.BILLING_CONCURRENCY)
 
     try:
         # autocommit=True, чтобы не думать о транзакциях в cron-скрипте
-        with psycopg.connect(config.DATABASE_URL_SYNC, autocommit=True) as conn:
-            due_subs = get_due_subscriptions(conn)
-
-            for sub in due_subs:
-                sub_id = sub["sub_id"]
-                user_id = sub["user_id"]
-                price = sub["price"]
-                currency = sub["currency"]
-                payment_id = sub["payment_id"]
-                payment_method = sub["payment_method"]
-                plan_type = sub["plan_type"]
+        async with await psycopg.AsyncConnection.connect(config.DATABASE_URL_SYNC, autocommit=True) as conn:
+            due_subs = await get_due_subscriptions(conn)
+            await asyncio.gather(*(
+                process_subscription(conn, client, limiter, semaphore, sub, report)
+                for sub in due_subs
+            ))
+    finally:
+        await client.close()
+
+    return report
 
-                # ЮKassa ожидает строку для amount
-                amount_str = f"{price:.2f}"
-
-                try:
-                    payment = charge_saved_method(
-                        user_id=user_id,
-                        yk_payment_method_id=payment_method,
-                        amount=amount_str,
-                        currency=currency,
-                        subscription_id=sub_id,
-                    )
-                except Exception as e:
-                    logging.exception(
-                        "Ошибка при попытке списания: subscription_id=%s, error=%s",
-                        sub_id,
-                        e,
-                    )
-                    # Помечаем подписку как failed (или можно этого не делать, по бизнес-логике)
-                    mark_subscription_failed(conn, sub_id, reason=str(e))
-                    continue
-
-                status = payment.get("status")
-                if status == "succeeded":
-                    # Всё хорошо — переносим next_payment_date
-                    move_next_payment_date(conn, sub_id, plan_type)
-                else:
-                    # ЮKassa ответила, но платёж не прошёл (canceled, pending и т.п.)
-                    # todo придумать
-                    reason = f"Payment status {status}"
-                    mark_subscription_failed(conn, sub_id, reason=reason)
 
+def main():
+    logging.info("=== Запуск биллингового крона ===")
+    started = time.perf_counter()
+
+    try:
+        report = asyncio.run(run())
     except Exception:
         logging.exception("Критическая ошибка при выполнении крона")
         sys.exit(1)
 
+    logging.info(
+        "Итог: успешно=%d, отклонено=%d, в ожидании=%d, ошибок=%d, длительность=%.1f с, p50=%.3f с, p95=%.3f с",
+        report.succeeded,
+        report.declined,
+        report.pending,
+        report.errors,
+        time.perf_counter() - started,
+        report.percentile(0.5),
+        report.percentile(0.95),
+    )
     logging.info("=== Завершение биллингового крона ===")
 
 
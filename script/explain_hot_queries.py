@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN ANALYZE горячих запросов к subscriptions/users.
+
+    python script/explain_hot_queries.py                 # на текущих данных
+    python script/explain_hot_queries.py --seed 50000    # + 50000 синтетических пользователей
+
+Синтетические данные вставляются в той же транзакции и откатываются в конце
+(--commit — оставить их). Для каждого запроса печатается план; если по subscriptions
+или users идет Seq Scan, запрос помечается — значит, подходящего индекса нет
+или планировщик считает таблицу слишком маленькой.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Tuple
+
+import config
+import psycopg  # psycopg3
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql.psycopg import PGDialect_psycopg
+
+from config import EXPIRY_BATCH_SIZE
+from database.entitlements import active_entitlements_count_query, current_subscriptions_query
+from database.models import Entitlement, Subscription, User
+from database.subscriptions import (
+    expired_subscription_ids_query, expiring_reminders_query, subscriptions_page_query, unremoved_expired_query
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+SEED_TELEGRAM_ID = 9_000_000_000
+
+SEED_USERS = """
+    INSERT INTO users (telegram_id, full_name, language_code, is_premium, created_at, updated_at)
+    SELECT %(base)s + g, 'seed ' || g, 'ru', false,
+           now() - random() * interval '365 days', now()
+    FROM generate_series(1, %(users)s) g
+"""
+
+# ~30% активных, сроки ±30 дней от текущего момента, половина с автопродлением
+SEED_SUBSCRIPTIONS = """
+    INSERT INTO subscriptions (user_id, plan_type, plan_name, price, currency, status, payment_status,
+                               auto_renew, start_date, end_date, next_payment_date,
+                               created_at, updated_at, payment_id)
+    SELECT u.id, 'regular', 'Обычный', 8000, 'RUB',
+           CASE WHEN r < 0.3 THEN 'active' WHEN r < 0.7 THEN 'expired'
+                WHEN r < 0.9 THEN 'canceled' ELSE 'pending' END,
+           'completed', random() < 0.5,
+           e - interval '1 month', e, e,
+           e - interval '1 month', now(), 'seed-' || u.id || '-' || s
+    FROM users u
+    CROSS JOIN generate_series(1, %(per_user)s) s
+    CROSS JOIN LATERAL (SELECT random() AS r,
+                               (now() AT TIME ZONE 'utc') + (random() * 60 - 30) * interval '1 day' AS e
+                        WHERE s > 0) x
+    WHERE u.telegram_id > %(base)s
+"""
+
+SEED_ENTITLEMENTS = """
+    INSERT INTO entitlements (user_id, subscription_id, plan_type, plan_name, active_until, auto_renew, payment_method)
+    SELECT DISTINCT ON (s.user_id) s.user_id, s.id, s.plan_type, s.plan_name, s.end_date, s.auto_renew, s.payment_method
+    FROM subscriptions s JOIN users u ON u.id = s.user_id
+    WHERE u.telegram_id > %(base)s AND s.status = 'active'
+    ORDER BY s.user_id, s.end_date DESC, s.created_at DESC
+"""
+
+# Планы снимаются с тех же построителей запросов, что выполняет код; billing_cron работает
+# через psycopg текстом SQL, поэтому его условие повторено здесь (держать в синхроне)
+BILLING_DUE_QUERY = """
+    SELECT * FROM subscriptions
+    WHERE auto_renew = True
+      AND next_payment_date >= CURRENT_DATE
+      AND next_payment_date < CURRENT_DATE + 1
+"""
+
+# (название, откуда, построитель запроса по параметрам: now, user_id, telegram_id, payment_id, subscription_id)
+HOT_QUERIES = [
+    ("entitlement", "database/entitlements.get_entitlement (session.get по первичному ключу)",
+     lambda p: select(Entitlement).where(Entitlement.user_id == p["user_id"])),
+    ("current_subscription", "database/entitlements.refresh_entitlements",
+     lambda p: current_subscriptions_query([p["user_id"]])),
+    ("expiry_sweep", "checksub.expire_subscriptions_batch",
+     lambda p: expired_subscription_ids_query(p["now"], EXPIRY_BATCH_SIZE)),
+    ("expired_not_removed", "checksub.remove_expired_members",
+     lambda p: unremoved_expired_query(p["now"], EXPIRY_BATCH_SIZE)),
+    ("expiring_reminders", "checksub.check_expiring_subscriptions",
+     lambda p: expiring_reminders_query(p["now"])),
+    ("active_subscribers", "checksub.run_daily_report",
+     lambda p: active_entitlements_count_query(p["now"])),
+    ("admin_subscriptions_page", "handlers/handler_admin (/all_subscriptions, следующая страница)",
+     lambda p: subscriptions_page_query("all", "all", "next", p["subscription_id"], 11)),
+    ("billing_due", "script/billing_cron.get_due_subscriptions",
+     lambda p: BILLING_DUE_QUERY),
+    ("payment_lookup", "database/webhook_repository.get_subscription_by_payment",
+     lambda p: select(Subscription).where(Subscription.payment_id == p["payment_id"])),
+    ("user_by_telegram_id", "middlewares/db (DbSessionMiddleware), везде",
+     lambda p: select(User).where(User.telegram_id == p["telegram_id"])),
+]
+
+DIALECT = PGDialect_psycopg()
+
+
+def compile_query(query, params: dict) -> Tuple[str, dict]:
+    """SQL и параметры для psycopg: запросы SQLAlchemy компилируются диалектом psycopg (%(name)s)"""
+    if isinstance(query, str):
+        return query, params
+    compiled = query.compile(dialect=DIALECT, compile_kwargs={"render_postcompile": True})
+    return str(compiled), compiled.params
+
+
+async def seed(conn, users: int, per_user: int):
+    async with conn.cursor() as cur:
+        await cur.execute(SEED_USERS, {"base": SEED_TELEGRAM_ID, "users": users})
+        await cur.execute(SEED_SUBSCRIPTIONS, {"base": SEED_TELEGRAM_ID, "per_user": per_user})
+        logging.info("Добавлено %d пользователей и %d подписок", users, cur.rowcount)
+        await cur.execute(SEED_ENTITLEMENTS, {"base": SEED_TELEGRAM_ID})
+        # Без свежей статистики планировщик не знает о новых строках
+        await cur.execute("ANALYZE users")
+        await cur.execute("ANALYZE subscriptions")
+        await cur.execute("ANALYZE entitlements")
+
+
+async def sample_params(conn) -> dict:
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            SELECT s.user_id, u.telegram_id, s.payment_id, s.id
+            FROM subscriptions s JOIN users u ON u.id = s.user_id
+            WHERE s.status = 'active' AND s.payment_id IS NOT NULL
+            ORDER BY s.id DESC LIMIT 1
+        """)
+        row = await cur.fetchone()
+    user_id, telegram_id, payment_id, subscription_id = row or (0, 0, "", 0)
+    return {"now": datetime.utcnow(), "user_id": user_id, "telegram_id": telegram_id,
+            "payment_id": payment_id, "subscription_id": subscription_id}
+
+
+async def explain(conn, params: dict) -> int:
+    """Печатает планы, возвращает число запросов с Seq Scan по основным таблицам"""
+    flagged = 0
+    async with conn.cursor() as cur:
+        for name, source, build in HOT_QUERIES:
+            query, query_params = compile_query(build(params), params)
+            await cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, query_params)
+            plan = [row[0] for row in await cur.fetchall()]
+            seq_scan = any("Seq Scan on subscriptions" in line or "Seq Scan on users" in line for line in plan)
+            flagged += seq_scan
+            print(f"\n=== {name} ({source}){'  [SEQ SCAN]' if seq_scan else ''}")
+            print("\n".join(plan))
+    return flagged
+
+
+async def run(args) -> int:
+    async with await psycopg.AsyncConnection.connect(config.DATABASE_URL_SYNC) as conn:
+        try:
+            if args.seed:
+                await seed(conn, args.seed, args.per_user)
+            flagged = await explain(conn, await sample_params(conn))
+        finally:
+            if args.commit:
+                await conn.commit()
+            else:
+                await conn.rollback()
+    print(f"\nЗапросов: {len(HOT_QUERIES)}, с Seq Scan: {flagged}")
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE горячих запросов")
+    parser.add_argument("--seed", type=int, default=0, help="сколько синтетических пользователей добавить")
+    parser.add_argument("--per-user", type=int, default=3, help="подписок на синтетического пользователя")
+    parser.add_argument("--commit", action="store_true", help="не откатывать синтетические данные")
+    args = parser.parse_args()
+
+    flagged = asyncio.run(run(args))
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError, TelegramBadRequest
+)
+
+from config import ADMIN_NOTIFY_RATE, BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_PER_CHAT_INTERVAL, BROADCAST_MAX_RETRIES
+from log.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SendFunc = Callable[[int], Awaitable[Any]]
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов (например, после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: float = 1):
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+# Общий лимитер на процесс: все рассылки бота делят лимит Telegram
+telegram_rate_limiter = TokenBucket(BROADCAST_RATE)
+
+# Уведомления админам идут мимо общей очереди рассылок
+admin_rate_limiter = TokenBucket(ADMIN_NOTIFY_RATE)
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    success: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+    errors: Dict[int, str] = field(default_factory=dict)
+
+    @property
+    def rate(self) -> float:
+        return self.success / self.elapsed if self.elapsed else 0.0
+
+
+class Broadcaster:
+    """
+    Рассылка с ограничением скорости: общий token bucket, пул воркеров,
+    пауза между сообщениями в один чат и автоматический RetryAfter.
+    send(chat_id) должен бросать исключения aiogram, а не глотать их;
+    calls_per_send — сколько запросов к API он делает (столько токенов берется на отправку).
+    """
+
+    def __init__(
+            self,
+            name: str = "broadcast",
+            limiter: TokenBucket = telegram_rate_limiter,
+            workers: int = BROADCAST_WORKERS,
+            per_chat_interval: float = BROADCAST_PER_CHAT_INTERVAL,
+            max_retries: int = BROADCAST_MAX_RETRIES,
+            progress_every: float = 10.0,
+            calls_per_send: int = 1
+    ):
+        self.name = name
+        self.limiter = limiter
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.progress_every = progress_every
+        self.calls_per_send = calls_per_send
+        self._last_sent: Dict[int, float] = {}
+        self._sent = {
+            outcome: registry.counter("broadcast_messages_total", "Сообщения рассылок по результату",
+                                      broadcast=name, result=outcome)
+            for outcome in ("success", "failed", "blocked")
+        }
+        self._retries = registry.counter("broadcast_retries_total", "Повторы отправки в рассылках", broadcast=name)
+        self._duration = registry.histogram("broadcast_duration_seconds", "Длительность рассылки",
+                                            buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+                                            broadcast=name)
+        self._rate = registry.gauge("broadcast_last_rate", "Скорость последней рассылки, сообщ/с", broadcast=name)
+
+    async def run(
+            self,
+            chat_ids: Union[Iterable[int], AsyncIterable[int]],
+            send: SendFunc,
+            total: Optional[int] = None
+    ) -> BroadcastResult:
+        result = BroadcastResult(total=total if total is not None else self._len(chat_ids))
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        started = time.monotonic()
+
+        workers = [asyncio.create_task(self._worker(queue, send, result)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report_progress(result, started))
+        try:
+            if hasattr(chat_ids, "__aiter__"):
+                async for chat_id in chat_ids:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in chat_ids:
+                    await queue.put(chat_id)
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+
+        result.elapsed = time.monotonic() - started
+        self._duration.observe(result.elapsed)
+        self._rate.set(round(result.rate, 3))
+        if not result.total:
+            result.total = result.success + result.failed + result.blocked
+        logger.info(
+            f"[{self.name}] завершено: {result.success}/{result.total} успешно, "
+            f"ошибок {result.failed}, заблокировали бота {result.blocked}, повторов {result.retries}, "
+            f"{result.elapsed:.1f} с, {result.rate:.1f} сообщ/с"
+        )
+        return result
+
+    async def _worker(self, queue: asyncio.Queue, send: SendFunc, result: BroadcastResult):
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            await self._deliver(chat_id, send, result)
+
+    async def _deliver(self, chat_id: int, send: SendFunc, result: BroadcastResult):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat_slot(chat_id)
+            await self.limiter.acquire(self.calls_per_send)
+            self._last_sent[chat_id] = time.monotonic()
+            try:
+                await send(chat_id)
+                result.success += 1
+                self._sent["success"].inc()
+                return
+            except TelegramRetryAfter as e:
+                # Флуд-лимит общий для бота — тормозим всех
+                logger.warning(f"[{self.name}] RetryAfter {e.retry_after} с (чат {chat_id})")
+                self.limiter.pause(e.retry_after)
+                result.retries += 1
+                self._retries.inc()
+            except TelegramNetworkError as e:
+                logger.warning(f"[{self.name}] сетевая ошибка для {chat_id}: {e}")
+                result.retries += 1
+                self._retries.inc()
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramForbiddenError:
+                result.blocked += 1
+                self._sent["blocked"].inc()
+                return
+            except TelegramBadRequest as e:
+                result.failed += 1
+                self._sent["failed"].inc()
+                result.errors[chat_id] = str(e)
+                return
+            except Exception as e:
+                logger.error(f"[{self.name}] ошибка отправки {chat_id}: {e}")
+                result.failed += 1
+                self._sent["failed"].inc()
+                result.errors[chat_id] = str(e)
+                return
+
+        result.failed += 1
+        self._sent["failed"].inc()
+        result.errors[chat_id] = "retries exceeded"
+
+    async def _wait_chat_slot(self, chat_id: int):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _report_progress(self, result: BroadcastResult, started: float):
+        while True:
+            await asyncio.sleep(self.progress_every)
+            done = result.success + result.failed + result.blocked
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"[{self.name}] прогресс: {done}/{result.total or '?'}, "
+                f"{done / elapsed if elapsed else 0:.1f} сообщ/с"
+            )
+
+    @staticmethod
+    def _len(chat_ids) -> int:
+        try:
+            return len(chat_ids)
+        except TypeError:
+            return 0
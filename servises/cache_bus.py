@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import CACHE_BUS_CHECK_INTERVAL
+from database.session import engine
+from servises.subscription_cache import subscription_cache
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "subscription_cache"
+
+
+class CacheInvalidationBus:
+    """
+    Рассылка инвалидаций in-process кэшей между воркерами через LISTEN/NOTIFY.
+    Воркер, изменивший данные, публикует ключ в канал, остальные сбрасывают у себя запись.
+    По умолчанию подключен кэш подписок (канал subscription_cache, ключ — users.id).
+
+    Соединение с LISTEN проверяется раз в check_interval секунд (и сразу при его закрытии);
+    при потере оно переподключается, а локальные кэши очищаются целиком: уведомления,
+    пришедшие без подписки, потеряны.
+    """
+
+    def __init__(self, check_interval: float = CACHE_BUS_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+        # Метка процесса: свои же уведомления пропускаем, локальный кэш уже актуален
+        self.origin = uuid.uuid4().hex[:12]
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._resets: List[Callable[[], None]] = []
+        self._conn: Optional[AsyncConnection] = None
+        self._lost = asyncio.Event()
+        self._supervisor: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+        self.subscribe(CHANNEL, lambda payload: subscription_cache.invalidate(payload, publish=False),
+                       reset=subscription_cache.clear)
+
+    def subscribe(self, channel: str, handler: Callable[[str], None],
+                  reset: Optional[Callable[[], None]] = None):
+        """Регистрировать до start(); reset очищает кэш целиком после переподключения"""
+        self._handlers[channel] = handler
+        if reset is not None:
+            self._resets.append(reset)
+
+    async def start(self):
+        if not await self._connect():
+            logger.error("Инвалидации кэшей не синхронизируются, повтор подключения в фоне")
+        subscription_cache.on_invalidate = lambda user_id: self.publish(CHANNEL, str(user_id))
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info(f"Инвалидации кэшей синхронизируются через: {', '.join(self._handlers)}")
+
+    @property
+    def started(self) -> bool:
+        return self._supervisor is not None
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    async def close(self):
+        subscription_cache.on_invalidate = None
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        for task in list(self._tasks):
+            task.cancel()
+        await self._disconnect()
+
+    def publish(self, channel: str, payload: str):
+        if not self.started:
+            return
+        task = asyncio.create_task(self._notify(channel, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict:
+        return {"published": self.published, "received": self.received,
+                "reconnects": self.reconnects, "connected": int(self.connected)}
+
+    # ------------------------
+    async def _connect(self) -> bool:
+        try:
+            self._conn = await engine.connect()
+            raw = await self._conn.get_raw_connection()
+            driver = raw.driver_connection
+            for channel in self._handlers:
+                await driver.add_listener(channel, self._on_notify)
+            driver.add_termination_listener(lambda _: self._lost.set())
+        except Exception as e:
+            logger.error(f"Не удалось подписаться на инвалидации кэшей: {e}")
+            await self._disconnect()
+            return False
+        self._lost.clear()
+        return True
+
+    async def _disconnect(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            await conn.close()
+        except Exception:
+            await conn.invalidate()
+
+    async def _is_alive(self) -> bool:
+        if self._conn is None or self._lost.is_set():
+            return False
+        try:
+            raw = await self._conn.get_raw_connection()
+            # Запрос мимо транзакций SQLAlchemy: соединение с LISTEN не должно висеть в транзакции
+            await asyncio.wait_for(raw.driver_connection.execute("SELECT 1"), self.check_interval)
+            return True
+        except Exception as e:
+            logger.error(f"Соединение с LISTEN инвалидаций кэшей потеряно: {e}")
+            return False
+
+    async def _supervise(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._lost.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            if await self._is_alive():
+                continue
+
+            await self._disconnect()
+            if not await self._connect():
+                continue
+            self.reconnects += 1
+            for reset in self._resets:
+                reset()
+            logger.info("Подписка на инвалидации кэшей восстановлена, локальные кэши очищены")
+
+    async def _notify(self, channel: str, payload: str):
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                   {"channel": channel, "payload": f"{self.origin}|{payload}"})
+                await conn.commit()
+            self.published += 1
+        except Exception as e:
+            logger.error(f"Не удалось разослать инвалидацию {channel}:{payload}: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        origin, _, payload = payload.partition("|")
+        handler = self._handlers.get(channel)
+        if handler is None or origin == self.origin:
+            return
+        self.received += 1
+        handler(payload)
+
+
+cache_bus = CacheInvalidationBus()
@@ -1,60 +1,80 @@
 from datetime import datetime, timedelta
+from typing import AsyncIterator, Iterable, List, Optional
+
 from aiogram import Bot
 
-from sqlalchemy import select, and_
+from sqlalchemy import select, exists, func
 
-from database.models import Subscription, User, UserSettings, FreeDailyPost
+from config import FREE_POST_CHUNK_SIZE, FREE_POST_SPREAD_MINUTES, SCHEDULER_TIMEZONE
+from database.models import Entitlement, User, UserSettings, FreeDailyPost
 from database.session import get_db_session
+from servises.media_registry import media_registry
 
 
 class FreePostService:
 
     @staticmethod
-    async def get_users_without_subscription() -> list:
-        """Получить пользователей БЕЗ активной подписки"""
-        current_time = datetime.utcnow()
-        async with get_db_session() as session:
-            # Подзапрос для пользователей с активными подписками
-            subquery = select(Subscription.user_id).where(
-                and_(
-                    Subscription.status == 'active',
-                    Subscription.end_date > current_time
-                )
-            ).scalar_subquery()
-
-            # Основной запрос: пользователи без активной подписки И с включенной бесплатной рассылкой
-            result = await session.execute(
-                select(User)
-                .join(UserSettings, User.id == UserSettings.user_id)
-                .where(
-                    and_(
-                        User.id.not_in(subquery),  # Нет активной подписки
-                        UserSettings.wants_free_posts == True  # Хочет бесплатную рассылку
-                    )
-                )
-            )
-        return result.scalars().all()
+    def _free_post_recipients_query(timezones: Optional[Iterable[str]] = None,
+                                    slots: Optional[Iterable[int]] = None):
+        """
+        telegram_id всех, кто хочет бесплатную рассылку и не имеет действующей подписки.
+        Покрывает и "никогда не было подписки", и "подписка истекла"; дубли убирает БД.
+        timezones/slots сужают выборку до одного окна доставки: часовые пояса пользователей
+        и минутные слоты (telegram_id % FREE_POST_SPREAD_MINUTES), в которые пост им уже пора отправить.
+        """
+        has_active_sub = exists().where(
+            Entitlement.user_id == User.id,
+            Entitlement.active_until > datetime.utcnow()
+        )
+        query = (
+            select(User.telegram_id)
+            .join(UserSettings, User.id == UserSettings.user_id)
+            .where(UserSettings.wants_free_posts == True, ~has_active_sub)
+            .distinct()
+        )
+        if timezones is not None:
+            query = query.where(func.coalesce(UserSettings.timezone, SCHEDULER_TIMEZONE).in_(list(timezones)))
+        if slots is not None:
+            query = query.where((User.telegram_id % FREE_POST_SPREAD_MINUTES).in_(list(slots)))
+        return query
 
     @staticmethod
-    async def get_users_with_expired_subscription() -> list:
-        """Получить пользователей с истекшей подпиской"""
-        current_time = datetime.utcnow()
+    async def get_free_post_timezones() -> List[str]:
+        """Часовые пояса, в которых есть подписчики бесплатной рассылки"""
         async with get_db_session() as session:
-            # Пользователи у которых была подписка, но она истекла
             result = await session.execute(
-                select(User)
-                .join(Subscription, User.id == Subscription.user_id)
-                .join(UserSettings, User.id == UserSettings.user_id)
-                .where(
-                    and_(
-                        Subscription.status == 'active',
-                        Subscription.end_date <= current_time,  # Подписка истекла
-                        UserSettings.wants_free_posts == True
-                    )
-                )
+                select(func.coalesce(UserSettings.timezone, SCHEDULER_TIMEZONE))
+                .where(UserSettings.wants_free_posts == True)
                 .distinct()
             )
-        return result.scalars().all()
+            return list(result.scalars().all())
+
+    @staticmethod
+    async def count_free_post_recipients(timezones: Optional[Iterable[str]] = None,
+                                         slots: Optional[Iterable[int]] = None) -> int:
+        query = FreePostService._free_post_recipients_query(timezones, slots)
+        async with get_db_session() as session:
+            result = await session.execute(select(func.count()).select_from(query.subquery()))
+            return result.scalar_one()
+
+    @staticmethod
+    async def iter_free_post_recipients(chunk_size: int = FREE_POST_CHUNK_SIZE,
+                                        timezones: Optional[Iterable[str]] = None,
+                                        slots: Optional[Iterable[int]] = None) -> AsyncIterator[List[int]]:
+        """Получатели бесплатной рассылки пачками через серверный курсор"""
+        query = FreePostService._free_post_recipients_query(timezones, slots).execution_options(yield_per=chunk_size)
+        async with get_db_session() as session:
+            result = await session.stream_scalars(query)
+            async for chunk in result.partitions(chunk_size):
+                yield chunk
+
+    @staticmethod
+    async def iter_free_post_recipient_ids(chunk_size: int = FREE_POST_CHUNK_SIZE,
+                                           timezones: Optional[Iterable[str]] = None,
+                                           slots: Optional[Iterable[int]] = None) -> AsyncIterator[int]:
+        async for chunk in FreePostService.iter_free_post_recipients(chunk_size, timezones, slots):
+            for telegram_id in chunk:
+                yield telegram_id
 
     @staticmethod
     async def get_today_free_post() -> FreeDailyPost:
@@ -68,30 +88,33 @@ class FreePostService:
             return result.scalar()
 
     @staticmethod
-    async def send_free_post_to_user(bot, user: User, post: FreeDailyPost):
-        """Отправить бесплатный пост пользователю"""
-        try:
-            message_text = (
-                "📢 <b>БЕСПЛАТНЫЙ КОНТЕНТ</b>\n\n"
-                f"{post.content}\n\n"
-                "💎 <i>Хотите больше контента? Оформите премиум подписку!</i>"
-            )
+    async def send_free_post(bot, telegram_id: int, post: FreeDailyPost):
+        """Отправить бесплатный пост в чат (исключения aiogram пробрасываются для Broadcaster)"""
+        message_text = (
+            "📢 <b>БЕСПЛАТНЫЙ КОНТЕНТ</b>\n\n"
+            f"{post.content}\n\n"
+            "💎 <i>Хотите больше контента? Оформите премиум подписку!</i>"
+        )
 
-            if post.photo_file_id:
-                await bot.send_photo(
-                    chat_id=user.telegram_id,
-                    photo=post.photo_file_id,
-                    caption=message_text,
-                    parse_mode="HTML"
-                )
-            else:
-                await bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=message_text,
-                    parse_mode="HTML"
-                )
-            return True
-
-        except Exception as e:
-            print(f"Ошибка отправки бесплатного поста пользователю {user.telegram_id}: {e}")
-            return False
+        if post.photo_file_id:
+            await bot.send_photo(
+                chat_id=telegram_id,
+                photo=post.photo_file_id,
+                caption=message_text,
+                parse_mode="HTML"
+            )
+        elif post.photo_path:
+            # Локальное фото загружается один раз, дальше уходит по file_id
+            await media_registry.send_photo(
+                bot,
+                telegram_id,
+                post.photo_path,
+                caption=message_text,
+                parse_mode="HTML"
+            )
+        else:
+            await bot.send_message(
+                chat_id=telegram_id,
+                text=message_text,
+                parse_mode="HTML"
+            )
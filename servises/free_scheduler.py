@@ -1,66 +1,109 @@
-import asyncio
-from datetime import datetime, time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, FrozenSet, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
 from aiogram import Bot
+
+from config import FREE_POST_CRON, FREE_POST_SPREAD_MINUTES, SCHEDULER_TIMEZONE
+from database.models import FreeDailyPost
+from servises.broadcaster import Broadcaster
 from servises.daily_poster import FreePostService
+from servises.scheduler import Job, JobScheduler
+
+MINUTES_PER_DAY = 24 * 60
+DEFAULT_POST_TIME = "10:00"
+
+
+def _parse_post_time(value: Optional[str]) -> int:
+    """scheduled_time поста ("HH:MM") в минутах от начала суток"""
+    try:
+        hours, minutes = (int(part) for part in (value or DEFAULT_POST_TIME).split(":"))
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(value)
+    except ValueError:
+        print(f"Некорректное время поста {value!r}, используем {DEFAULT_POST_TIME}")
+        return _parse_post_time(DEFAULT_POST_TIME)
+    return hours * 60 + minutes
+
+
+def _zone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(SCHEDULER_TIMEZONE)
 
 
 class FreePostScheduler:
+    """
+    Бесплатная рассылка по окнам доставки.
+    Пост уходит пользователю в scheduled_time по его часовому поясу (UserSettings.timezone)
+    плюс персональный сдвиг telegram_id % FREE_POST_SPREAD_MINUTES минут, поэтому вместо
+    одного всплеска на всех получается много маленьких пачек, по одной на (пост, локальное время).
+    """
+
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.is_running = False
+        self.job: Optional[Job] = None
+
+    def register(self, scheduler: JobScheduler):
+        """Проверка окон доставки на каждом тике FREE_POST_CRON"""
+        self.job = scheduler.add_job("free_posts", FREE_POST_CRON, self.send_due_free_posts)
 
-    async def start_free_posting(self):
-        """Запуск ежедневной бесплатной рассылки"""
-        self.is_running = True
-        while self.is_running:
-            try:
-                now = datetime.now()
-                target_time = time(14, 00)  # 10:00 утра
+    async def send_due_free_posts(self):
+        post = await FreePostService.get_today_free_post()
+        if not post:
+            return
 
-                if now.time().hour == target_time.hour and now.time().minute == target_time.minute:
-                    await self.send_free_posts()
-                    await asyncio.sleep(61)
-                else:
-                    await asyncio.sleep(60)
+        now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        # Окно тика: (предыдущий запуск; сейчас]. last_run хранится в job_runs,
+        # поэтому после простоя догоняем пропущенные окна (но не больше суток)
+        last_run = self.job.last_run if self.job else None
+        since = last_run.replace(second=0, microsecond=0) if last_run else now - timedelta(minutes=1)
+        since = max(since, now - timedelta(days=1) + timedelta(minutes=1))
+        if since >= now:
+            return
 
-            except Exception as e:
-                print(f"Ошибка в планировщике бесплатной рассылки: {e}")
-                await asyncio.sleep(60)
+        buckets = self._due_buckets(post, await FreePostService.get_free_post_timezones(), since, now)
+        for slots, timezones in buckets.items():
+            await self._send_bucket(post, timezones, sorted(slots))
 
-    async def send_free_posts(self):
+    @staticmethod
+    def _due_buckets(post: FreeDailyPost, timezones: List[str],
+                     since: datetime, until: datetime) -> Dict[FrozenSet[int], List[str]]:
+        """
+        Группирует часовые пояса по набору слотов, которым пост пора отправить в окне (since; until].
+        Пояса с одинаковым локальным временем (например, UTC и Europe/London зимой) попадают в одну пачку.
+        """
+        post_minute = _parse_post_time(post.scheduled_time)
+        spread = max(1, min(FREE_POST_SPREAD_MINUTES, MINUTES_PER_DAY))
+        window = [since + timedelta(minutes=i) for i in range(1, int((until - since).total_seconds() // 60) + 1)]
 
-        # Получаем пост на сегодня
-        post = await FreePostService.get_today_free_post()
-        if not post:
-            print("Нет активного бесплатного поста для рассылки")
+        buckets: Dict[FrozenSet[int], List[str]] = defaultdict(list)
+        for name in timezones:
+            tz = _zone(name)
+            slots = set()
+            for moment in window:
+                local = moment.astimezone(tz)
+                offset = (local.hour * 60 + local.minute - post_minute) % MINUTES_PER_DAY
+                if offset < spread:
+                    slots.add(offset)
+            if slots:
+                buckets[frozenset(slots)].append(name)
+        return buckets
+
+    async def _send_bucket(self, post: FreeDailyPost, timezones: List[str], slots: List[int]):
+        total = await FreePostService.count_free_post_recipients(timezones, slots)
+        if not total:
             return
-        # Получаем пользователей без подписки
-        users_without_sub = await FreePostService.get_users_without_subscription()
-        # Также получаем пользователей с истекшей подпиской
-        users_expired_sub = await FreePostService.get_users_with_expired_subscription()
-        # Объединяем списки
-        all_users = list(set(users_without_sub + users_expired_sub))
-        print(f"Найдено {len(all_users)} пользователей для бесплатной рассылки")
-        success_count = 0
-        fail_count = 0
-
-        for user in all_users:
-            try:
-                success = await FreePostService.send_free_post_to_user(self.bot, user, post)
-                if success:
-                    success_count += 1
-                else:
-                    fail_count += 1
-
-                # Задержка чтобы не превысить лимиты Telegram
-                await asyncio.sleep(0.1)
-
-            except Exception as e:
-                print(f"Ошибка при отправке бесплатного поста пользователю {user.telegram_id}: {e}")
-                fail_count += 1
-
-        print(f"Бесплатная рассылка завершена. Успешно: {success_count}, Не удалось: {fail_count}")
-
-    def stop(self):
-        """Остановить рассылку"""
-        self.is_running = False
+        print(f"Бесплатная рассылка поста {post.id}: {total} получателей "
+              f"(пояса: {', '.join(timezones)}; слоты: {slots[0]}-{slots[-1]} мин)")
+
+        async def send(telegram_id: int):
+            await FreePostService.send_free_post(self.bot, telegram_id, post)
+
+        result = await Broadcaster("free_posts").run(
+            FreePostService.iter_free_post_recipient_ids(timezones=timezones, slots=slots), send, total=total
+        )
+        print(f"Пачка бесплатной рассылки завершена. Успешно: {result.success}, "
+              f"Не удалось: {result.failed + result.blocked}")
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiohttp import web
+
+from config import HEALTH_CACHE_TTL, HEALTH_DB_TIMEOUT, HEALTH_MAX_LOOP_LAG, HEALTH_POLLING_STALE
+from database.session import get_pool_stats, ping_database
+from log.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """
+    Проверки для /health/live и /health/ready.
+
+    live — процесс жив: event loop отвечает, отслеживаемые фоновые задачи не упали.
+    ready — можно принимать трафик: БД отвечает (результат кэшируется на cache_ttl секунд,
+    параллельные пробы ждут одну проверку), лаг event loop в норме, в polling-режиме
+    getUpdates недавно завершался успешно.
+    """
+
+    def __init__(self, cache_ttl: float = HEALTH_CACHE_TTL, db_timeout: float = HEALTH_DB_TIMEOUT,
+                 max_loop_lag: float = HEALTH_MAX_LOOP_LAG, polling_stale: float = HEALTH_POLLING_STALE,
+                 lag_interval: float = 0.5):
+        self.cache_ttl = cache_ttl
+        self.db_timeout = db_timeout
+        self.max_loop_lag = max_loop_lag
+        self.polling_stale = polling_stale
+        self.lag_interval = lag_interval
+        self.mode = "polling"
+        self.started_at = time.time()
+        self.last_update_at: Optional[float] = None
+        self.last_get_updates_at: Optional[float] = None
+        self.loop_lag = 0.0
+        self._lag_gauge = registry.gauge("event_loop_lag_seconds", "Задержка event loop относительно таймера")
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._lag_task: Optional[asyncio.Task] = None
+        self._db_result: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._db_lock = asyncio.Lock()
+
+    def start(self, mode: str):
+        self.mode = mode
+        self.started_at = time.time()
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    def watch(self, name: str, task: asyncio.Task):
+        """Фоновая задача, которая должна работать все время жизни процесса"""
+        self._tasks[name] = task
+
+    # ------------------------ источники
+    async def update_middleware(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                                event: Any, data: Dict[str, Any]) -> Any:
+        """outer-middleware на dp.update: время последнего апдейта"""
+        self.last_update_at = time.time()
+        return await handler(event, data)
+
+    async def api_middleware(self, make_request, bot: Bot, method: TelegramMethod):
+        """middleware сессии бота: время последнего успешного getUpdates"""
+        response = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            self.last_get_updates_at = time.time()
+        return response
+
+    async def _measure_loop_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, time.monotonic() - started - self.lag_interval)
+            self._lag_gauge.set(round(self.loop_lag, 6))
+
+    # ------------------------ проверки
+    def _check_tasks(self) -> Dict[str, Any]:
+        tasks = {}
+        for name, task in self._tasks.items():
+            if not task.done():
+                tasks[name] = "running"
+            elif task.cancelled():
+                tasks[name] = "cancelled"
+            else:
+                tasks[name] = f"failed: {task.exception()!r}" if task.exception() else "finished"
+        if self._lag_task is not None and self._lag_task.done():
+            tasks["loop_lag_monitor"] = "stopped"
+        return tasks
+
+    async def check_database(self) -> Dict[str, Any]:
+        cached = self._db_result
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+
+        async with self._db_lock:
+            # Пока ждали блокировку, проверку мог уже выполнить другой запрос
+            cached = self._db_result
+            if cached and time.monotonic() - cached[0] < self.cache_ttl:
+                return cached[1]
+            try:
+                latency = await ping_database(self.db_timeout)
+                result = {"ok": True, "latency": round(latency, 6)}
+            except asyncio.TimeoutError:
+                result = {"ok": False, "error": f"timeout {self.db_timeout}s"}
+            except Exception as e:
+                result = {"ok": False, "error": repr(e)}
+            result["pool"] = get_pool_stats()
+            self._db_result = (time.monotonic(), result)
+            return result
+
+    def liveness(self) -> Tuple[bool, Dict[str, Any]]:
+        tasks = self._check_tasks()
+        ok = all(state == "running" for state in tasks.values())
+        return ok, {
+            "status": "ok" if ok else "fail",
+            "uptime": round(time.time() - self.started_at, 1),
+            "loop_lag": round(self.loop_lag, 6),
+            "tasks": tasks,
+        }
+
+    async def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        now = time.time()
+        live, details = self.liveness()
+        database = await self.check_database()
+        loop_ok = self.loop_lag <= self.max_loop_lag
+
+        telegram: Dict[str, Any] = {
+            "mode": self.mode,
+            "last_update_age": round(now - self.last_update_at, 1) if self.last_update_at else None,
+        }
+        telegram_ok = True
+        if self.mode == "polling":
+            # Long polling возвращается не реже чем раз в timeout, даже без апдейтов
+            reference = self.last_get_updates_at or self.started_at
+            telegram["last_get_updates_age"] = round(now - reference, 1)
+            telegram_ok = now - reference <= self.polling_stale
+        telegram["ok"] = telegram_ok
+
+        ok = live and database["ok"] and loop_ok and telegram_ok
+        details.update({
+            "status": "ok" if ok else "fail",
+            "loop_ok": loop_ok,
+            "database": database,
+            "telegram": telegram,
+        })
+        return ok, details
+
+    # ------------------------ HTTP
+    async def live_handler(self, request: web.Request) -> web.Response:
+        ok, details = self.liveness()
+        return web.json_response(details, status=200 if ok else 503)
+
+    async def ready_handler(self, request: web.Request) -> web.Response:
+        ok, details = await self.readiness()
+        if not ok:
+            logger.warning("Проверка готовности не пройдена: %s", details)
+        return web.json_response(details, status=200 if ok else 503)
+
+
+health_monitor = HealthMonitor()
@@ -2,6 +2,7 @@ import logging
 from datetime import datetime, timedelta
 from aiogram import Bot
 from sqlalchemy import select
+from database import daily_stats
 from database.session import get_db_session
 from database.models import InviteLink
 
@@ -46,6 +47,7 @@ class InviteService:
                     expires_at=expire_date
                 )
                 session.add(invite_record)
+                await daily_stats.record_stat(session, daily_stats.INVITES_CREATED)
                 await session.commit()
                 await session.refresh(invite_record)
 
@@ -66,6 +68,8 @@ class InviteService:
             invite = result.scalar_one_or_none()
 
             if invite:
+                if not invite.is_used:
+                    await daily_stats.record_stat(session, daily_stats.INVITES_USED)
                 invite.is_used = True
                 invite.used_at = datetime.utcnow()
                 if user_id:
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import zlib
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import LEADER_CHECK_INTERVAL
+from database.session import engine
+
+logger = logging.getLogger(__name__)
+
+
+def advisory_lock_key(name: str) -> int:
+    """Стабильный ключ pg_advisory_lock по имени (одинаковый во всех процессах)"""
+    return zlib.crc32(f"tg-bot:{name}".encode())
+
+
+class LeaderElection:
+    """
+    Выбор лидера через сессионный pg_try_advisory_lock.
+    Лидер держит отдельное соединение с блокировкой и выполняет on_elected;
+    если соединение пропало (а с ним и блокировка), on_elected отменяется, вызывается
+    on_lost и выборы начинаются заново. Остальные процессы пробуют захватить блокировку
+    каждые LEADER_CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self, name: str, interval: float = LEADER_CHECK_INTERVAL):
+        self.name = name
+        self.key = advisory_lock_key(name)
+        self.interval = interval
+        self.is_leader = False
+        self.elections = 0
+        self._running = False
+        self._stopped = asyncio.Event()
+
+    async def run(self, on_elected: Callable[[], Awaitable[None]],
+                  on_lost: Optional[Callable[[], None]] = None):
+        self._running = True
+        self._stopped.clear()
+        while self._running:
+            conn = await self._try_acquire()
+            if conn is None:
+                await self._sleep(self.interval)
+                continue
+
+            self.is_leader = True
+            self.elections += 1
+            logger.info(f"Процесс стал лидером {self.name}")
+            task = asyncio.create_task(on_elected())
+            try:
+                while self._running and not task.done():
+                    await self._sleep(self.interval)
+                    # Heartbeat: если соединение умерло, блокировку уже мог взять другой процесс
+                    await conn.execute(text("SELECT 1"))
+            except Exception as e:
+                logger.error(f"Потеряно соединение лидера {self.name}: {e}")
+            finally:
+                self.is_leader = False
+                task.cancel()
+                if on_lost:
+                    on_lost()
+                await self._release(conn)
+                logger.info(f"Процесс перестал быть лидером {self.name}")
+
+    def stop(self):
+        self._running = False
+        self._stopped.set()
+
+    def stats(self) -> dict:
+        return {"name": self.name, "is_leader": self.is_leader, "elections": self.elections}
+
+    # ------------------------
+    async def _try_acquire(self) -> Optional[AsyncConnection]:
+        conn = None
+        try:
+            # AUTOCOMMIT: соединение живет, пока процесс лидер, и не должно держать открытую
+            # транзакцию (снимок мешает vacuum, idle_in_transaction_session_timeout разорвет
+            # соединение вместе с блокировкой). Сессионная блокировка от транзакций не зависит
+            conn = await engine.connect()
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            result = await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key})
+            if result.scalar():
+                return conn
+            await conn.close()
+        except Exception as e:
+            logger.error(f"Ошибка захвата блокировки лидера {self.name}: {e}")
+            if conn is not None:
+                await conn.invalidate()
+        return None
+
+    async def _release(self, conn: AsyncConnection):
+        try:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            await conn.close()
+        except Exception:
+            # Соединение уже мертво — блокировка снята вместе с ним
+            await conn.invalidate()
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopped.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from database.models import MediaFile
+from database.session import get_db_session
+
+logger = logging.getLogger(__name__)
+
+
+# Ошибки Telegram о самом file_id (не о получателе или подписи): только после них есть смысл загружать заново
+STALE_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+    "wrong padding in the string",
+    "can't use file of type",
+)
+
+
+def is_stale_file_id_error(error: TelegramBadRequest) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in STALE_FILE_ID_ERRORS)
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class MediaRegistry:
+    """
+    Загружает локальный файл в Telegram один раз и дальше отправляет его по file_id.
+    file_id хранится в БД (media_files) по пути и sha256 содержимого,
+    поэтому после изменения файла он загружается заново автоматически.
+    """
+
+    def __init__(self):
+        # path -> (mtime, size, sha256): не перечитываем файл, если он не менялся
+        self._hashes: Dict[str, Tuple[float, int, str]] = {}
+        # (path, sha256, media_type) -> file_id
+        self._file_ids: Dict[Tuple[str, str, str], str] = {}
+        self._locks: Dict[Tuple[str, str, str], asyncio.Lock] = {}
+
+    async def send_document(self, bot: Bot, chat_id: int, path: str, filename: str = None, **kwargs) -> Message:
+        return await self._send(bot, chat_id, path, "document", filename=filename, **kwargs)
+
+    async def send_photo(self, bot: Bot, chat_id: int, path: str, **kwargs) -> Message:
+        return await self._send(bot, chat_id, path, "photo", **kwargs)
+
+    async def _send(self, bot: Bot, chat_id: int, path: str, media_type: str, filename: str = None, **kwargs):
+        content_hash = await self._content_hash(path)
+        key = (path, content_hash, media_type)
+
+        file_id = self._file_ids.get(key)
+        if not file_id:
+            # Пока идет первая загрузка, параллельные отправки (рассылка) ждут ее file_id
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                file_id = self._file_ids.get(key) or await self._load_file_id(*key)
+                if not file_id:
+                    return await self._upload(bot, chat_id, key, filename, **kwargs)
+
+        try:
+            return await self._send_media(bot, chat_id, media_type, file_id, **kwargs)
+        except TelegramBadRequest as e:
+            # "chat not found", слишком длинная подпись и т.п. повторная загрузка не исправит
+            if not is_stale_file_id_error(e):
+                raise
+            # file_id мог стать недействительным (например, сменился бот) — загружаем заново
+            logger.warning(f"file_id для {path} не принят Telegram: {e}")
+            self._file_ids.pop(key, None)
+            return await self._upload(bot, chat_id, key, filename, **kwargs)
+
+    async def _upload(self, bot: Bot, chat_id: int, key: Tuple[str, str, str], filename: str = None, **kwargs):
+        path, content_hash, media_type = key
+        message = await self._send_media(bot, chat_id, media_type, FSInputFile(path, filename=filename), **kwargs)
+        file_id = self._extract_file_id(message, media_type)
+        if file_id:
+            self._file_ids[key] = file_id
+            await self._save_file_id(path, content_hash, media_type, file_id)
+            logger.info(f"Файл {path} загружен в Telegram, file_id сохранен")
+        return message
+
+    async def _content_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+
+        content_hash = await asyncio.to_thread(_file_hash, path)
+        self._hashes[path] = (stat.st_mtime, stat.st_size, content_hash)
+        return content_hash
+
+    async def _load_file_id(self, path: str, content_hash: str, media_type: str) -> Optional[str]:
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(MediaFile.file_id).where(
+                    MediaFile.path == path,
+                    MediaFile.content_hash == content_hash,
+                    MediaFile.media_type == media_type
+                )
+            )
+            file_id = result.scalar_one_or_none()
+
+        if file_id:
+            self._file_ids[(path, content_hash, media_type)] = file_id
+        return file_id
+
+    @staticmethod
+    async def _save_file_id(path: str, content_hash: str, media_type: str, file_id: str):
+        async with get_db_session() as session:
+            stmt = insert(MediaFile).values(
+                path=path, content_hash=content_hash, media_type=media_type, file_id=file_id
+            )
+            await session.execute(stmt.on_conflict_do_update(
+                constraint='uq_media_file_path_hash_type',
+                set_={"file_id": file_id}
+            ))
+
+    @staticmethod
+    async def _send_media(bot: Bot, chat_id: int, media_type: str, media, **kwargs) -> Message:
+        if media_type == "photo":
+            return await bot.send_photo(chat_id=chat_id, photo=media, **kwargs)
+        return await bot.send_document(chat_id=chat_id, document=media, **kwargs)
+
+    @staticmethod
+    def _extract_file_id(message: Message, media_type: str) -> Optional[str]:
+        if media_type == "photo" and message.photo:
+            return message.photo[-1].file_id
+        if media_type == "document" and message.document:
+            return message.document.file_id
+        return None
+
+
+media_registry = MediaRegistry()
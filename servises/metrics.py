@@ -0,0 +1,80 @@
+import time
+from typing import Iterable, Optional
+
+from aiohttp import web
+
+from database.session import get_pool_stats
+from log.logging_config import get_logging_stats
+from log.metrics import Sample, registry, render_prometheus
+from payment.yookassa_client import YooKassaClient
+from servises.cache_bus import cache_bus
+from servises.subscription_cache import subscription_cache
+
+
+@web.middleware
+async def http_metrics_middleware(request: web.Request, handler):
+    """Время обработки HTTP-запросов (вебхуки ЮKassa и Telegram, /status): http_request_duration_seconds"""
+    resource = request.match_info.route.resource
+    path = resource.canonical if resource is not None else "unmatched"
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        registry.histogram("http_request_duration_seconds", "Время обработки HTTP-запроса",
+                           path=path, method=request.method, status=str(status)
+                           ).observe(time.perf_counter() - start)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Version": "0.0.4"})
+
+
+def _gauges(prefix: str, help: str, values: dict, **labels) -> Iterable[Sample]:
+    for key, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}_{key}", "gauge", help, labels, value
+
+
+def register_default_collectors(scheduler=None, leader=None, storage=None,
+                                yookassa_clients: Optional[dict] = None):
+    """Состояние сервисов, которое читается из их stats() в момент снятия метрик"""
+
+    def collect() -> Iterable[Sample]:
+        yield from _gauges("db_pool", "Пул соединений БД", get_pool_stats())
+        yield from _gauges("subscription_cache", "Кэш статусов подписок", subscription_cache.stats())
+        yield from _gauges("cache_bus", "Инвалидации кэшей между воркерами", cache_bus.stats())
+        logging_stats = get_logging_stats()
+        yield from _gauges("log_queue", "Очередь логирования", logging_stats)
+
+        for name, client in (yookassa_clients or {}).items():
+            client: YooKassaClient
+            for operation, histogram in client.latency.items():
+                yield ("yookassa_request_duration_seconds", "histogram", "Время запроса к API ЮKassa",
+                       {"client": name, "operation": operation}, histogram)
+            for operation, count in client.errors.items():
+                yield ("yookassa_errors_total", "counter", "Ошибки API ЮKassa",
+                       {"client": name, "operation": operation}, count)
+
+        if scheduler is not None:
+            now = time.time()
+            for name, job in scheduler.jobs.items():
+                yield "scheduler_job_runs_total", "counter", "Выполненные запуски задачи", {"job": name}, job.runs
+                yield "scheduler_job_running", "gauge", "Задача выполняется", {"job": name}, int(job.running)
+                if job.next_run is not None:
+                    yield ("scheduler_job_next_run_seconds", "gauge", "Секунд до следующего запуска",
+                           {"job": name}, round(job.next_run.timestamp() - now, 3))
+
+        if leader is not None:
+            yield "leader_is_leader", "gauge", "Процесс — лидер фоновых задач", {"name": leader.name}, int(leader.is_leader)
+
+        if storage is not None and hasattr(storage, "stats"):
+            yield from _gauges("fsm_storage", "FSM-хранилище", storage.stats())
+
+    registry.register_collector(collect)
@@ -0,0 +1,258 @@
+import asyncio
+import heapq
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from config import SCHEDULER_TIMEZONE
+from database.models import JobRun
+from database.session import get_db_session
+from log.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+JobFunc = Callable[[], Awaitable[None]]
+
+# Границы полей cron: минута, час, день месяца, месяц, день недели (0 — воскресенье)
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _parse_cron_field(expr: str, low: int, high: int) -> set:
+    values = set()
+    for part in expr.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Некорректное поле cron: {expr}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """Cron из 5 полей: "мин час день месяц день_недели" (*, списки, диапазоны, шаги)"""
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron должен состоять из 5 полей: {expr}")
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(part, low, high) for part, (low, high) in zip(parts, _CRON_FIELDS)
+        )
+        # cron: 0 — воскресенье, datetime.weekday(): 0 — понедельник
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = dt.weekday() in self.weekdays
+        # Как в cron: если заданы оба поля — достаточно совпадения любого
+        if not self._any_day and not self._any_weekday:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, after: datetime, tz: ZoneInfo) -> datetime:
+        """Ближайшее время срабатывания строго после after (aware), результат в UTC"""
+        local = after.astimezone(tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local + timedelta(days=366 * 5)
+
+        while local < limit:
+            if local.month not in self.months:
+                local = (local.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(local):
+                local = (local + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if local.hour not in self.hours:
+                local = (local + timedelta(hours=1)).replace(minute=0)
+                continue
+            if local.minute not in self.minutes:
+                local += timedelta(minutes=1)
+                continue
+            return local.replace(tzinfo=tz).astimezone(timezone.utc)
+
+        raise ValueError(f"Cron {self.expr} не срабатывает в ближайшие 5 лет")
+
+
+class Job:
+    def __init__(self, name: str, cron: str, func: JobFunc, tz: str = SCHEDULER_TIMEZONE,
+                 jitter: float = 0, catch_up: bool = True):
+        self.name = name
+        self.cron = CronExpression(cron)
+        self.func = func
+        self.tz = ZoneInfo(tz)
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.next_run: Optional[datetime] = None
+        self.last_run: Optional[datetime] = None
+        self.last_lag: float = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.lag_histogram = registry.histogram("scheduler_lag_seconds", "Задержка запуска задачи относительно cron",
+                                                buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 3600), job=name)
+        self.duration_histogram = registry.histogram("scheduler_job_duration_seconds", "Длительность задачи",
+                                                     buckets=(0.1, 1, 5, 15, 60, 300, 900, 3600), job=name)
+        self.failures_counter = registry.counter("scheduler_job_failures_total", "Упавшие запуски задачи", job=name)
+
+    def schedule_after(self, after: datetime):
+        self.next_run = self.cron.next_after(after, self.tz)
+        if self.jitter:
+            self.next_run += timedelta(seconds=random.uniform(0, self.jitter))
+
+    def stats(self) -> dict:
+        return {
+            "cron": self.cron.expr,
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_lag": round(self.last_lag, 3),
+            "runs": self.runs,
+            "failures": self.failures,
+            "running": self.running,
+        }
+
+
+class JobScheduler:
+    """
+    Планировщик задач по cron: спит ровно до ближайшей задачи, без опроса раз в минуту.
+    Время последнего запуска хранится в job_runs, поэтому пропущенный во время
+    рестарта запуск выполняется сразу после старта (catch_up).
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._tasks: set = set()
+        self._running = False
+
+    def add_job(self, name: str, cron: str, func: JobFunc, tz: str = SCHEDULER_TIMEZONE,
+                jitter: float = 0, catch_up: bool = True) -> Job:
+        job = Job(name, cron, func, tz=tz, jitter=jitter, catch_up=catch_up)
+        self.jobs[name] = job
+        if self._running:
+            job.schedule_after(datetime.now(timezone.utc))
+            self._push(job)
+        return job
+
+    async def start(self):
+        self._running = True
+        # После повторного старта (смена лидера) старые записи кучи не нужны
+        self._heap = []
+        now = datetime.now(timezone.utc)
+        last_runs = await self._load_last_runs()
+
+        for job in self.jobs.values():
+            job.last_run = last_runs.get(job.name)
+            if job.catch_up and job.last_run and job.cron.next_after(job.last_run, job.tz) <= now:
+                logger.info(f"Задача {job.name} пропущена во время простоя — запускаем сейчас")
+                job.next_run = now
+            else:
+                job.schedule_after(now)
+            self._push(job)
+            logger.info(f"Задача {job.name} ({job.cron.expr}, {job.tz.key}): следующий запуск {job.next_run}")
+
+        while self._running:
+            if not self._heap:
+                await self._wait(None)
+                continue
+
+            next_run, _, name = self._heap[0]
+            delay = (next_run - datetime.now(timezone.utc)).total_seconds()
+            if delay > 0:
+                await self._wait(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            job = self.jobs.get(name)
+            if job is None or job.next_run != next_run:
+                continue
+            self._run(job)
+            job.schedule_after(max(datetime.now(timezone.utc), next_run))
+            self._push(job)
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    # ------------------------
+    def _push(self, job: Job):
+        heapq.heappush(self._heap, (job.next_run, id(job), job.name))
+        self._wakeup.set()
+
+    async def _wait(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _run(self, job: Job):
+        if job.running:
+            logger.warning(f"Задача {job.name} еще выполняется — запуск пропущен")
+            return
+        task = asyncio.create_task(self._execute(job, job.next_run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: Job, scheduled_at: datetime):
+        job.running = True
+        started = datetime.now(timezone.utc)
+        job.last_lag = (started - scheduled_at).total_seconds()
+        job.lag_histogram.observe(max(job.last_lag, 0.0))
+        try:
+            await job.func()
+            job.runs += 1
+            # Только успешный запуск: по last_run считаются догоняющий запуск и окна задач
+            job.last_run = started
+            await self._save_last_run(job.name, started)
+        except Exception as e:
+            job.failures += 1
+            job.failures_counter.inc()
+            logger.error(f"Ошибка в задаче {job.name}: {e}", exc_info=True)
+        finally:
+            job.duration_histogram.observe((datetime.now(timezone.utc) - started).total_seconds())
+            job.running = False
+
+    @staticmethod
+    async def _load_last_runs() -> Dict[str, datetime]:
+        try:
+            async with get_db_session() as session:
+                result = await session.execute(select(JobRun.name, JobRun.last_run_at))
+                return dict(result.all())
+        except Exception as e:
+            logger.error(f"Не удалось загрузить историю запусков: {e}")
+            return {}
+
+    @staticmethod
+    async def _save_last_run(name: str, run_at: datetime):
+        try:
+            async with get_db_session() as session:
+                stmt = insert(JobRun).values(name=name, last_run_at=run_at)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[JobRun.name],
+                    set_={"last_run_at": run_at}
+                ))
+        except Exception as e:
+            logger.error(f"Не удалось сохранить время запуска {name}: {e}")
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional
+
+from config import SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_CACHE_SIZE
+
+
+class SubscriptionStatus(NamedTuple):
+    is_active: bool
+    plan_name: Optional[str] = None
+    end_date: Optional[datetime] = None
+    auto_renew: Optional[bool] = None
+
+
+class SubscriptionCache:
+    """
+    TTL + LRU кэш статуса подписки по users.id.
+    Все места, где меняется подписка, должны вызывать invalidate(user_id).
+    on_invalidate (если задан) получает user_id, чтобы сбросить запись и в других воркерах.
+    """
+
+    def __init__(self, maxsize: int = SUBSCRIPTION_CACHE_SIZE, ttl: float = SUBSCRIPTION_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.on_invalidate: Optional[Callable[[int], None]] = None
+
+    def get(self, user_id: int) -> Optional[SubscriptionStatus]:
+        item = self._data.get(user_id)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, status = item
+        # Активная подписка не должна пережить свою end_date даже внутри TTL
+        if expires_at <= time.monotonic() or (
+                status.is_active and status.end_date and status.end_date <= datetime.utcnow()):
+            del self._data[user_id]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return status
+
+    def set(self, user_id: int, status: SubscriptionStatus):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[user_id] = (time.monotonic() + self.ttl, status)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int, publish: bool = True):
+        if user_id is None:
+            return
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return
+        if self._data.pop(user_id, None) is not None:
+            self.invalidations += 1
+        if publish and self.on_invalidate is not None:
+            self.on_invalidate(user_id)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+subscription_cache = SubscriptionCache()
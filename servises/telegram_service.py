@@ -1,6 +1,17 @@
+import asyncio
+import logging
+
 from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
 from aiogram.types import ChatPermissions
 
+from servises.broadcaster import telegram_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Повторы unban после успешного бана: без него пользователь остается забанен в канале навсегда
+UNBAN_RETRIES = 3
+
 
 class TelegramService:
 
@@ -49,6 +60,32 @@ class TelegramService:
             print(f"Ошибка при удалении пользователя из канала: {e}")
             return False
 
+    @staticmethod
+    async def kick_from_channel(bot: Bot, telegram_id: int, channel_id: str):
+        """
+        Удалить из канала без бана навсегда (исключения пробрасываются для Broadcaster).
+        Unban после бана повторяется при RetryAfter и сетевых ошибках, каждый повтор берет токен
+        общего лимитера; если он так и не прошел — ошибка в лог и исключение.
+        """
+        await bot.ban_chat_member(chat_id=channel_id, user_id=telegram_id)
+        for attempt in range(UNBAN_RETRIES + 1):
+            try:
+                if attempt:
+                    await telegram_rate_limiter.acquire()
+                await bot.unban_chat_member(chat_id=channel_id, user_id=telegram_id, only_if_banned=True)
+                return
+            except TelegramRetryAfter as e:
+                error = e
+                telegram_rate_limiter.pause(e.retry_after)
+            except TelegramNetworkError as e:
+                error = e
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                error = e
+                break
+        logger.error(f"Пользователь {telegram_id} забанен в {channel_id}, но unban не прошел: {error}")
+        raise error
+
     @staticmethod
     async def unban_from_channel(bot: Bot, telegram_id: int, channel_id: str):
         await bot.unban_chat_member(
@@ -0,0 +1,192 @@
+import asyncio
+import copy
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# (state, data)
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище в таблице fsm_states.
+
+    Чтения идут из in-process LRU-кэша (в БД — только при промахе),
+    записи сразу попадают в кэш и сбрасываются в БД пачкой раз в flush_interval секунд
+    (write-behind). Несброшенные записи из кэша не вытесняются, close() сбрасывает остаток.
+    on_flush получает ключи, записанные в БД, чтобы другие воркеры сбросили их из своего кэша.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, cache_size: int = 10000,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.on_flush: Optional[Callable[[str], None]] = None
+        self._cache: "OrderedDict[str, Record]" = OrderedDict()
+        self._dirty: set = set()
+        self._flushing: set = set()
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    # ------------------------ BaseStorage
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record_key = self.key_builder.build(key)
+        _, data = await self._get(record_key)
+        self._put(record_key, (state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Data must be a dict, got {type(data).__name__}")
+        record_key = self.key_builder.build(key)
+        state, _ = await self._get(record_key)
+        self._put(record_key, (state, copy.deepcopy(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(self.key_builder.build(key))
+        return copy.deepcopy(data)
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    # ------------------------
+    def forget(self, record_key: str):
+        """Сбросить запись из кэша (изменена другим воркером); несброшенные свои изменения не трогаем"""
+        if record_key not in self._dirty and record_key not in self._flushing:
+            self._cache.pop(record_key, None)
+
+    def forget_all(self):
+        """Сбросить все записи, кроме несброшенных своих изменений (пропущены инвалидации)"""
+        for record_key in list(self._cache):
+            self.forget(record_key)
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        async with self._lock:
+            if not self._dirty:
+                return
+            keys, self._dirty = self._dirty, set()
+            self._flushing = keys
+            records = {key: self._cache[key] for key in keys if key in self._cache}
+            try:
+                await self._write(records)
+            except Exception as e:
+                # Вернем ключи в очередь, если за это время их не перезаписали снова
+                self._dirty |= keys
+                self.flush_errors += 1
+                logger.error(f"Ошибка записи FSM-состояний ({len(keys)}): {e}")
+                return
+            finally:
+                self._flushing = set()
+            self.flushes += 1
+
+        if self.on_flush is not None:
+            for key in records:
+                self.on_flush(key)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+    # ------------------------
+    async def _get(self, record_key: str) -> Record:
+        record = self._cache.get(record_key)
+        if record is not None:
+            self._cache.move_to_end(record_key)
+            self.hits += 1
+            return record
+
+        self.misses += 1
+        record = await self._read(record_key)
+        # Пока читали, запись могла появиться локально — она новее
+        if record_key not in self._cache:
+            self._cache[record_key] = record
+            self._evict()
+        return self._cache[record_key]
+
+    def _put(self, record_key: str, record: Record):
+        self._cache[record_key] = record
+        self._cache.move_to_end(record_key)
+        self._dirty.add(record_key)
+        self._evict()
+        self._ensure_flusher()
+
+    def _evict(self):
+        if len(self._cache) <= self.cache_size:
+            return
+        for record_key in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if record_key not in self._dirty and record_key not in self._flushing:
+                del self._cache[record_key]
+
+    def _ensure_flusher(self):
+        if self._flusher is None and not self._closed:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    @staticmethod
+    async def _read(record_key: str) -> Record:
+        # Импорт здесь: хранилище создается в config.py раньше, чем database.session
+        from database.models import FsmState
+        from database.session import get_db_session
+
+        async with get_db_session() as session:
+            row = await session.get(FsmState, record_key)
+            if row is None:
+                return None, {}
+            return row.state, dict(row.data or {})
+
+    @staticmethod
+    async def _write(records: Dict[str, Record]):
+        from sqlalchemy import delete, func
+        from sqlalchemy.dialects.postgresql import insert
+
+        from database.models import FsmState
+        from database.session import get_db_session
+
+        # Пустое состояние без данных — строку удаляем, чтобы таблица не росла
+        empty = [key for key, (state, data) in records.items() if state is None and not data]
+        rows = [{"key": key, "state": state, "data": data}
+                for key, (state, data) in records.items() if key not in empty]
+
+        async with get_db_session() as session:
+            if empty:
+                await session.execute(delete(FsmState).where(FsmState.key.in_(empty)))
+            if rows:
+                stmt = insert(FsmState).values(rows)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[FsmState.key],
+                    set_={"state": stmt.excluded.state, "data": stmt.excluded.data,
+                          "updated_at": func.now()}
+                ))